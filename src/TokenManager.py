@@ -1,36 +1,110 @@
+import hashlib
+import json
+import os
+import threading
 import time
 
-import requests
-
+from defines import CACHE_FOLDER
+from filesystem import file_lock
+from graph import get_graph_client
 from secret import read_secret
 
+# Seconds before expiry when a token is considered stale and refreshed
+TOKEN_REFRESH_MARGIN = 300
+
 
 class TokenManager:
-    def __init__(self, tenant_id, client_id, client_secret, scope="https://graph.microsoft.com/.default"):
+    """
+    Client-credentials token for Graph.
+
+    The token is kept in a file of the cache folder readable only by its owner, so every run on the same machine reuses
+    it until it is about to expire. A lock file makes a single process (and a single thread) request a new token while
+    the others wait for it and read it from the file.
+    """
+
+    def __init__(self, tenant_id, client_id, client_secret, scope="https://graph.microsoft.com/.default",
+                 cache_path=None):
         self.token_url = f"https://login.microsoftonline.com/{tenant_id}/oauth2/v2.0/token"
         self.client_id = client_id
         self.client_secret = client_secret
         self.scope = scope
         self.access_token = None
         self.expires_at = 0  # Unix timestamp
+        if cache_path is None:
+            cache_id = hashlib.sha256(f"{tenant_id}/{client_id}/{scope}".encode("utf-8")).hexdigest()[:16]
+            cache_path = os.path.join(CACHE_FOLDER, f"token_{cache_id}.json")
+        self.cache_path = cache_path
+        self.lock = threading.Lock()
+        self.refresh_thread = None
+        self.refresh_thread_lock = threading.Lock()
+
+    def is_fresh(self, margin=TOKEN_REFRESH_MARGIN) -> bool:
+        return self.access_token is not None and time.time() < self.expires_at - margin  # >5min left by default
 
     def get_token(self):
-        if self.access_token is None or time.time() >= self.expires_at - 300:  # Refresh if <5min left
-            self._refresh_token()
+        if not self.is_fresh():
+            with self.lock:
+                if not self.is_fresh():  # Another thread may have refreshed it while this one waited
+                    self._refresh_token()
         return self.access_token
 
-    def _refresh_token(self):
-        token_data = {
-            'grant_type': 'client_credentials',
-            'client_id': self.client_id,
-            'client_secret': self.client_secret,
-            'scope': 'https://graph.microsoft.com/.default',
-        }
-        response = requests.post(self.token_url, data=token_data)
-        response.raise_for_status()
-        token_data = response.json()
-        self.access_token = token_data['access_token']
-        self.expires_at = time.time() + token_data['expires_in']
+    def _load_cached_token(self):
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+            self.access_token = cached["access_token"]
+            self.expires_at = cached["expires_at"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def _save_cached_token(self):
+        temporary_path = self.cache_path + "." + str(os.getpid()) + ".tmp"
+        # Created with owner-only permissions from the start, the token is never readable by other users
+        fd = os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"access_token": self.access_token, "expires_at": self.expires_at}, f)
+        os.replace(temporary_path, self.cache_path)
+
+    def _refresh_token(self, margin=TOKEN_REFRESH_MARGIN):
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        with file_lock(self.cache_path + ".lock"):
+            self._load_cached_token()
+            if self.is_fresh(margin):  # Refreshed by another process
+                return
+            token_data = {
+                'grant_type': 'client_credentials',
+                'client_id': self.client_id,
+                'client_secret': self.client_secret,
+                'scope': self.scope,
+            }
+            response = get_graph_client().post(self.token_url, data=token_data)
+            response.raise_for_status()
+            token_data = response.json()
+            self.access_token = token_data['access_token']
+            self.expires_at = time.time() + token_data['expires_in']
+            self._save_cached_token()
+
+    def _refresh_periodically(self):
+        # Refreshed a bit before get_token would consider it stale, so no request ever waits for a refresh
+        margin = TOKEN_REFRESH_MARGIN + 120
+        while True:
+            time.sleep(max(1.0, self.expires_at - margin - time.time()))
+            try:
+                with self.lock:
+                    if not self.is_fresh(margin):
+                        self._refresh_token(margin)
+            except Exception:
+                time.sleep(30)  # get_token will refresh it on demand if this keeps failing
+
+    def start_background_refresh(self):
+        """For long-running processes: keeps the token fresh from a daemon thread."""
+        # Not self.lock, which get_token takes
+        with self.refresh_thread_lock:
+            if self.refresh_thread is None:
+                self.get_token()
+                self.refresh_thread = threading.Thread(target=self._refresh_periodically, name="token-refresh",
+                                                       daemon=True)
+                self.refresh_thread.start()
 
 
 def _create_token_manager():
@@ -42,6 +116,11 @@ def _create_token_manager():
 
 def get_token_manager():
     if not hasattr(get_token_manager, "_instance"):
-        # create and store the singleton instance the first time
-        get_token_manager._instance = _create_token_manager()
+        with get_token_manager._lock:
+            if not hasattr(get_token_manager, "_instance"):
+                # create and store the singleton instance the first time
+                get_token_manager._instance = _create_token_manager()
     return get_token_manager._instance
+
+
+get_token_manager._lock = threading.Lock()
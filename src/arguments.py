@@ -13,9 +13,11 @@ from NAF import is_naf_present, build_naf_to_dni, parse_naf
 from custom_except import *
 from defines import DocType, from_string, ROOT_FOLDER
 from secret import read_secret
-from sharepoint import get_parameters_from_list, get_author_email
+from sharepoint import get_parameters_from_list, get_author_email, DOWNLOAD_MODES
+from sharepoint_async import is_async_available
 from DNI import parse_dni
 from Name import parse_name_sharepoint, parse_name_a3
+from pdf_backend import BACKENDS, PYPDF_BACKEND, parse_pdf_backend
 
 
 def get_compact_init():
@@ -110,6 +112,13 @@ def parse_boolean(value):
     raise ValueError("The value " + str(value) + " can not be parsed into a boolean. It should be 'True' or 'False'")
 
 
+def parse_async_graph(value):
+    enabled = parse_boolean(value)
+    if enabled and not is_async_available():
+        raise ValueError("The asyncio transfers need the aiohttp package.")
+    return enabled
+
+
 def parse_input_type(value):
     if value == "sharepoint":
         return value
@@ -141,9 +150,8 @@ def parse_input_location(value):
     return value
 
 
-def parse_arguments():
-    """Parse and validate command-line arguments"""
-    parser = argparse.ArgumentParser(description="Justicier")
+def build_argument_parser(description="Justicier"):
+    parser = argparse.ArgumentParser(description=description)
 
     parser.add_argument("-r", "--request", "--id", type=parse_id, required=False,
                         help='ID of the justification request in Microsoft List of Peticions Justificacions. If you use'
@@ -170,6 +178,20 @@ def parse_arguments():
     parser.add_argument("-a", "--author", type=parse_author, required=False, help="author's email doing"
                                                                                   " request")
 
+    parser.add_argument("-D", "--download-mode", choices=DOWNLOAD_MODES, required=False, default="full",
+                        help="How the input is obtained from SharePoint. \"full\" (default) downloads the whole input "
+                             "folder again; \"delta\" only transfers the files added, changed or deleted since the "
+                             "last run on this machine; \"planned\" only downloads the files that can affect the justified period.")
+    parser.add_argument("--download-workers", type=int, required=False, default=8,
+                        help="Number of files downloaded from SharePoint at the same time.")
+    parser.add_argument("--upload-workers", type=int, required=False, default=8,
+                        help="Number of result files uploaded to SharePoint at the same time.")
+    parser.add_argument("--async-graph", type=parse_async_graph, required=False, default=False,
+                        help="Download the input and upload the results with the asyncio client of Graph, keeping "
+                             "all the transfers in flight from a single thread. Needs the aiohttp package.")
+    parser.add_argument("--graph-concurrency", type=int, required=False, default=16,
+                        help="Maximum number of requests to Microsoft Graph in flight at the same time. Throttled "
+                             "requests are retried after the wait asked by Graph.")
     parser.add_argument("-s", "--merge-salary", type=parse_boolean, required=False, default=False,
                         help="Merge each salary with the corresponding bank proof")
     parser.add_argument("-m", "--merge-result", type=parse_boolean, required=False,
@@ -179,13 +201,47 @@ def parse_arguments():
                              ",".join([dt.value.__str__() for dt in DocType]))
     parser.add_argument("-R", "--merge-rnt-rlc", type=parse_boolean, required=False, default=False,
                         help="Merge all RLCs and RNTs of each month.")
+    parser.add_argument("-c", "--page-cache", type=parse_boolean, required=False, default=True,
+                        help="Use the persistent cache of the text of PDF pages. Use \"False\" to always extract the "
+                             "text from the PDFs. The cache can be warmed or purged with src/page_cache.py.")
+    parser.add_argument("-i", "--identifier-index", type=parse_boolean, required=False, default=True,
+                        help="Use the index of NAFs and DNIs found in each page of the input PDFs instead of scanning "
+                             "the PDFs of salaries, RNTs and bank proofs on each request.")
+    parser.add_argument("-w", "--workers", type=int, required=False, default=1,
+                        help="Number of processes used to extract the text of PDF pages. Files and page ranges of "
+                             "big files are distributed between them. With 1 (default) pages are scanned sequentially.")
+    parser.add_argument("--stage-workers", type=int, required=False, default=4,
+                        help="Number of stages of the justification (salaries and RLCs, bank proofs, contracts, RNTs "
+                             "and their merges) run at the same time. With 1 they run one after the other.")
+    parser.add_argument("-P", "--prefilter", type=parse_boolean, required=False, default=False,
+                        help="Skip the text extraction of the pages whose raw content does not contain the digits of "
+                             "the searched NAF or DNI. Only used for files that are not in the page cache. Check it "
+                             "against your input with src/verify_prefilter.py before enabling it.")
+    parser.add_argument("--max-open-readers", type=int, required=False, default=64,
+                        help="Maximum number of input PDFs kept open at once when several justifications share them "
+                             "(batch mode). Lower it to reduce memory usage.")
+    parser.add_argument("--pdf-backend", type=parse_pdf_backend, required=False, default=PYPDF_BACKEND,
+                        help="Engine used to read and write PDFs. Possible values are: " +
+                             ",".join(BACKENDS.keys()) + ". \"pymupdf\" is faster but needs the PyMuPDF package. "
+                             "Compare them with src/benchmark_backends.py.")
+
+    return parser
+
+
+def parse_arguments(argv=None):
+    """Parse and validate command-line arguments"""
+    parser = build_argument_parser()
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     return args
 
 
-def parse_sharepoint_arguments(args, common):
+def parse_sharepoint_arguments(args, common, config=None):
+    """
+    Replaces the arguments by the configuration of the request in the Microsoft List. config, if given, is that
+    configuration already read from the list (by the poller) and the list is not asked again.
+    """
     if args.naf:
         parse_arguments_helper("NAF")
     if args.name:
@@ -205,7 +261,8 @@ def parse_sharepoint_arguments(args, common):
     if args.merge_rnt_rlc:
         parse_arguments_helper("merge rlc")
 
-    config = expand_job_id(args.request)
+    if config is None:
+        config = expand_job_id(args.request)
 
     print("configuration from sharepoint: " + str(config))
     try:
@@ -274,9 +331,17 @@ def process_parse_arguments():
         print(common)
         exit(5)
 
+    return complete_parsed_arguments(args, common)
+
+
+def complete_parsed_arguments(args, common, config=None):
+    """
+    Expands the request ID from the Microsoft List (if any, with its configuration if already read) and normalizes
+    the dates of already parsed arguments.
+    """
     # Manual validation of inputs from sharepoint list
     if args.request:
-        parse_sharepoint_arguments(args, common)
+        parse_sharepoint_arguments(args, common, config)
 
     if args.input_location:
         args.location = "local"
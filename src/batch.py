@@ -0,0 +1,150 @@
+import argparse
+import copy
+import sys
+import time
+
+from NAF import parse_naf
+from TokenManager import get_token_manager
+from arguments import parse_arguments, complete_parsed_arguments, parse_id
+from chrono import elapsed_time
+from identifier_index import get_identifier_index
+from job_context import input_folder_lock
+from manifest import refresh_manifest
+from logger import build_process_logger, get_console_logger, set_logger
+from mail import mail_process
+from main import process, apply_performance_arguments
+from pdf import share_readers, shutdown_scan_pool
+from secret import read_secret
+from sharepoint import fetch_input_folder, get_site_id, get_drive_id, update_list_item_field, \
+    flush_list_item_updates, get_list_item_updates
+
+
+def parse_batch_arguments(argv=None):
+    """
+    Parses the employees of the batch and the arguments shared by all of them. Returns a list with the arguments of
+    each justification, in the same format that main.process expects.
+    """
+    parser = argparse.ArgumentParser(description="Justicier batch mode",
+                                     epilog="Any other argument of src/main.py (begin and end dates, author, merge "
+                                            "options, input location...) is also accepted and applies to all the "
+                                            "justifications of the batch.")
+    parser.add_argument("--nafs", type=parse_naf, nargs="+", default=[],
+                        help="NAFs of the employees to justify with the same dates and options.")
+    parser.add_argument("--requests", "--ids", type=parse_id, nargs="+", default=[],
+                        help="IDs of justification requests in the Microsoft List. Each request uses its own dates "
+                             "and options.")
+    batch_args, remaining = parser.parse_known_args(argv)
+    if len(batch_args.nafs) == 0 and len(batch_args.requests) == 0:
+        parser.error("At least one NAF (--nafs) or request ID (--requests) is needed.")
+
+    template = parse_arguments(remaining)
+    if len(batch_args.nafs) > 0 and (template.begin is None or template.end is None or template.author is None):
+        parser.error("--begin, --end and --author are required when justifying a list of NAFs.")
+
+    common = ("Error parsing arguments of the batch. Program aborting. The arguments are: " + str(sys.argv))
+    jobs = []
+    for naf in batch_args.nafs:
+        args = copy.deepcopy(template)
+        args.naf = naf
+        args.request = None
+        jobs.append(complete_parsed_arguments(args, common))
+    for request in batch_args.requests:
+        args = copy.deepcopy(template)
+        args.request = request
+        jobs.append(complete_parsed_arguments(args, common))
+    return jobs
+
+
+def fetch_batch_input_folder(input_folder, download_mode, begin=None, end=None):
+    token_manager = get_token_manager()
+    site_id = get_site_id(token_manager, read_secret('SHAREPOINT_DOMAIN'), read_secret('SITE_NAME'))
+    drive_id = get_drive_id(token_manager, site_id, drive_name="Documents")
+    fetch_input_folder(token_manager, drive_id, read_secret("SHAREPOINT_FOLDER_INPUT"), input_folder, download_mode,
+                       begin=begin, end=end)
+
+
+def process_batch(jobs, INPUT_FOLDER):
+    """
+    Justifies several employees with a single pass over the input data: the input is fetched and indexed once, each
+    input PDF is opened once and its pages are shared by all the justifications that need them. Reports, uploads and
+    list updates are still done for each justification.
+    """
+    console_logger = get_console_logger()
+    set_logger(console_logger)
+    logger = build_process_logger(console_logger, "Batch")
+
+    start_time = time.time()
+    # Other processes may be fetching or reading the same input folder
+    with input_folder_lock(INPUT_FOLDER):
+        if any(args.location == "sharepoint" for args in jobs):
+            # A planned fetch covers the periods of all the justifications, of any employee
+            fetch_batch_input_folder(INPUT_FOLDER, jobs[0].download_mode, min(args.begin for args in jobs),
+                                     max(args.end for args in jobs))
+        refresh_manifest(INPUT_FOLDER)
+        identifier_index = get_identifier_index()
+        if identifier_index is not None:
+            identifier_index.build(INPUT_FOLDER)
+    logger.info(f"Time elapsed for obtaining and indexing input data: {elapsed_time(start_time)}.")
+
+    results = []
+    share_readers(True)
+    try:
+        for i, args in enumerate(jobs):
+            job_name = f"request {str(args.request)}" if args.request else f"NAF {str(args.naf)}"
+            logger.info(f"[{str(i + 1)}/{str(len(jobs))}] Justifying {job_name}.")
+            start_time = time.time()
+            try:
+                link, log_link = process(args, INPUT_FOLDER, prepare_input=False)
+            except Exception as e:
+                logger.error(f"Justification of {job_name} failed. Continuing with the next one. Error is: {str(e)}")
+                if args.request:
+                    try:
+                        # A job whose stages failed already queued its error state, with the message of the stage
+                        if get_list_item_updates().get_pending(args.request).get("Estatworkflow") != "Error":
+                            update_list_item_field(args.request, {"Estatworkflow": "Error", "Missatge_x0020_error":
+                                                                  f"A not controlled error happen during execution "
+                                                                  f"of Justicier. Error is: {str(e)}"})
+                        flush_list_item_updates()
+                    except Exception as update_error:
+                        logger.error(f"Error state of {job_name} could not be sent to the list. Error is: "
+                                     f"{str(update_error)}")
+                results.append((job_name, None, e))
+                continue
+
+            logger.info(f"Justification of {job_name} finished in {elapsed_time(start_time)}: {link}")
+            if args.request:
+                mail_process(link, log_link, args)
+            results.append((job_name, link, None))
+    finally:
+        share_readers(False)
+    return results
+
+
+def main():
+    jobs = parse_batch_arguments()
+    apply_performance_arguments(jobs[0])
+    if any(args.location == "sharepoint" or args.request for args in jobs):
+        # A batch can outlive a token, keep it fresh instead of refreshing it in the middle of a justification
+        get_token_manager().start_background_refresh()
+
+    INPUT_FOLDER = jobs[0].input_location
+
+    try:
+        results = process_batch(jobs, INPUT_FOLDER)
+    finally:
+        shutdown_scan_pool()
+
+    print("Batch justification is finished.")
+    failed = 0
+    for job_name, link, error in results:
+        if error is None:
+            print(f"✅ {job_name}: {link}")
+        else:
+            print(f"❌ {job_name}: {str(error)}")
+            failed += 1
+    if failed > 0:
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
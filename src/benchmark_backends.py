@@ -0,0 +1,112 @@
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime
+
+import main
+from DNI import parse_dni
+from NAF import build_naf_to_dni, parse_naf
+from defines import ROOT_FOLDER, SALARIES_OUTPUT_NAME, PROOFS_OUTPUT_NAME, CONTRACTS_OUTPUT_NAME, RNTS_OUTPUT_NAME, \
+    RLCS_OUTPUT_NAME
+from identifier_index import set_identifier_index
+from logger import get_console_logger, set_logger
+from page_cache import list_pdfs, set_page_cache
+from pdf import compact_folder, output_assembler
+from pdf_backend import get_available_backends, parse_pdf_backend, set_pdf_backend, PypdfBackend
+
+OUTPUT_FOLDERS = [SALARIES_OUTPUT_NAME, PROOFS_OUTPUT_NAME, CONTRACTS_OUTPUT_NAME, RNTS_OUTPUT_NAME, RLCS_OUTPUT_NAME]
+
+
+def run_justification(input_folder, output_folder, naf, begin, end, naf_to_dni):
+    """Runs the document stages of a justification and merges each type of document, without any upload."""
+    for folder_name in OUTPUT_FOLDERS:
+        os.makedirs(os.path.join(output_folder, folder_name), exist_ok=True)
+    main.process_salaries_with_rlc(os.path.join(input_folder, "_salaries"), os.path.join(input_folder, "_RLC"),
+                                   output_folder, naf, begin, end)
+    main.process_proofs(os.path.join(input_folder, "_proofs"), os.path.join(output_folder, PROOFS_OUTPUT_NAME), naf,
+                        begin, end, naf_to_dni)
+    main.process_contracts(os.path.join(input_folder, "_contracts"), output_folder, naf, begin, end)
+    main.process_RNTs(os.path.join(input_folder, "_RNT"), output_folder, naf, begin, end)
+    for folder_name in OUTPUT_FOLDERS:
+        compact_folder(os.path.join(output_folder, folder_name))
+
+
+def read_output_texts(output_folder):
+    """Text of each page of each output PDF, always extracted with pypdf so the outputs of all backends compare."""
+    reader = PypdfBackend()
+    texts = {}
+    for pdf_path in list_pdfs(output_folder):
+        document = reader.open(pdf_path)
+        texts[os.path.relpath(pdf_path, output_folder)] = [" ".join(reader.page_text(page).split())
+                                                          for page in reader.pages(document)]
+    return texts
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description="Run the same justification with each PDF backend and compare their "
+                                                 "wall time and their output")
+    parser.add_argument("-n", "--naf", type=parse_naf, required=True, help="NAF of the employee to justify.")
+    parser.add_argument("-b", "--begin", type=lambda s: datetime.strptime(s, "%Y-%m-%d"), required=True,
+                        help="Begin date (YYYY-MM-DD)")
+    parser.add_argument("-e", "--end", type=lambda s: datetime.strptime(s, "%Y-%m-%d"), required=True,
+                        help="End date (YYYY-MM-DD)")
+    parser.add_argument("-d", "--dni", type=parse_dni, required=False,
+                        help="DNI of the employee. By default it is read from NAF_DNI.xlsx of the input folder.")
+    parser.add_argument("-L", "--input-location", default=os.path.join(ROOT_FOLDER, "input"),
+                        help="Input folder (default: ./input).")
+    parser.add_argument("--backends", type=parse_pdf_backend, nargs="+", default=get_available_backends(),
+                        help="Backends to compare (default: all the installed ones).")
+    parser.add_argument("-r", "--repeat", type=int, default=1, help="Runs of each backend. The best time is kept.")
+    args = parser.parse_args()
+
+    end = args.end.replace(hour=23, minute=59)
+    if args.dni is not None:
+        naf_to_dni = {args.naf: args.dni}
+    else:
+        naf_to_dni = build_naf_to_dni(os.path.join(args.input_location, "NAF_DNI.xlsx"))
+
+    console_logger = get_console_logger()
+    set_logger(console_logger)
+    # Measure the backends themselves, not the caches
+    set_page_cache(None)
+    set_identifier_index(None)
+
+    work_folder = tempfile.mkdtemp(prefix="justicier_benchmark_")
+    timings = {}
+    outputs = {}
+    try:
+        for backend in args.backends:
+            set_pdf_backend(backend)
+            best = None
+            for _ in range(max(1, args.repeat)):
+                output_folder = os.path.join(work_folder, backend)
+                shutil.rmtree(output_folder, ignore_errors=True)
+                start_time = time.time()
+                run_justification(args.input_location, output_folder, args.naf, args.begin, end, naf_to_dni)
+                seconds = time.time() - start_time
+                output_assembler.clear()
+                if best is None or seconds < best:
+                    best = seconds
+            timings[backend] = best
+            outputs[backend] = read_output_texts(os.path.join(work_folder, backend))
+            print(f"{backend}: {best:.2f} s")
+    finally:
+        shutil.rmtree(work_folder, ignore_errors=True)
+
+    reference = args.backends[0]
+    equivalent = True
+    for backend in args.backends[1:]:
+        print(f"{backend} is {timings[reference] / timings[backend]:.2f}x faster than {reference}.")
+        for file_name in sorted(set(outputs[reference]) | set(outputs[backend])):
+            if outputs[reference].get(file_name) != outputs[backend].get(file_name):
+                equivalent = False
+                print(f"❌ {file_name} is different between {reference} and {backend}.")
+    if not equivalent:
+        exit(1)
+    print(f"✅ All the backends produce the same {str(len(outputs[reference]))} documents.")
+
+
+if __name__ == "__main__":
+    main_benchmark()
@@ -22,3 +22,7 @@ class UndefinedRegularSalaryType(Exception):
 class UndefinedInputType(Exception):
     pass
 
+
+
+class DeltaLinkExpired(Exception):
+    pass
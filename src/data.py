@@ -9,6 +9,10 @@ import logger
 from defines import SalaryType
 
 
+SPANISH_MONTHS = {"Enero": 1, "Febrero": 2, "Marzo": 3, "Abril": 4, "Mayo": 5, "Junio": 6, "Julio": 7, "Agosto": 8,
+                  "Septiembre": 9, "Octubre": 10, "Noviembre": 11, "Diciembre": 12}
+
+
 def get_rlc_monthly_result_structure(begin: datetime, end: datetime, result_structure=None) -> Dict[str, List[bool]]:
     print("get_rlc_monthly_result_structure params:")
     print(begin)
@@ -104,6 +108,11 @@ def parse_date_from_salary_filename(salary_path):
     return datetime.strptime("20" + salary_path[::-1].split("/")[0][::-1].split(".")[0].split("_")[0], "%Y%m")
 
 
+def parse_spanish_date(day: str, month_name: str, year: str) -> datetime:
+    """Parses dates written as in the salaries, e.g. "1 Enero 2024", without depending on the Spanish locale."""
+    return datetime(int(year), SPANISH_MONTHS[month_name], int(day))
+
+
 def parse_salary_filename_from_salary_path(salary_path):
     return os.path.basename(salary_path)
 
@@ -8,8 +8,21 @@ ROOT_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 GENERAL_OUTPUT_FOLDER: str = os.path.join(ROOT_FOLDER, "output")
 
 # Admin logs
-ADMIN_LOG_FOLDER = os.path.join(GENERAL_OUTPUT_FOLDER, "_admin_logs")
-SUPERVISOR_LOG_FOLDER = os.path.join(GENERAL_OUTPUT_FOLDER, "_supervisor_logs")
+ADMIN_LOG_FOLDER_NAME = "_admin_logs"
+SUPERVISOR_LOG_FOLDER_NAME = "_supervisor_logs"
+ADMIN_LOG_FOLDER = os.path.join(GENERAL_OUTPUT_FOLDER, ADMIN_LOG_FOLDER_NAME)
+SUPERVISOR_LOG_FOLDER = os.path.join(GENERAL_OUTPUT_FOLDER, SUPERVISOR_LOG_FOLDER_NAME)
+
+# Persistent caches shared between runs
+CACHE_FOLDER = os.path.join(GENERAL_OUTPUT_FOLDER, "_cache")
+
+# Justifications waiting for the worker (src/worker.py), one JSON file each
+WORKER_QUEUE_FOLDER = os.path.join(GENERAL_OUTPUT_FOLDER, "_queue")
+
+# Identifiers as printed in the input documents: NAF in salaries, NAF in RNTs and DNI / NIE in bank proofs
+NAF_PATTERN = r"\d{2}/\d{8}-\d{2}"
+NAF_RNT_PATTERN = r"\d{12}"
+DNI_PATTERN = "[A-Z]\\d{7}[A-Z]|\\d{8}[A-Z]"
 
 SALARIES_OUTPUT_NAME = "Nòmines"
 PROOFS_OUTPUT_NAME = "Justificants"
@@ -1,7 +1,13 @@
 import os
 import shutil
+from contextlib import contextmanager
 
-from defines import GENERAL_OUTPUT_FOLDER, ADMIN_LOG_FOLDER, SUPERVISOR_LOG_FOLDER, SALARIES_OUTPUT_NAME, \
+try:
+    import fcntl  # Only on POSIX. Without it, the processes do not wait for each other
+except ImportError:
+    fcntl = None
+
+from defines import GENERAL_OUTPUT_FOLDER, ADMIN_LOG_FOLDER_NAME, SUPERVISOR_LOG_FOLDER_NAME, SALARIES_OUTPUT_NAME, \
     PROOFS_OUTPUT_NAME, CONTRACTS_OUTPUT_NAME, RNTS_OUTPUT_NAME, RLCS_OUTPUT_NAME, SALARIES_AND_PROOFS_OUTPUT_NAME
 
 
@@ -33,6 +39,23 @@ def read_env_var(var_name):
     return value
 
 
+@contextmanager
+def file_lock(lock_path, shared=False):
+    """
+    Exclusive lock between processes, held while the context is open. The lock file is created if needed. Shared
+    locks can be held by several holders at the same time, but not together with an exclusive one. Each holder opens
+    the file itself, so the lock also works between threads.
+    """
+    with open(lock_path, "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
 def read_file_content(file_path):
     content = read_file(file_path)
     # Check if the file is empty or contains only whitespace
@@ -120,16 +143,16 @@ def compute_impersonal_id(now, args, naf_to_name):
             args.begin.strftime("%Y-%m-%d") + "_" + args.end.strftime("%Y-%m-%d") + id_str)
 
 
-def compute_paths(args, id_str, impersonal_id_str):
+def compute_paths(args, id_str, impersonal_id_str, output_root=GENERAL_OUTPUT_FOLDER):
     log_filename = id_str + ".log.txt"
     log_filename_impersonal = impersonal_id_str + ".log.txt"
 
     # Admin logs
-    ADMIN_LOG_PATH = os.path.join(ADMIN_LOG_FOLDER, log_filename)
-    SUPERVISOR_LOG_PATH = os.path.join(SUPERVISOR_LOG_FOLDER, log_filename)
+    ADMIN_LOG_PATH = os.path.join(output_root, ADMIN_LOG_FOLDER_NAME, log_filename)
+    SUPERVISOR_LOG_PATH = os.path.join(output_root, SUPERVISOR_LOG_FOLDER_NAME, log_filename)
 
     # Home folder of the user
-    CURRENT_USER_FOLDER: str = os.path.join(GENERAL_OUTPUT_FOLDER, args.author)
+    CURRENT_USER_FOLDER: str = os.path.join(output_root, args.author)
 
     # Folder for the current justification
     justification_name = impersonal_id_str
@@ -149,12 +172,13 @@ def remove_folder(folder_path):
         print(f"Error removing folder {folder_path}: {e}")
 
 
-def ensure_file_structure(CURRENT_USER_FOLDER, CURRENT_JUSTIFICATION_FOLDER):
-    os.makedirs(GENERAL_OUTPUT_FOLDER, exist_ok=True)
-    ensure_output_gitignore()
+def ensure_file_structure(CURRENT_USER_FOLDER, CURRENT_JUSTIFICATION_FOLDER, output_root=GENERAL_OUTPUT_FOLDER):
+    os.makedirs(output_root, exist_ok=True)
+    if output_root == GENERAL_OUTPUT_FOLDER:
+        ensure_output_gitignore()
 
-    os.makedirs(ADMIN_LOG_FOLDER, exist_ok=True)
-    os.makedirs(SUPERVISOR_LOG_FOLDER, exist_ok=True)
+    os.makedirs(os.path.join(output_root, ADMIN_LOG_FOLDER_NAME), exist_ok=True)
+    os.makedirs(os.path.join(output_root, SUPERVISOR_LOG_FOLDER_NAME), exist_ok=True)
     os.makedirs(CURRENT_USER_FOLDER, exist_ok=True)
 
     os.makedirs(CURRENT_JUSTIFICATION_FOLDER, exist_ok=True)
@@ -0,0 +1,179 @@
+import contextvars
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from logger import build_process_logger, get_logger_instance
+
+# Base URL of Microsoft Graph. Can be pointed to a local stand-in of Graph for testing
+GRAPH_URL = os.environ.get("GRAPH_URL", "https://graph.microsoft.com/v1.0")
+
+# Answers of Graph that mean "try again later": throttling and transient errors of the service
+RETRY_STATUS_CODES = (429, 502, 503, 504)
+GRAPH_MAX_RETRIES = 6
+# Seconds of the first backoff, doubled after each retry up to GRAPH_BACKOFF_MAX
+GRAPH_BACKOFF_BASE = 1.0
+GRAPH_BACKOFF_MAX = 60.0
+# Requests in flight at the same time, counting all the threads
+GRAPH_CONCURRENCY = 16
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait given by a Retry-After header, which holds either seconds or an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def new_graph_counters() -> Dict[str, float]:
+    return {"requests": 0, "retries": 0, "throttled": 0, "server_errors": 0, "connection_errors": 0,
+            "waited_seconds": 0.0}
+
+
+# Counters of the job running in the current context, set by JobContext. Requests are also counted for the process
+job_graph_counters: contextvars.ContextVar = contextvars.ContextVar("graph_counters", default=None)
+
+
+def set_graph_counters(counters: Dict[str, float]) -> contextvars.Token:
+    """Makes the requests done in the current context also count in the given counters, until reset_graph_counters."""
+    return job_graph_counters.set(counters)
+
+
+def reset_graph_counters(token: contextvars.Token):
+    job_graph_counters.reset(token)
+
+
+class GraphClient:
+    """
+    HTTP client for every call to Graph and SharePoint.
+
+    Connections are pooled and shared by all the threads, at most `concurrency` requests are in flight at the same time,
+    and throttled (429) or failed (502, 503, 504, connection errors) requests are retried. The wait before each retry is
+    the Retry-After given by the server or, without it, an exponential backoff with jitter. A 429 makes all the threads
+    wait, since Graph throttles the whole application and not a single request.
+    """
+
+    def __init__(self, concurrency=GRAPH_CONCURRENCY, max_retries=GRAPH_MAX_RETRIES,
+                 backoff_base=GRAPH_BACKOFF_BASE, backoff_max=GRAPH_BACKOFF_MAX):
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.slots = threading.BoundedSemaphore(concurrency)
+        self.lock = threading.Lock()
+        self.paused_until = 0.0
+        self.counters: Dict[str, float] = new_graph_counters()
+
+    def count(self, counter, amount=1):
+        job_counters = job_graph_counters.get()
+        with self.lock:
+            self.counters[counter] += amount
+            if job_counters is not None:
+                job_counters[counter] += amount
+
+    def get_counters(self) -> Dict[str, float]:
+        with self.lock:
+            return dict(self.counters)
+
+    def get_backoff(self, attempt) -> float:
+        backoff = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+        return random.uniform(backoff / 2, backoff)
+
+    def wait(self, seconds):
+        if seconds > 0:
+            self.count("waited_seconds", seconds)
+            time.sleep(seconds)
+
+    def wait_if_paused(self):
+        with self.lock:
+            remaining = self.paused_until - time.time()
+        self.wait(remaining)
+
+    def request(self, method, url, **kwargs) -> requests.Response:
+        """Same as requests.request. Returns the last response when the retries are exhausted."""
+        logger = build_process_logger(get_logger_instance(), "Graph")
+        # A file being streamed as body has to be sent again from the same position
+        data = kwargs.get("data")
+        data_position = data.tell() if hasattr(data, "seek") and hasattr(data, "tell") else None
+        attempt = 0
+        while True:
+            if data_position is not None:
+                data.seek(data_position)
+            self.wait_if_paused()
+            self.count("requests")
+            try:
+                with self.slots:
+                    response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.max_retries:
+                    raise
+                self.count("connection_errors")
+                delay = self.get_backoff(attempt)
+                logger.warning(f"{method} {url} failed ({e}). Retrying in {delay:.1f}s "
+                               f"({str(attempt + 1)}/{str(self.max_retries)}).")
+            else:
+                if response.status_code not in RETRY_STATUS_CODES or attempt >= self.max_retries:
+                    return response
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                delay = retry_after if retry_after is not None else self.get_backoff(attempt)
+                if response.status_code == 429:
+                    self.count("throttled")
+                    with self.lock:
+                        self.paused_until = max(self.paused_until, time.time() + delay)
+                else:
+                    self.count("server_errors")
+                response.close()
+                logger.warning(f"{method} {url} answered {str(response.status_code)}. Retrying in {delay:.1f}s "
+                               f"({str(attempt + 1)}/{str(self.max_retries)}).")
+            self.count("retries")
+            attempt += 1
+            self.wait(delay)
+
+    def get(self, url, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url, **kwargs) -> requests.Response:
+        return self.request("PUT", url, **kwargs)
+
+    def patch(self, url, **kwargs) -> requests.Response:
+        return self.request("PATCH", url, **kwargs)
+
+    def delete(self, url, **kwargs) -> requests.Response:
+        return self.request("DELETE", url, **kwargs)
+
+
+def get_graph_client() -> GraphClient:
+    if not hasattr(get_graph_client, "_instance"):
+        with get_graph_client._lock:
+            if not hasattr(get_graph_client, "_instance"):
+                get_graph_client._instance = GraphClient()
+    return get_graph_client._instance
+
+
+get_graph_client._lock = threading.Lock()
+
+
+def set_graph_concurrency(concurrency: int):
+    """Replaces the shared client by one with another limit of requests in flight."""
+    with get_graph_client._lock:
+        get_graph_client._instance = GraphClient(concurrency=max(1, concurrency))
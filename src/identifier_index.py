@@ -0,0 +1,172 @@
+import os
+import re
+import sqlite3
+from contextlib import closing
+from typing import Dict, List, Optional, Tuple
+
+from defines import CACHE_FOLDER, NAF_PATTERN, NAF_RNT_PATTERN, DNI_PATTERN
+from logger import build_process_logger, get_logger_instance
+from page_cache import list_pdfs
+from pdf import get_page_texts, get_many_page_texts, get_matching_page_nums, get_pages_facts, get_pages, PageFacts
+from pdf_backend import Page, get_pdf_backend
+
+IDENTIFIER_INDEX_FILENAME = "identifier_index.sqlite3"
+# Increased when the tables change. Indexes with an older schema are emptied when opened
+IDENTIFIER_INDEX_SCHEMA_VERSION = 1
+
+# Identifiers recorded for each page
+IDENTIFIER_PATTERNS = [NAF_PATTERN, NAF_RNT_PATTERN, DNI_PATTERN]
+
+# Input folders whose documents are searched by identifier
+INDEXED_FOLDERS = ["_salaries", "_RNT", "_proofs"]
+
+
+class IdentifierIndex:
+    """
+    Inverted index from each identifier found in the input PDFs to the (file, page) where it appears.
+
+    A file is (re)indexed when its size, its mtime or the PDF backend that extracted its text differ from the ones
+    recorded the last time it was indexed, so the index can always be trusted for any path that is asked for.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.compiled_patterns = [(pattern, re.compile(pattern)) for pattern in IDENTIFIER_PATTERNS]
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            if conn.execute("PRAGMA user_version").fetchone()[0] != IDENTIFIER_INDEX_SCHEMA_VERSION:
+                conn.execute("DROP TABLE IF EXISTS identifiers")
+                conn.execute("DROP TABLE IF EXISTS files")
+                conn.execute(f"PRAGMA user_version = {IDENTIFIER_INDEX_SCHEMA_VERSION}")
+            conn.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, "
+                         "backend TEXT)")
+            conn.execute("CREATE TABLE IF NOT EXISTS identifiers (pattern TEXT, value TEXT, path TEXT, "
+                         "page_num INTEGER)")
+            conn.execute("CREATE INDEX IF NOT EXISTS identifiers_value ON identifiers (pattern, value)")
+            conn.execute("CREATE INDEX IF NOT EXISTS identifiers_path ON identifiers (path)")
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def is_indexed(self, path) -> bool:
+        stat = os.stat(path)
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT size, mtime_ns, backend FROM files WHERE path = ?", (path,)).fetchone()
+        return (row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime_ns and
+                row[2] == get_pdf_backend().name)
+
+    def index_file(self, path, texts: Optional[List[str]] = None):
+        stat = os.stat(path)
+        if texts is None:
+            texts = get_page_texts(path)
+        rows = []
+        for page_num, text in enumerate(texts):
+            if not text:
+                continue
+            for pattern, compiled in self.compiled_patterns:
+                for value in set(compiled.findall(text)):
+                    rows.append((pattern, value, path, page_num))
+
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM identifiers WHERE path = ?", (path,))
+            conn.executemany("INSERT INTO identifiers (pattern, value, path, page_num) VALUES (?, ?, ?, ?)", rows)
+            conn.execute("INSERT OR REPLACE INTO files (path, size, mtime_ns, backend) VALUES (?, ?, ?, ?)",
+                         (path, stat.st_size, stat.st_mtime_ns, get_pdf_backend().name))
+
+    def ensure_file(self, path):
+        if not self.is_indexed(path):
+            self.index_file(path)
+
+    def build(self, input_folder):
+        """Indexes every new or modified PDF of the searched input folders and forgets the ones that were removed."""
+        logger = build_process_logger(get_logger_instance(), "Identifier index")
+        input_folder = os.path.abspath(input_folder)
+        seen = set()
+        stale = []
+        for folder_name in INDEXED_FOLDERS:
+            for pdf_path in list_pdfs(os.path.join(input_folder, folder_name)):
+                seen.add(pdf_path)
+                if not self.is_indexed(pdf_path):
+                    stale.append(pdf_path)
+
+        # Extract all the new texts in one go, so they can be spread between the scan workers
+        try:
+            texts = get_many_page_texts(stale)
+        except Exception as e:
+            logger.warning(f"Could not extract the text of all new input files at once. Extracting them one by one. "
+                           f"Error: {e}")
+            texts = {}
+        indexed = 0
+        for pdf_path in stale:
+            try:
+                self.index_file(pdf_path, texts.get(pdf_path))
+                indexed += 1
+            except Exception as e:
+                logger.warning(f"Could not index {pdf_path}. It will be searched when requested. Error: {e}")
+
+        with closing(self._connect()) as conn, conn:
+            known = [row[0] for row in conn.execute("SELECT path FROM files")]
+            removed = [(path,) for path in known
+                       if path.startswith(os.path.join(input_folder, "")) and path not in seen]
+            conn.executemany("DELETE FROM identifiers WHERE path = ?", removed)
+            conn.executemany("DELETE FROM files WHERE path = ?", removed)
+        logger.info(f"Identifier index is up to date: {str(indexed)} files indexed, {str(len(removed))} removed, "
+                    f"{str(len(seen))} files in total.")
+
+    def lookup(self, value: str, pattern: str = NAF_PATTERN) -> Dict[str, List[int]]:
+        """Returns every indexed file where the identifier appears, with the sorted numbers of the matching pages."""
+        result = {}
+        with closing(self._connect()) as conn:
+            for path, page_num in conn.execute("SELECT path, page_num FROM identifiers WHERE pattern = ? AND value = ? "
+                                               "ORDER BY path, page_num", (pattern, value)):
+                result.setdefault(path, []).append(page_num)
+        return result
+
+    def lookup_file(self, path, value: str, pattern: str = NAF_PATTERN) -> List[int]:
+        self.ensure_file(path)
+        with closing(self._connect()) as conn:
+            return [row[0] for row in conn.execute("SELECT page_num FROM identifiers WHERE path = ? AND pattern = ? "
+                                                   "AND value = ? ORDER BY page_num", (path, pattern, value))]
+
+
+def _create_identifier_index():
+    return IdentifierIndex(os.path.join(CACHE_FOLDER, IDENTIFIER_INDEX_FILENAME))
+
+
+def get_identifier_index() -> Optional[IdentifierIndex]:
+    if not hasattr(get_identifier_index, "_instance"):
+        get_identifier_index._instance = _create_identifier_index()
+    return get_identifier_index._instance
+
+
+def set_identifier_index(index: Optional[IdentifierIndex]):
+    """Replaces the shared identifier index. Setting it to None makes the stages scan the PDFs directly."""
+    get_identifier_index._instance = index
+
+
+def find_matching_page_nums(pdf_path, query_string: str, pattern: str = NAF_PATTERN) -> List[int]:
+    """Same result as pdf.get_matching_page_nums, answered from the identifier index when possible."""
+    index = get_identifier_index()
+    if index is None or pattern not in IDENTIFIER_PATTERNS:
+        return get_matching_page_nums(pdf_path, query_string, pattern)
+    return index.lookup_file(os.path.abspath(pdf_path), query_string, pattern)
+
+
+def find_matching_page_facts(pdf_path, query_string: str,
+                             pattern: str = NAF_PATTERN) -> List[Tuple[Page, PageFacts]]:
+    """Matching pages of the PDF together with the facts of each one, see pdf.classify_page_text."""
+    return get_pages_facts(pdf_path, find_matching_page_nums(pdf_path, query_string, pattern))
+
+
+def find_matching_pages(pdf_path, query_string: str, pattern: str = NAF_PATTERN) -> List[Tuple[Page, int]]:
+    """Same result as pdf.get_matching_pages, answered from the identifier index when possible."""
+    return get_pages(pdf_path, find_matching_page_nums(pdf_path, query_string, pattern))
+
+
+def find_matching_page(pdf_path, query_string: str, pattern: str = NAF_PATTERN) -> Page:
+    """Same result as pdf.get_matching_page, answered from the identifier index when possible."""
+    pages = find_matching_pages(pdf_path, query_string, pattern)
+    if len(pages) == 0:
+        raise ValueError("The string " + query_string + " can't be found in the file " + pdf_path)
+    return pages[0][0]
@@ -0,0 +1,116 @@
+import hashlib
+import heapq
+import itertools
+import os
+import threading
+from typing import Dict, List, Optional
+
+from defines import GENERAL_OUTPUT_FOLDER, CACHE_FOLDER
+from filesystem import compute_paths, ensure_file_structure, file_lock
+from graph import new_graph_counters, reset_graph_counters, set_graph_counters
+from logger import build_process_logger, close_logger, get_logger, reset_logger, set_logger
+from pdf import OutputAssembler, reset_output_assembler, set_output_assembler
+from sharepoint import ListItemUpdateBuffer, get_list_item_updates, reset_list_item_updates, set_list_item_updates
+
+# Numbers of the loggers of the jobs of this process. A number is reused once its job ends, so the loggers registered
+# in the logging module do not grow with every job a worker runs
+logger_numbers = itertools.count(1)
+free_logger_numbers: List[int] = []
+logger_numbers_lock = threading.Lock()
+
+
+def acquire_logger_number() -> int:
+    with logger_numbers_lock:
+        if free_logger_numbers:
+            return heapq.heappop(free_logger_numbers)
+        return next(logger_numbers)
+
+
+def release_logger_number(number: int):
+    with logger_numbers_lock:
+        heapq.heappush(free_logger_numbers, number)
+
+
+def input_folder_lock(input_folder, shared=False):
+    """
+    Lock of the input folder, between the threads and processes that use it. Fetching and indexing the input holds it
+    exclusively, so no justification reads the input while it changes, and justifications hold it shared while their
+    stages read the input.
+    """
+    input_id = hashlib.sha256(os.path.abspath(input_folder).encode("utf-8")).hexdigest()[:16]
+    os.makedirs(CACHE_FOLDER, exist_ok=True)
+    return file_lock(os.path.join(CACHE_FOLDER, f"input_{input_id}.lock"), shared)
+
+
+class JobContext:
+    """
+    Everything that belongs to a single justification: its arguments, input and output paths, logger, reports and the
+    assembler of its output PDFs, and the changes of its item of the list of requests.
+
+    While the context is open, the helpers that log or write pages in the current thread use the logger and assembler
+    of this job, so several justifications can run at the same time in the same process without mixing their logs or
+    outputs. Use it as a context manager:
+        with JobContext(args, input_folder) as context:
+            ...
+    """
+
+    def __init__(self, args, input_folder, output_root=GENERAL_OUTPUT_FOLDER):
+        self.args = args
+        self.input_folder = input_folder
+        self.output_root = output_root
+        self.logger_number: Optional[int] = None
+        self.id_str: Optional[str] = None
+        self.impersonal_id_str: Optional[str] = None
+        self.user_folder: Optional[str] = None
+        self.justification_folder: Optional[str] = None
+        self.user_report_file: Optional[str] = None
+        self.admin_log_path: Optional[str] = None
+        self.supervisor_log_path: Optional[str] = None
+        self.logger_instance = None
+        self.logger = None
+        # NAF -> DNI of the registry of employees, read once the input data is ready
+        self.naf_to_dni: Dict = {}
+        self.reports: Dict = {}
+        self.assembler = OutputAssembler()
+        self.list_item_updates = ListItemUpdateBuffer()
+        # Graph requests of this job only, not of the other jobs of the process
+        self.graph_counters: Dict[str, float] = new_graph_counters()
+        self.tokens: List = []
+
+    def __enter__(self):
+        self.tokens.append((reset_output_assembler, set_output_assembler(self.assembler)))
+        self.tokens.append((reset_list_item_updates, set_list_item_updates(self.list_item_updates)))
+        self.tokens.append((reset_graph_counters, set_graph_counters(self.graph_counters)))
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        # Restores the logger, assembler, list buffer and Graph counters that the thread had before the job
+        for reset, token in reversed(self.tokens):
+            reset(token)
+        self.tokens.clear()
+        # Changes not flushed by a failed job are sent by the caller, together with its error state
+        get_list_item_updates().merge(self.list_item_updates.take())
+        if self.logger_instance is not None:
+            close_logger(self.logger_instance)
+            release_logger_number(self.logger_number)
+
+    def input_lock(self, shared=False):
+        """See input_folder_lock."""
+        return input_folder_lock(self.input_folder, shared)
+
+    def open_output(self, id_str, impersonal_id_str):
+        """Creates the output folders of the justification and its log files, and starts logging to them."""
+        self.id_str = id_str
+        self.impersonal_id_str = impersonal_id_str
+        (self.user_folder, self.justification_folder, self.user_report_file, self.admin_log_path,
+         self.supervisor_log_path) = compute_paths(self.args, id_str, impersonal_id_str, self.output_root)
+        ensure_file_structure(self.user_folder, self.justification_folder, self.output_root)
+
+        self.logger_number = acquire_logger_number()
+        self.logger_instance = get_logger(self.user_report_file, self.admin_log_path, self.supervisor_log_path,
+                                          name=f"justicier.job{str(self.logger_number)}", debug_mode=True)
+        self.tokens.append((reset_logger, set_logger(self.logger_instance)))
+        self.logger = build_process_logger(self.logger_instance, "main process")
+
+    def get_output_path(self, name):
+        return os.path.join(self.justification_folder, name)
@@ -1,3 +1,4 @@
+import contextvars
 import logging
 import sys
 
@@ -26,7 +27,9 @@ def unformatted_logger(logger):
 
 
 def get_logger_instance():
-    return base_logger
+    """Logger of the job running in the current context (thread or asyncio task), set by set_logger."""
+    logger_instance = base_logger.get()
+    return logger_instance if logger_instance is not None else logging.getLogger("justicier")
 
 
 def build_process_logger(logger_instance, process_name):
@@ -36,6 +39,8 @@ def build_process_logger(logger_instance, process_name):
 def get_logger(user_report_file, admin_log_file, supervisor_log_file, name="justicier", debug_mode=False):
     logger = logging.getLogger(name)
     logger.setLevel(logging.DEBUG)
+    # Loggers of concurrent jobs are named after each job, none of them writes to the handlers of another one
+    logger.propagate = False
 
     if logger.handlers:
         return logger  # Prevent re-adding handlers
@@ -70,9 +75,44 @@ def get_logger(user_report_file, admin_log_file, supervisor_log_file, name="just
     return logger
 
 
-def set_logger(logger_instance):
-    global base_logger
-    base_logger = logger_instance
+def get_console_logger(name="justicier_console", debug_mode=False):
+    """Logger that only writes to the console, for entry points that run before any job has its own log files."""
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.DEBUG)
+
+    if logger.handlers:
+        return logger
+
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setLevel(logging.DEBUG if debug_mode else logging.INFO)
+    console_handler.setFormatter(ColorFormatter('%(asctime)s - %(process_name)s - %(levelname)s - %(message)s'))
+    logger.addHandler(console_handler)
+    return logger
+
+
+def close_logger(logger):
+    """Closes and detaches all handlers, so the next call to get_logger writes to the log files of a new job."""
+    for handler in list(logger.handlers):
+        handler.close()
+        logger.removeHandler(handler)
+
+
+def set_logger(logger_instance) -> contextvars.Token:
+    """Sets the logger of the current context. Returns a token to restore the previous one with reset_logger."""
+    return base_logger.set(logger_instance)
+
+
+def reset_logger(token: contextvars.Token):
+    base_logger.reset(token)
+
+
+def submit_with_context(pool, fn, *args, **kwargs):
+    """
+    Same as pool.submit, but fn runs in a copy of the context of the caller, so it logs to the logger of the same job.
+    Threads of a pool do not inherit the context of the thread that submits the work.
+    """
+    return pool.submit(contextvars.copy_context().run, fn, *args, **kwargs)
 
 
-base_logger = None  # will be set later by main
+# Set by main for each job. A context variable, so each thread running a job logs to the files of its own job
+base_logger: contextvars.ContextVar = contextvars.ContextVar("base_logger", default=None)
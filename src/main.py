@@ -4,34 +4,43 @@ import os.path
 import sys
 import time
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, List, NamedTuple, Optional, Tuple
 
-import pytz
 
 from NAF import NAF, build_naf_to_dni, build_naf_to_name
 from TokenManager import get_token_manager
-from arguments import parse_date, process_parse_arguments
+from arguments import process_parse_arguments
 from chrono import elapsed_time
 from custom_except import UndefinedRegularSalaryType
-from data import get_rlc_monthly_result_structure, parse_date_from_salary_filename, \
-    parse_salary_filename_from_salary_path, unparse_date, parse_salary_type, unparse_month, unparse_year_month, \
+from data import get_rlc_monthly_result_structure, \
+    parse_salary_filename_from_salary_path, unparse_date, unparse_month, unparse_year_month, \
     unparse_year_month_short
 from defines import *
 from filesystem import *
-from logger import build_process_logger, get_logger, get_logger_instance
-from logger import set_logger
-from pdf import get_matching_page, write_page, parse_dates_from_delayed_salary, is_date_present_in_rlc_delay, \
-    merge_pdfs, compact_folder, parse_regular_salary_type, get_matching_pages, merge_equal_files_from_two_folders
+from job_context import JobContext
+from logger import build_process_logger, get_logger_instance, submit_with_context
+from identifier_index import get_identifier_index, set_identifier_index, find_matching_pages, find_matching_page, \
+    find_matching_page_facts
+from manifest import Manifest, get_manifest, refresh_manifest, SALARY_CATEGORY, PROOF_CATEGORY, RNT_CATEGORY, \
+    CONTRACT_CATEGORY
+from page_cache import set_page_cache
+from graph import set_graph_concurrency
+from sharepoint_async import run_fetch_input_folder, run_upload_folder
+from pdf_backend import set_pdf_backend
+from pdf import write_page, parse_dates_from_delayed_salary, is_date_present_in_rlc_delay, \
+    merge_pdfs, compact_folder, parse_regular_salary_type, merge_equal_files_from_two_folders, \
+    set_scan_workers, shutdown_scan_pool, set_prefilter, set_max_open_readers, release_pdf
 from report import get_end_user_report, get_initial_user_report
 from secret import read_secret
-from sharepoint import download_input_folder, upload_folder_recursive, upload_file, get_site_id, get_drive_id, \
-    update_list_item_field, get_sharepoint_web_url, update_resultat_sharepoint_rest
+from sharepoint import fetch_input_folder, upload_folder_recursive, upload_file, get_site_id, get_drive_id, \
+    update_list_item_field, get_sharepoint_web_url, update_resultat_sharepoint_rest, set_download_workers, \
+    set_upload_workers, flush_list_item_updates
 from mail import send_mail, mail_process
 
-logger = None
-
 
 def process_rlc_aux(salary_date, rlc_folder_path, months_found, rlc_subtype: str, rlc_type: str):
-    proc_logger = build_process_logger(logger, "Salaries and RLCs L00 / L13 aux")
+    proc_logger = build_process_logger(get_logger_instance(), "Salaries and RLCs L00 / L13 aux")
     month = unparse_month(salary_date)
     year = salary_date.year.__str__()
     n_name = month + "_L" + rlc_type + rlc_subtype + "01.pdf"
@@ -56,7 +65,7 @@ def process_rlc_aux(salary_date, rlc_folder_path, months_found, rlc_subtype: str
 def process_generic_rlc(rlc_type, salary_date, salary_file_path, rlc_folder_path, naf_dir, salary_output_path,
                         salaries_found):
     salaries_found[salary_date][0] = True  # Monthly salary is found
-    proc_logger = build_process_logger(logger, "Salaries and RLCs L00 / L13")
+    proc_logger = build_process_logger(get_logger_instance(), "Salaries and RLCs L00 / L13")
     try:
         rlc_n_path = process_rlc_aux(salary_date, rlc_folder_path, salaries_found,
                                      "N", rlc_type)
@@ -74,15 +83,15 @@ def process_generic_rlc(rlc_type, salary_date, salary_file_path, rlc_folder_path
     merge_pdfs(pdf_path_list, os.path.join(naf_dir, RLCS_OUTPUT_NAME, pdf_merged_name))
 
 
-def process_rlc_l03(salary_file_path, salary_page_number, salary_page, salary_date, naf_dir, rlc_folder_path,
+def process_rlc_l03(salary_file_path, salary_page_number, salary_facts, salary_date, naf_dir, rlc_folder_path,
                     salary_output_path, months_found):
-    proc_logger = build_process_logger(logger, "Salaries and RLCs L03")
+    proc_logger = build_process_logger(get_logger_instance(), "Salaries and RLCs L03")
 
     proc_logger.info("Salary file " + salary_file_path + " page " +
                      str(salary_page_number + 1) + " has been selected as delay salary for date " +
                      unparse_date(salary_date))
     try:
-        delay_initial_date, delay_end_date = parse_dates_from_delayed_salary(salary_page)
+        delay_initial_date, delay_end_date = parse_dates_from_delayed_salary(salary_facts)
     except ValueError as exc:
         proc_logger.error("The delay date could not be parsed from the delay salary page. This document will be "
                           "skipped from search. The internal error is " + exc.__str__())
@@ -119,8 +128,11 @@ def process_rlc_l03(salary_file_path, salary_page_number, salary_page, salary_da
         suffix += 1
 
 
-def process_salaries_with_rlc(salaries_folder_path, rlc_folder_path, naf_dir, naf, begin, end):
-    proc_logger = build_process_logger(logger, "Salaries and RLCs")
+def process_salaries_with_rlc(salaries_folder_path, rlc_folder_path, naf_dir, naf, begin, end,
+                              manifest: Optional[Manifest] = None):
+    proc_logger = build_process_logger(get_logger_instance(), "Salaries and RLCs")
+    if manifest is None:
+        manifest = get_manifest(os.path.dirname(salaries_folder_path))
 
     # regular monthly salary, RLC-N, RLC-P
     regular_monthly_salaries_rlcs_found = get_rlc_monthly_result_structure(begin, end)
@@ -129,34 +141,27 @@ def process_salaries_with_rlc(salaries_folder_path, rlc_folder_path, naf_dir, na
     # delay salary, RLC-N, RLC-P
     delay_salaries_rlcs_found = get_rlc_monthly_result_structure(begin, end)
 
-    # List all file names in the _salaries folder, in the ./input folder and remove undesired files
-    salary_files = flatten_dirs(salaries_folder_path)
     # Select all salary sheets that are in range with the date (begin and end date included)
-    salary_files_selected = []
-    for salary_file in salary_files:
-        dir_date = parse_date_from_salary_filename(parse_salary_filename_from_salary_path(salary_file))
-        if begin <= dir_date <= end:
-            salary_files_selected.append(salary_file)
-            proc_logger.info(
-                f"Salary file {salary_file} is selected, because its date is {unparse_date(dir_date, '-')}.")
-        else:
-            proc_logger.debug(
-                f"Salary file {salary_file} is not selected, because its date is {unparse_date(dir_date, '-')}.")
+    salary_entries = manifest.select(SALARY_CATEGORY, begin, end)
+    for salary_entry in salary_entries:
+        proc_logger.info(f"Salary file {salary_entry.relative_path} is selected, because its date is "
+                         f"{unparse_date(salary_entry.period, '-')}.")
 
     # Salaries, RLC L00, RLC L03
     # Write sheets to NAF folder that match the supplied NAF
-    salary_files_selected.sort()
-    for salary_file in salary_files_selected:
-        proc_logger.debug(f"Processing file {salary_file}")
-        salary_file_path = os.path.join(salaries_folder_path, salary_file)
+    for salary_entry in salary_entries:
+        proc_logger.debug(f"Processing file {salary_entry.relative_path}")
+        salary_file_path = salary_entry.path
         salary_file_name = parse_salary_filename_from_salary_path(salary_file_path)
-        salary_date = parse_date_from_salary_filename(salary_file_name)
+        salary_date = salary_entry.period
         salary_output_filename = f"{str(salary_date.year)}{unparse_month(salary_date)}_{salary_file_name.split('_')[1]}"
-        salary_pages = get_matching_pages(salary_file_path, naf.slash_dash_str())
+        salary_pages = find_matching_page_facts(salary_file_path, naf.slash_dash_str())
         if len(salary_pages) == 0:
-            proc_logger.debug(f"NAF {str(naf)} was not detected in PDF {str(salary_file)}. Skipping document.")
+            proc_logger.debug(f"NAF {str(naf)} was not detected in PDF {salary_entry.relative_path}. Skipping "
+                              f"document.")
             continue
-        for salary_page, salary_page_number in salary_pages:
+        for salary_page, salary_facts in salary_pages:
+            salary_page_number = salary_facts.page_num
             salary_output_path = os.path.join(naf_dir, SALARIES_OUTPUT_NAME, salary_output_filename)
 
             index = 2
@@ -173,16 +178,16 @@ def process_salaries_with_rlc(salaries_folder_path, rlc_folder_path, naf_dir, na
                              f"further processing it.")
 
             # Now check if salary_file is delay, so we need to proceed to L03 or regular (L00 or L13) procedure
-            salary_type = parse_salary_type(salary_file_path)
+            salary_type = SalaryType(salary_entry.salary_type)
             if salary_type == SalaryType.DELAY:  # process L03 RLCs
                 delay_salaries_rlcs_found[salary_date][0] = True
-                process_rlc_l03(salary_file_path, salary_page_number, salary_page, salary_date,
+                process_rlc_l03(salary_file_path, salary_page_number, salary_facts, salary_date,
                                 naf_dir, rlc_folder_path, salary_output_path, delay_salaries_rlcs_found)
             elif salary_type == SalaryType.REGULAR:  # process L00 and L13 RLCs
                 proc_logger.info(f"Salary file {salary_file_path} page {str(salary_page_number + 1)} has been selected "
                                  f"as regular salary for date {unparse_date(salary_date)}")
                 try:
-                    regular_salary_type = parse_regular_salary_type(salary_page)
+                    regular_salary_type = parse_regular_salary_type(salary_facts)
                 except UndefinedRegularSalaryType as e:
                     proc_logger.error(f"Salary file {salary_file_path} page {str(salary_page_number + 1)} is a type "
                                       f"not supported or can not be recognized. Skipping to next page. Internal error "
@@ -232,32 +237,34 @@ def compute_path(partial_path, extension):
     return output_path
 
 
-def process_proofs(proofs_folder_path, proofs_output_path, naf, begin, end, naf_to_dni):
-    proc_logger = build_process_logger(logger, "Bank proofs")
-    # Flatten year directories (flat list of document for all years)
-    all_bankproof_folders = flatten_dirs(proofs_folder_path)
+def process_proofs(proofs_folder_path, proofs_output_path, naf, begin, end, naf_to_dni,
+                   manifest: Optional[Manifest] = None):
+    proc_logger = build_process_logger(get_logger_instance(), "Bank proofs")
+    if manifest is None:
+        manifest = get_manifest(os.path.dirname(proofs_folder_path))
 
-    # Select all bankproof folder that are in range with the date (begin and end date included)
-    bankproof_folders_selected = []
-    for bankproof_folder in all_bankproof_folders:
-        dir_date = parse_date(bankproof_folder.split("/")[1][:6], "%m%Y")
-        if begin <= dir_date <= end:
-            bankproof_folders_selected.append(bankproof_folder)
+    # Select all bankproof folder that are in range with the date (begin and end date included), grouping their files
+    bankproof_folders_selected = {}
+    for proof_entry in manifest.select(PROOF_CATEGORY, begin, end):
+        bankproof_folder = "/".join(proof_entry.relative_path.split("/")[1:3])
+        if bankproof_folder not in bankproof_folders_selected:
+            bankproof_folders_selected[bankproof_folder] = []
             proc_logger.info(
-                "Proof folder " + bankproof_folder + " is selected, because its date is " + unparse_date(dir_date,
-                                                                                                         "-") + ".")
+                "Proof folder " + bankproof_folder + " is selected, because its date is " +
+                unparse_date(proof_entry.period, "-") + ".")
+        bankproof_folders_selected[bankproof_folder].append(proof_entry)
 
     # Write sheets to NAF folder that match the DNI
-    for bankproof_folder in bankproof_folders_selected:
-        bank = "_".join(bankproof_folder.split("_")[1:])
-        proof_date = parse_date(bankproof_folder.split("/")[1][:6], "%m%Y")
+    for bankproof_folder, proof_entries in bankproof_folders_selected.items():
+        bank = proof_entries[0].bank
+        proof_date = proof_entries[0].period
         proc_logger.debug("Working with folder " + bankproof_folder + ". Bank type is " + bank)
         if (bank.__eq__("BBVA") or bank.__eq__("BBVA_endarreriments") or bank.__eq__("BBVA_endarreriments") or
                 bank.__eq__("BBVA_FINIQUITO")):
-            for bankproof_file in list_dir(os.path.join(proofs_folder_path, bankproof_folder)):
+            for bankproof_file in [os.path.basename(proof_entry.path) for proof_entry in proof_entries]:
                 try:
-                    page = get_matching_page(os.path.join(proofs_folder_path, bankproof_folder, bankproof_file),
-                                             naf_to_dni[naf].no_dash_str(), "[A-Z]\\d{7}[A-Z]|\\d{8}[A-Z]")
+                    page = find_matching_page(os.path.join(proofs_folder_path, bankproof_folder, bankproof_file),
+                                             naf_to_dni[naf].no_dash_str(), DNI_PATTERN)
                 except ValueError as e:
                     proc_logger.debug(
                         "DNI " + str(naf_to_dni[naf]) + " not detected in " +
@@ -280,11 +287,11 @@ def process_proofs(proofs_folder_path, proofs_output_path, naf, begin, end, naf_
                 write_page(page, output_path)
 
         elif bank.__eq__("LA_CAIXA") or bank.__eq__("LA_CAIXA_EXTRA") or bank.__eq__("LA_CAIXA_endarreriments"):
-            file_names = list_dir(os.path.join(proofs_folder_path, bankproof_folder))
+            file_names = [os.path.basename(proof_entry.path) for proof_entry in proof_entries]
             for file_name in file_names:
                 try:
-                    page = get_matching_page(os.path.join(proofs_folder_path, bankproof_folder, file_name),
-                                             naf_to_dni[naf].no_dash_str(), "[A-Z]\\d{7}[A-Z]|\\d{8}[A-Z]")
+                    page = find_matching_page(os.path.join(proofs_folder_path, bankproof_folder, file_name),
+                                             naf_to_dni[naf].no_dash_str(), DNI_PATTERN)
                 except ValueError as e:
                     proc_logger.debug("DNI " + str(naf_to_dni[naf]) + " not detected in " +
                                       os.path.join(proofs_folder_path, bankproof_folder, file_name) + ". Error: "
@@ -310,31 +317,21 @@ def process_proofs(proofs_folder_path, proofs_output_path, naf, begin, end, naf_
             continue
 
 
-def process_contracts(contracts_folder_path, naf_dir, naf, begin, end):
-    proc_logger = build_process_logger(logger, "Contracts")
+def process_contracts(contracts_folder_path, naf_dir, naf, begin, end, manifest: Optional[Manifest] = None):
+    proc_logger = build_process_logger(get_logger_instance(), "Contracts")
+    if manifest is None:
+        manifest = get_manifest(os.path.dirname(contracts_folder_path))
     found = False
-    # Salaries
-    # List all file names in the _salaries folder, in the ./input folder and remove undesired files
-    contracts_files = list_dir(contracts_folder_path)
-    contracts_files.sort()
-    for contracts_file in contracts_files:
+    for contract_entry in manifest.select(CONTRACT_CATEGORY):
+        contracts_file = os.path.basename(contract_entry.path)
         proc_logger.debug("contract file: " + contracts_file)
-        naf_dirty = NAF(contracts_file.split("_")[0])
-        dates = contracts_file.split(".")[0].split("_")
-        begin_date = parse_date("20" + dates[1], "%Y%m")
-        if len(dates) == 3:  # Contract is temporary; has end date
-            if dates[2] == "A":
-                # Addenda
-                end_date = datetime.max
-            else:
-                end_date = parse_date("20" + dates[2], "%Y%m")
-        elif len(dates) == 2:  # Contract is undefined; has no end date
-            end_date = datetime.max
-        else:
-            proc_logger.error("expected 3 fields in the name of the file " + contracts_file + " but " +
-                              str(len(
-                                  dates)) + " have been found. The file will be ignored until it has proper format.")
+        if contract_entry.period is None:
+            proc_logger.error("expected a name like NAF_YYMM[_YYMM|_A].pdf for the contract " + contracts_file +
+                              " but it does not follow it. The file will be ignored until it has proper format.")
             continue
+        naf_dirty = NAF(contract_entry.naf)
+        begin_date = contract_entry.period
+        end_date = contract_entry.period_end
 
         if naf_dirty.__eq__(naf):
             proc_logger.debug(
@@ -349,7 +346,7 @@ def process_contracts(contracts_folder_path, naf_dir, naf, begin, end):
                                                                                                                 "of " + unparse_date(
                         begin, "-") + ", " + unparse_date(end, "-") + ". Copying it to " + naf_dir)
                 try:
-                    shutil.copy(src=os.path.join(contracts_folder_path, contracts_file),
+                    shutil.copy(src=contract_entry.path,
                                 dst=os.path.join(naf_dir, CONTRACTS_OUTPUT_NAME))
                     found = True
                 except Exception as e:
@@ -365,7 +362,7 @@ def process_contracts(contracts_folder_path, naf_dir, naf, begin, end):
     return found
 
 
-def process_RNTs(rnts_folder_path, naf_dir, naf, begin, end):
+def process_RNTs(rnts_folder_path, naf_dir, naf, begin, end, manifest: Optional[Manifest] = None):
     rnts_found = get_rlc_monthly_result_structure(begin, end, False)  # regular monthly salary, RLC-N, RLC-P
     print("process RNT args are ")
     print(begin)
@@ -373,38 +370,33 @@ def process_RNTs(rnts_folder_path, naf_dir, naf, begin, end):
     print("rnts found initial structure")
     print(rnts_found)
 
-    proc_logger = build_process_logger(logger, "RNTs")
-    rnt_files = flatten_dirs(rnts_folder_path)
-    rnt_files.sort()
-    for rnt_file in rnt_files:
-        file_date = parse_date("20" + rnt_file.split("/")[1][:4], "%Y%m", return_naive=True)
-        #file_date.hour = 0  # Sometimes due to timezone correction the hour get set to a different than 0, causing problems in reporting
+    proc_logger = build_process_logger(get_logger_instance(), "RNTs")
+    if manifest is None:
+        manifest = get_manifest(os.path.dirname(rnts_folder_path))
+    for rnt_entry in manifest.select(RNT_CATEGORY, begin, end):
+        file_date = rnt_entry.period
         print("parsed file date")
         print(file_date)
-        if begin <= file_date <= end:
-            rnt_file_name = rnt_file.split("/")[1]
-            rnt_file_name_without_extension = rnt_file_name.split(".")[0]
-            rnt_path = os.path.join(rnts_folder_path, file_date.year.__str__(), rnt_file_name)
-            rnt_partial_path_destination = os.path.join(naf_dir, RNTS_OUTPUT_NAME, rnt_file_name)
-            proc_logger.info("RNT file " + rnt_path.__str__() + " is selected, because its date is " +
-                             unparse_date(file_date) + ".")
-            try:
-                pages = get_matching_pages(rnt_path, naf.__str__(), r"\d{12}")
-            except ValueError as e:
-                proc_logger.debug("NAF " + naf.__str__() + " not detected in " + rnt_path + ". Error: " + e.__str__())
-                continue
-            for page, page_num in pages:
-                rnt_path_destination = os.path.join(naf_dir, RNTS_OUTPUT_NAME,
-                                                    rnt_file_name_without_extension + "_" + str(page_num) + ".pdf")
-                proc_logger.info(
-                    "NAF " + naf.__str__() + " was detected in " + rnt_path + " in page " + str(page_num + 1) +
-                    ". Writing page to " + rnt_path_destination.__str__() + ".")
-                write_page(page, rnt_path_destination)
-                print("rnt found with date: " + str(file_date))
-                rnts_found[file_date] = True
-        else:
-            proc_logger.debug("RNT file " + rnt_file.__str__() + " is not selected, because its date is " +
-                              unparse_date(file_date) + ".")
+        rnt_file_name = os.path.basename(rnt_entry.path)
+        rnt_file_name_without_extension = rnt_file_name.split(".")[0]
+        rnt_path = rnt_entry.path
+        rnt_partial_path_destination = os.path.join(naf_dir, RNTS_OUTPUT_NAME, rnt_file_name)
+        proc_logger.info("RNT file " + rnt_path.__str__() + " is selected, because its date is " +
+                         unparse_date(file_date) + ".")
+        try:
+            pages = find_matching_pages(rnt_path, naf.__str__(), NAF_RNT_PATTERN)
+        except ValueError as e:
+            proc_logger.debug("NAF " + naf.__str__() + " not detected in " + rnt_path + ". Error: " + e.__str__())
+            continue
+        for page, page_num in pages:
+            rnt_path_destination = os.path.join(naf_dir, RNTS_OUTPUT_NAME,
+                                                rnt_file_name_without_extension + "_" + str(page_num) + ".pdf")
+            proc_logger.info(
+                "NAF " + naf.__str__() + " was detected in " + rnt_path + " in page " + str(page_num + 1) +
+                ". Writing page to " + rnt_path_destination.__str__() + ".")
+            write_page(page, rnt_path_destination)
+            print("rnt found with date: " + str(file_date))
+            rnts_found[file_date] = True
 
     print("rnts found before returning func")
     print(rnts_found)
@@ -426,7 +418,7 @@ def datetime_range(begin, end):
 
 
 def merge_rnts_rlcs(rnts_folder_path, rlcs_folder_path, naf_dir, begin, end):
-    proc_logger = build_process_logger(logger, "merge RNTs and RLCs")
+    proc_logger = build_process_logger(get_logger_instance(), "merge RNTs and RLCs")
 
     months_list = datetime_range(begin, end)
     proc_logger.info("Generated months list from " + str(begin) + " to " + str(end) + " is: " + str(months_list))
@@ -473,6 +465,20 @@ def reverse_dict(d: dict):
     return r
 
 
+def get_employee_registry(naf_data_path):
+    """
+    Returns NAF_TO_DNI, DNI_TO_NAF, NAF_TO_NAME and NAME_TO_NAF built from NAF_DNI.xlsx. They are kept for the next
+    justifications of the same process and the file is only read again when it changes.
+    """
+    key = (os.path.abspath(naf_data_path), os.stat(naf_data_path).st_mtime_ns)
+    if getattr(get_employee_registry, "_key", None) != key:
+        naf_to_dni = build_naf_to_dni(naf_data_path)
+        naf_to_name = build_naf_to_name(naf_data_path)
+        get_employee_registry._registry = (naf_to_dni, reverse_dict(naf_to_dni), naf_to_name, reverse_dict(naf_to_name))
+        get_employee_registry._key = key
+    return get_employee_registry._registry
+
+
 def complete_arguments(args, NAME_TO_NAF, NAF_TO_DNI, DNI_TO_NAF, NAF_TO_NAME):
     if args.naf:
         if not args.dni:
@@ -519,121 +525,167 @@ def complete_arguments(args, NAME_TO_NAF, NAF_TO_DNI, DNI_TO_NAF, NAF_TO_NAME):
     raise ValueError("An employee identifier was not supplied (NAF, DNI or name). Aborting.")
 
 
-def process(args, INPUT_FOLDER):
-    if args.request:
-        update_list_item_field(args.request, {"Estatworkflow": "En execució"})
-
-    tz = pytz.timezone("Europe/Madrid")
-
-    # Obtain absolute path to the valid user list
-    USER_LIST_DATA_PATH = os.path.join(INPUT_FOLDER, "input")
-
-    # Obtain absolute paths for each input directory
-    SALARIES_FOLDER = os.path.join(INPUT_FOLDER, "_salaries")
-    PROOFS_FOLDER = os.path.join(INPUT_FOLDER, "_proofs")
-    CONTRACTS_FOLDER = os.path.join(INPUT_FOLDER, "_contracts")
-    RNTS_FOLDER = os.path.join(INPUT_FOLDER, "_RNT")
-    RLCS_FOLDER = os.path.join(INPUT_FOLDER, "_RLC")
-
+def prepare_job(context: JobContext, token_manager, drive_id, prepare_input=True) -> Manifest:
+    """
+    Obtains the input data, completes the arguments with the registry of employees and opens the output folders and
+    log files of the justification. Returns the manifest of the input folder.
+    """
+    args = context.args
+    INPUT_FOLDER = context.input_folder
     NAF_DATA_PATH = os.path.join(INPUT_FOLDER, "NAF_DNI.xlsx")
 
-    token_manager = get_token_manager()
-
-    sharepoint_domain = read_secret('SHAREPOINT_DOMAIN')
-    site_name = read_secret('SITE_NAME')
-    site_id = get_site_id(token_manager, sharepoint_domain, site_name)
-    drive_id = get_drive_id(token_manager, site_id, drive_name="Documents")
-    carpeta_sharepoint = read_secret("SHAREPOINT_FOLDER_INPUT")
-
-    start_time = time.time()
     # Ensure fresh input data
-    if args.location == "sharepoint":
-        remove_folder(INPUT_FOLDER)
-        download_input_folder(token_manager, drive_id, carpeta_sharepoint, INPUT_FOLDER)
+    if not prepare_input:
+        pass  # The caller already fetched and indexed the input data (batch mode)
+    elif args.location == "sharepoint":
+        carpeta_sharepoint = read_secret("SHAREPOINT_FOLDER_INPUT")
+        if args.async_graph:
+            run_fetch_input_folder(token_manager, drive_id, carpeta_sharepoint, INPUT_FOLDER, args.download_mode,
+                                   args.begin, args.end, args.naf)
+        else:
+            fetch_input_folder(token_manager, drive_id, carpeta_sharepoint, INPUT_FOLDER, args.download_mode,
+                               begin=args.begin, end=args.end, naf=args.naf)
     elif args.location == "local":
         pass
 
     # Build dictionaries to translate between different identifier data
-    NAF_TO_DNI = build_naf_to_dni(NAF_DATA_PATH)
-    DNI_TO_NAF = reverse_dict(NAF_TO_DNI)
-    NAF_TO_NAME = build_naf_to_name(NAF_DATA_PATH)
-    NAME_TO_NAF = reverse_dict(NAF_TO_NAME)
+    NAF_TO_DNI, DNI_TO_NAF, NAF_TO_NAME, NAME_TO_NAF = get_employee_registry(NAF_DATA_PATH)
+    context.naf_to_dni = NAF_TO_DNI
 
     complete_arguments(args, NAME_TO_NAF, NAF_TO_DNI, DNI_TO_NAF, NAF_TO_NAME)
+    # The identifiers completed above reach the list in a single request
+    flush_list_item_updates()
 
     now = datetime.now().strftime("%Y-%m-%d_%H,%M,%S")
 
     id_str = compute_id(now, args, NAF_TO_NAME)
     impersonal_id_str = compute_impersonal_id(now, args, NAF_TO_NAME)
 
-    current_user_folder, current_justification_folder, user_report_file, admin_log_path, supervisor_log_path = (
-        compute_paths(args, id_str, impersonal_id_str))
-
-    ensure_file_structure(current_user_folder, current_justification_folder)
-
-    # Define logger
-    logger_instance = get_logger(user_report_file, admin_log_path, supervisor_log_path, debug_mode=True)
-    set_logger(logger_instance)
-
-    global logger
-    logger = build_process_logger(logger_instance, "main process")
+    # Output folders, log files and logger of this justification
+    context.open_output(id_str, impersonal_id_str)
 
     # Log initial report
-    logger.info(get_initial_user_report(args))
+    context.logger.info(get_initial_user_report(args))
+
+    # Table of the input files with the metadata of their names, so the stages do not need to list the folders
+    manifest = refresh_manifest(INPUT_FOLDER) if prepare_input else get_manifest(INPUT_FOLDER)
+
+    # Record which pages mention each NAF / DNI, so the stages do not need to scan every PDF
+    identifier_index = get_identifier_index()
+    if identifier_index is not None and prepare_input:
+        identifier_index.build(INPUT_FOLDER)
+    return manifest
+
+
+class Stage(NamedTuple):
+    name: str
+    run: Callable[[], None]
+    # Names of the stages that have to finish before this one starts
+    after: Tuple[str, ...] = ()
+
+
+def run_stage_graph(stages: List[Stage], workers):
+    """
+    Runs each stage as soon as the stages it depends on are finished, up to `workers` of them at the same time, and logs
+    the time spent by each one. If a stage fails, the stages not started yet are dropped and its exception is raised
+    once the running ones finish. Raises ValueError before running any stage if a stage depends on stages that do not
+    exist or on itself through others.
+    """
+    logger = build_process_logger(get_logger_instance(), "Stages")
+    names = {stage.name for stage in stages}
+    for stage in stages:
+        if not names.issuperset(stage.after):
+            raise ValueError(f"Stage {stage.name} depends on stages that do not exist: {str(stage.after)}")
+    ordered = set()
+    unordered = list(stages)
+    while unordered:
+        ready = [stage for stage in unordered if ordered.issuperset(stage.after)]
+        if not ready:
+            raise ValueError(f"Stages {', '.join(stage.name for stage in unordered)} depend on each other")
+        ordered.update(stage.name for stage in ready)
+        unordered = [stage for stage in unordered if stage.name not in ordered]
+
+    def run_timed(stage: Stage):
+        start_time = time.time()
+        try:
+            stage.run()
+        finally:
+            # The thread may run a stage of another job next, the shared reader it used last can be closed
+            release_pdf()
+        logger.info(f"Stage \"{stage.name}\" finished in {time.time() - start_time:.2f}s.")
+
+    waiting = list(stages)
+    done = set()
+    running = {}
+    error = None
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        while waiting or running:
+            if error is None:
+                for stage in [stage for stage in waiting if done.issuperset(stage.after)]:
+                    waiting.remove(stage)
+                    # Copies the context, so the stage logs and writes its pages to the current job
+                    running[submit_with_context(pool, run_timed, stage)] = stage
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage = running.pop(future)
+                try:
+                    future.result()
+                except Exception as e:
+                    error = error or e
+                else:
+                    done.add(stage.name)
+    if error is not None:
+        raise error
+
+
+def run_stages(context: JobContext, manifest: Manifest):
+    """
+    Selects the documents of the justification from the input data and writes them to its output folder. Each type of
+    document reads its own input folder and writes its own output folder, so they are extracted at the same time, and
+    each merge starts when the folders it reads are complete.
+    """
+    args = context.args
+    INPUT_FOLDER = context.input_folder
+    logger = context.logger
+    reports = context.reports
+    current_justification_folder = context.justification_folder
 
-    # Stop timer for download process
-    end_time = elapsed_time(start_time)
-    logger.info("Time elapsed for obtaining and validating input data: " + str(end_time) + ".")
-    start_time = time.time()
+    # Obtain absolute paths for each input directory
+    SALARIES_FOLDER = os.path.join(INPUT_FOLDER, "_salaries")
+    PROOFS_FOLDER = os.path.join(INPUT_FOLDER, "_proofs")
+    CONTRACTS_FOLDER = os.path.join(INPUT_FOLDER, "_contracts")
+    RNTS_FOLDER = os.path.join(INPUT_FOLDER, "_RNT")
+    RLCS_FOLDER = os.path.join(INPUT_FOLDER, "_RLC")
 
-    # Begin processing
-    reports = {}
-    # Salaries & RLC
     salary_output_path = os.path.join(current_justification_folder, SALARIES_OUTPUT_NAME)
-    reports[DocType.SALARY] = process_salaries_with_rlc(SALARIES_FOLDER, RLCS_FOLDER, current_justification_folder,
-                                                        args.naf, args.begin, args.end)
-
-    # Bank proofs
     proof_output_path = os.path.join(current_justification_folder, PROOFS_OUTPUT_NAME)
-    reports[DocType.PROOFS] = process_proofs(PROOFS_FOLDER, proof_output_path, args.naf, args.begin,
-                                             args.end, NAF_TO_DNI)
-
     rlc_output_path = os.path.join(current_justification_folder, RLCS_OUTPUT_NAME)
-    if args.merge_salary:
-        salaries_and_bankproofs_output_path = os.path.join(current_justification_folder,
-                                                           SALARIES_AND_PROOFS_OUTPUT_NAME)
-        merge_equal_files_from_two_folders(salary_output_path, proof_output_path, salaries_and_bankproofs_output_path)
-        if args.merge_result[DocType.SALARIES_AND_PROOFS]:
-            compact_folder(salaries_and_bankproofs_output_path)
-    # Process general after processing merge salary + bank proof
-    if args.merge_result[DocType.SALARY]:
-        compact_folder(salary_output_path)
-    if args.merge_result[DocType.RLC]:
-        compact_folder(rlc_output_path)
-    if args.merge_result[DocType.PROOFS]:
-        compact_folder(proof_output_path)
-
-    # Contracts
-    try:
-        reports[DocType.CONTRACT] = process_contracts(CONTRACTS_FOLDER, current_justification_folder, args.naf,
-                                                      args.begin, args.end)
-    except Exception as e:
-        if args.request:
-            update_list_item_field(args.request, {"Estatworkflow": "Error", "Missatge_x0020_error":
-                str(e)})
-        raise ValueError
     contract_output_path = os.path.join(current_justification_folder, CONTRACTS_OUTPUT_NAME)
-    if args.merge_result[DocType.CONTRACT]:
-        compact_folder(contract_output_path)
-
-    # RNTs
-    reports[DocType.RNT] = process_RNTs(RNTS_FOLDER, current_justification_folder, args.naf, args.begin, args.end)
     rnt_output_path = os.path.join(current_justification_folder, RNTS_OUTPUT_NAME)
-    if args.merge_result[DocType.RNT]:
-        compact_folder(rnt_output_path)
+    salaries_and_bankproofs_output_path = os.path.join(current_justification_folder, SALARIES_AND_PROOFS_OUTPUT_NAME)
 
-    # Process fusion of RLC & RNT
-    if args.merge_rnt_rlc:
+    def salaries():
+        reports[DocType.SALARY] = process_salaries_with_rlc(SALARIES_FOLDER, RLCS_FOLDER, current_justification_folder,
+                                                            args.naf, args.begin, args.end, manifest)
+
+    def proofs():
+        reports[DocType.PROOFS] = process_proofs(PROOFS_FOLDER, proof_output_path, args.naf, args.begin,
+                                                 args.end, context.naf_to_dni, manifest)
+
+    def contracts():
+        try:
+            reports[DocType.CONTRACT] = process_contracts(CONTRACTS_FOLDER, current_justification_folder, args.naf,
+                                                          args.begin, args.end, manifest)
+        except Exception as e:
+            raise ValueError(str(e)) from e
+
+    def rnts():
+        reports[DocType.RNT] = process_RNTs(RNTS_FOLDER, current_justification_folder, args.naf, args.begin, args.end,
+                                            manifest)
+
+    def merge_rnt_rlc():
         logger.info("Starting the merge of RNT and RLC")
         if args.merge_result[DocType.RNT] or args.merge_result[DocType.RLC]:
             rnts_merged_path = os.path.join(current_justification_folder, "RNTs.pdf")  # TODO: remove hard-coded filename
@@ -662,19 +714,57 @@ def process(args, INPUT_FOLDER):
                 args.end
             )
 
-    final_logger = build_process_logger(logger_instance, "Final report")
-    report_text = get_end_user_report(reports, args)
-    final_logger.info(report_text)
+    stages = [
+        Stage("salaries and RLCs", salaries),
+        Stage("bank proofs", proofs),
+        Stage("contracts", contracts),
+        Stage("RNTs", rnts)
+    ]
+    # The salaries and bank proofs are compacted after the merge, which reads their folders
+    salary_readers = ()
+    if args.merge_salary:
+        salary_readers = ("merge salaries and bank proofs",)
+        stages.append(Stage("merge salaries and bank proofs",
+                            lambda: merge_equal_files_from_two_folders(salary_output_path, proof_output_path,
+                                                                       salaries_and_bankproofs_output_path),
+                            ("salaries and RLCs", "bank proofs")))
+        if args.merge_result[DocType.SALARIES_AND_PROOFS]:
+            stages.append(Stage("compact salaries and bank proofs",
+                                lambda: compact_folder(salaries_and_bankproofs_output_path),
+                                ("merge salaries and bank proofs",)))
+    if args.merge_result[DocType.SALARY]:
+        stages.append(Stage("compact salaries", lambda: compact_folder(salary_output_path),
+                            ("salaries and RLCs",) + salary_readers))
+    if args.merge_result[DocType.RLC]:
+        stages.append(Stage("compact RLCs", lambda: compact_folder(rlc_output_path), ("salaries and RLCs",)))
+    if args.merge_result[DocType.PROOFS]:
+        stages.append(Stage("compact bank proofs", lambda: compact_folder(proof_output_path),
+                            ("bank proofs",) + salary_readers))
+    if args.merge_result[DocType.CONTRACT]:
+        stages.append(Stage("compact contracts", lambda: compact_folder(contract_output_path), ("contracts",)))
+    if args.merge_result[DocType.RNT]:
+        stages.append(Stage("compact RNTs", lambda: compact_folder(rnt_output_path), ("RNTs",)))
+
+    # Process fusion of RLC & RNT, from their folders or from their compacted PDFs
+    if args.merge_rnt_rlc:
+        compactions = tuple(stage.name for stage in stages if stage.name in ["compact RNTs", "compact RLCs"])
+        stages.append(Stage("merge RNTs and RLCs", merge_rnt_rlc, ("salaries and RLCs", "RNTs") + compactions))
+
+    run_stage_graph(stages, args.stage_workers)
+
 
-    end_time = elapsed_time(start_time)
-    logger.info("Time elapsed for doing this justification: " + str(end_time) + ".")
-    start_time = time.time()
-    elapsed_time(start_time)
+def publish_results(context: JobContext, token_manager, site_id, drive_id):
+    """Uploads the output folder and the admin log of the justification. Returns the links to both."""
+    args = context.args
+    logger = context.logger
+    impersonal_id_str = context.impersonal_id_str
+    admin_log_path = context.admin_log_path
 
-    upload_folder_recursive(
+    upload_folder = run_upload_folder if args.async_graph else upload_folder_recursive
+    upload_folder(
         token_manager=token_manager,
         drive_id=drive_id,
-        local_folder_path=current_justification_folder,
+        local_folder_path=context.justification_folder,
         remote_folder_path=read_secret("SHAREPOINT_FOLDER_OUTPUT") + "/" + args.author + "/" + impersonal_id_str
     )
 
@@ -692,30 +782,107 @@ def process(args, INPUT_FOLDER):
     #            SHAREPOINT_FOLDER_OUTPUT + "/" + "_supervisor_logs/" + os.path.basename(supervisor_log_path),
     #            supervisor_log_path)
 
-    end_time = elapsed_time(start_time)
-    logger.info("Time elapsed for uploading data: " + str(end_time) + ".")
-    start_time = time.time()
-    elapsed_time(start_time)
-
-    if args.request:
-        logger.debug("Updating list element state to Completed")
-        update_list_item_field(args.request, {"Estatworkflow": "Completat"})
-        logger.debug("Updating list element error message to no error message")
-        update_list_item_field(args.request, {"Missatge_x0020_error": "-"})
-        logger.debug("Updating list element link to result")
-        #update_resultat_sharepoint_rest(args.request, link)  # TODO: When field Resultat is URL or image, I need more
-                                                              # permissions to update it using sharepoint API, can't use
-                                                              # graph api
-        update_list_item_field(args.request, {"Resultat": link})
-
     return link, log_link
 
 
+def process(args, INPUT_FOLDER, prepare_input=True, output_root=GENERAL_OUTPUT_FOLDER):
+    """
+    Does a justification. Its logger, output folders and reports belong to its own JobContext, so several
+    justifications can run at the same time in different threads of the same process.
+    """
+    with JobContext(args, INPUT_FOLDER, output_root) as context:
+        if args.request:
+            update_list_item_field(args.request, {"Estatworkflow": "En execució"})
+            # Sent now, so the request shows as running while the input is downloaded. The identifiers completed by
+            # prepare_job are sent together later
+            flush_list_item_updates()
+
+        token_manager = get_token_manager()
+
+        sharepoint_domain = read_secret('SHAREPOINT_DOMAIN')
+        site_name = read_secret('SITE_NAME')
+        site_id = get_site_id(token_manager, sharepoint_domain, site_name)
+        drive_id = get_drive_id(token_manager, site_id, drive_name="Documents")
+
+        start_time = time.time()
+        if prepare_input:
+            # Other jobs of this process or of other processes may be fetching or reading the same input folder
+            with context.input_lock():
+                manifest = prepare_job(context, token_manager, drive_id)
+        else:
+            with context.input_lock(shared=True):
+                manifest = prepare_job(context, token_manager, drive_id, prepare_input=False)
+        logger = context.logger
+
+        # Stop timer for download process
+        end_time = elapsed_time(start_time)
+        logger.info("Time elapsed for obtaining and validating input data: " + str(end_time) + ".")
+        start_time = time.time()
+
+        # Begin processing. Other jobs do not fetch the input while the stages read it
+        try:
+            with context.input_lock(shared=True):
+                run_stages(context, manifest)
+        except Exception as e:
+            if args.request:
+                update_list_item_field(args.request, {"Estatworkflow": "Error", "Missatge_x0020_error": str(e)})
+            raise
+
+        final_logger = build_process_logger(context.logger_instance, "Final report")
+        report_text = get_end_user_report(context.reports, args)
+        final_logger.info(report_text)
+
+        end_time = elapsed_time(start_time)
+        logger.info("Time elapsed for doing this justification: " + str(end_time) + ".")
+        start_time = time.time()
+        elapsed_time(start_time)
+
+        link, log_link = publish_results(context, token_manager, site_id, drive_id)
+
+        end_time = elapsed_time(start_time)
+        logger.info("Time elapsed for uploading data: " + str(end_time) + ".")
+        graph_counters = context.graph_counters
+        logger.info(f"Graph requests: {graph_counters['requests']:.0f}, retries: {graph_counters['retries']:.0f}, "
+                    f"throttled: {graph_counters['throttled']:.0f}, waiting: {graph_counters['waited_seconds']:.1f}s.")
+        start_time = time.time()
+        elapsed_time(start_time)
+
+        if args.request:
+            logger.debug("Updating list element state to Completed")
+            update_list_item_field(args.request, {"Estatworkflow": "Completat"})
+            logger.debug("Updating list element error message to no error message")
+            update_list_item_field(args.request, {"Missatge_x0020_error": "-"})
+            logger.debug("Updating list element link to result")
+            #update_resultat_sharepoint_rest(args.request, link)  # TODO: When field Resultat is URL or image, I need more
+                                                                  # permissions to update it using sharepoint API, can't use
+                                                                  # graph api
+            update_list_item_field(args.request, {"Resultat": link})
+            flush_list_item_updates()
+
+        return link, log_link
+
+
+def apply_performance_arguments(args):
+    set_pdf_backend(args.pdf_backend)
+    set_download_workers(args.download_workers)
+    set_upload_workers(args.upload_workers)
+    set_graph_concurrency(args.graph_concurrency)
+    set_scan_workers(args.workers)
+    set_prefilter(args.prefilter)
+    set_max_open_readers(args.max_open_readers)
+    if not args.page_cache:
+        set_page_cache(None)
+    if not args.identifier_index:
+        set_identifier_index(None)
+
+
 def main():
     #logger = build_process_logger(get_logger_instance(), "Main")  # Logger in this project is an absolute mess...
 
     args = process_parse_arguments()
 
+    apply_performance_arguments(args)
+
     if args.input_location:
         INPUT_FOLDER = args.input_location
     else:
@@ -724,12 +891,17 @@ def main():
     try:
         result_link, log_link = process(args, INPUT_FOLDER)
     except ValueError as e:  # "Too broad exception clause" but I know exactly what I'm doing
+        shutdown_scan_pool()
         err = f"A not controlled error happen during execution of Justicier. Error is: {str(e)}"
         update_list_item_field(args.request, {"Missatge_x0020_error": err})
         mail_process(result_link, log_link, args)  # TODO silenced until we have the firewall route allowing traffic.
         print(err)
         exit(1)
+    finally:
+        # Also sends the error state of a failed justification
+        flush_list_item_updates()
 
+    shutdown_scan_pool()
     print("Justification process is finished.")
     print("Sending notification email")
     mail_process(result_link, log_link, args)  # TODO silenced until we have the firewall route allowing traffic.
@@ -2,7 +2,8 @@ import argparse
 import os
 
 from arguments import parse_id
-from sharepoint import update_list_item_field, upload_folder_recursive, get_drive_id, get_site_id, upload_file
+from sharepoint import update_list_item_field, upload_folder_recursive, get_drive_id, get_site_id, upload_file, \
+    flush_list_item_updates
 from TokenManager import get_token_manager
 from secret import read_secret
 from defines import ADMIN_LOG_FOLDER
@@ -27,6 +28,7 @@ def main():
                         help='ID of the justification request in Microsoft List of Peticions Justificacions.')
     args = parser.parse_args()
     update_list_item_field(args.request, {"Estatworkflow": "Error"})
+    flush_list_item_updates()
 
     if os.path.isdir(ADMIN_LOG_FOLDER):  # Only upload when the folder is detected
         SUPERVISOR_LOG_PATH = get_first_log_path(ADMIN_LOG_FOLDER)
@@ -0,0 +1,238 @@
+import hashlib
+import json
+import os
+import re
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional
+
+from NAF import NAF
+from defines import CACHE_FOLDER
+from page_cache import compute_file_hash
+
+# Categories of the input files, given by the folder of the input where they are
+SALARY_CATEGORY = "salary"
+PROOF_CATEGORY = "proof"
+RNT_CATEGORY = "rnt"
+RLC_CATEGORY = "rlc"
+CONTRACT_CATEGORY = "contract"
+OTHER_CATEGORY = "other"
+
+CATEGORY_FOLDERS = {"_salaries": SALARY_CATEGORY, "_proofs": PROOF_CATEGORY, "_RNT": RNT_CATEGORY,
+                    "_RLC": RLC_CATEGORY, "_contracts": CONTRACT_CATEGORY}
+# Categories whose files are grouped in a folder for each year
+YEAR_FOLDER_CATEGORIES = [SALARY_CATEGORY, PROOF_CATEGORY, RNT_CATEGORY, RLC_CATEGORY]
+
+
+def period_in_range(period: Optional[datetime], period_end: Optional[datetime], begin: Optional[datetime],
+                    end: Optional[datetime]) -> bool:
+    """True if the period (from period to period_end, if given) overlaps [begin, end]."""
+    if period is None:
+        return False
+    period_end = period_end if period_end is not None else period
+    return (begin is None or begin <= period_end) and (end is None or period <= end)
+
+
+class ManifestEntry(NamedTuple):
+    """An input file with the metadata encoded in its path."""
+    path: str  # Input folder joined with the relative path
+    relative_path: str  # Always with "/" separators
+    category: str
+    period: Optional[datetime]  # Month of the document, or first month for contracts. None if it can not be parsed
+    period_end: Optional[datetime]  # Only contracts: last month, or datetime.max if they have no end
+    salary_type: Optional[str]  # Only salaries: type in the filename, see defines.SalaryType
+    bank: Optional[str]  # Only bank proofs: bank of the folder, e.g. LA_CAIXA_EXTRA
+    naf: Optional[str]  # Only contracts: NAF in the filename, as written
+    size: int
+    mtime_ns: int
+    hash: str
+
+    def in_range(self, begin: Optional[datetime], end: Optional[datetime]) -> bool:
+        """True if the period of the document (the whole contract, for contracts) overlaps [begin, end]."""
+        return period_in_range(self.period, self.period_end, begin, end)
+
+
+def parse_path_metadata(relative_path: str) -> dict:
+    """
+    Parses the metadata encoded in the path of an input file, following the naming conventions of the input folder:
+        _salaries/YYYY/YYMM_Type.pdf
+        _proofs/YYYY/MMYYYY_BANK/file.pdf
+        _RNT/YYYY/YYMM....pdf
+        _RLC/YYYY/MM_L00N01.pdf
+        _contracts/NAF_YYMM[_YYMM|_A].pdf
+    Fields that do not follow the convention are left as None.
+    """
+    parts = relative_path.split("/")
+    metadata = {"category": CATEGORY_FOLDERS.get(parts[0], OTHER_CATEGORY), "period": None, "period_end": None,
+                "salary_type": None, "bank": None, "naf": None}
+    name = parts[-1]
+    stem = name.split(".")[0]
+    try:
+        if metadata["category"] == SALARY_CATEGORY and len(parts) == 3:
+            metadata["period"] = datetime.strptime("20" + stem.split("_")[0], "%Y%m")
+            metadata["salary_type"] = stem.split("_")[1]
+        elif metadata["category"] == PROOF_CATEGORY and len(parts) == 4:
+            metadata["bank"] = "_".join(parts[2].split("_")[1:])
+            metadata["period"] = datetime.strptime(parts[2][:6], "%m%Y")
+        elif metadata["category"] == RNT_CATEGORY and len(parts) == 3:
+            metadata["period"] = datetime.strptime("20" + name[:4], "%Y%m")
+        elif metadata["category"] == RLC_CATEGORY and len(parts) == 3:
+            metadata["period"] = datetime.strptime(parts[1] + name[:2], "%Y%m")
+        elif metadata["category"] == CONTRACT_CATEGORY and len(parts) == 2:
+            fields = stem.split("_")
+            metadata["naf"] = fields[0]
+            if len(fields) in (2, 3):
+                metadata["period"] = datetime.strptime("20" + fields[1], "%Y%m")
+                if len(fields) == 3 and fields[2] != "A":  # Temporary contract
+                    metadata["period_end"] = datetime.strptime("20" + fields[2], "%Y%m")
+                else:  # Undefined contract or addenda
+                    metadata["period_end"] = datetime.max
+    except (ValueError, IndexError):
+        metadata["period"] = None
+        metadata["period_end"] = None
+    return metadata
+
+
+def is_folder_in_scope(relative_path: str, begin: datetime, end: datetime) -> bool:
+    """False for the year folders of the input (e.g. _salaries/2019) that can not hold any document of [begin, end]."""
+    parts = relative_path.split("/")
+    if len(parts) >= 2 and CATEGORY_FOLDERS.get(parts[0]) in YEAR_FOLDER_CATEGORIES and re.fullmatch(r"\d{4}", parts[1]):
+        return begin.year <= int(parts[1]) <= end.year
+    return True
+
+
+def is_file_in_scope(relative_path: str, begin: datetime, end: datetime, naf: Optional[NAF] = None) -> bool:
+    """
+    False for the input files that the stages would not select for a justification of [begin, end]; with naf, also for
+    the contracts of other employees. Files whose path does not follow the naming conventions are kept, the stages
+    report them.
+    """
+    if not is_folder_in_scope(relative_path, begin, end):
+        return False
+    metadata = parse_path_metadata(relative_path)
+    if metadata["category"] == OTHER_CATEGORY or metadata["period"] is None:
+        return True
+    if metadata["category"] == CONTRACT_CATEGORY and naf is not None:
+        try:
+            if NAF(metadata["naf"]) != naf:
+                return False
+        except ValueError:
+            return True
+    return period_in_range(metadata["period"], metadata["period_end"], begin, end)
+
+
+class Manifest:
+    """
+    Table of every file of the input folder with the metadata parsed from its path, so the stages select their
+    documents with queries instead of listing directories and parsing names.
+
+    The table is kept in a JSON file of the cache folder. On refresh, only files whose size or mtime changed are hashed
+    and parsed again.
+    """
+
+    def __init__(self, input_folder, manifest_path=None):
+        self.input_folder = input_folder
+        if manifest_path is None:
+            folder_id = hashlib.sha256(os.path.abspath(input_folder).encode("utf-8")).hexdigest()[:16]
+            manifest_path = os.path.join(CACHE_FOLDER, f"manifest_{folder_id}.json")
+        self.manifest_path = manifest_path
+        self.entries: Dict[str, ManifestEntry] = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                rows = json.load(f)
+        except (OSError, ValueError):
+            return
+        for row in rows:
+            for field in ("period", "period_end"):
+                if row[field] is not None:
+                    row[field] = datetime.fromisoformat(row[field])
+            row["path"] = os.path.join(self.input_folder, *row["relative_path"].split("/"))
+            entry = ManifestEntry(**row)
+            self.entries[entry.relative_path] = entry
+
+    def save(self):
+        rows = []
+        for entry in self.entries.values():
+            row = entry._asdict()
+            del row["path"]
+            for field in ("period", "period_end"):
+                if row[field] is not None:
+                    row[field] = row[field].isoformat()
+            rows.append(row)
+        os.makedirs(os.path.dirname(self.manifest_path), exist_ok=True)
+        # Written aside and renamed, so a concurrent reader never sees half a manifest
+        temporary_path = self.manifest_path + "." + str(os.getpid()) + ".tmp"
+        with open(temporary_path, "w", encoding="utf-8") as f:
+            json.dump(rows, f)
+        os.replace(temporary_path, self.manifest_path)
+
+    def refresh(self) -> Dict[str, int]:
+        """Brings the table up to date with the input folder. Returns how many files were added, updated and removed."""
+        counters = {"added": 0, "updated": 0, "removed": 0, "total": 0}
+        seen = set()
+        for root, dirs, files in os.walk(self.input_folder):
+            dirs.sort()
+            for file_name in sorted(files):
+                path = os.path.join(root, file_name)
+                relative_path = os.path.relpath(path, self.input_folder).replace(os.sep, "/")
+                seen.add(relative_path)
+                stat = os.stat(path)
+                known = self.entries.get(relative_path)
+                if known is not None and known.size == stat.st_size and known.mtime_ns == stat.st_mtime_ns:
+                    continue
+                counters["added" if known is None else "updated"] += 1
+                self.entries[relative_path] = ManifestEntry(path=path, relative_path=relative_path,
+                                                            size=stat.st_size, mtime_ns=stat.st_mtime_ns,
+                                                            hash=compute_file_hash(path),
+                                                            **parse_path_metadata(relative_path))
+        for relative_path in list(self.entries.keys()):
+            if relative_path not in seen:
+                del self.entries[relative_path]
+                counters["removed"] += 1
+        counters["total"] = len(self.entries)
+        if counters["added"] or counters["updated"] or counters["removed"] or not os.path.exists(self.manifest_path):
+            self.save()
+        return counters
+
+    def select(self, category: str, begin: Optional[datetime] = None, end: Optional[datetime] = None,
+               salary_type: Optional[str] = None, bank: Optional[str] = None) -> List[ManifestEntry]:
+        """
+        Files of the category, sorted by path. With begin and/or end, only the ones whose period overlaps the range;
+        files whose period could not be parsed are then left out.
+        """
+        selected = []
+        for entry in self.entries.values():
+            if entry.category != category:
+                continue
+            if (begin is not None or end is not None) and not entry.in_range(begin, end):
+                continue
+            if salary_type is not None and entry.salary_type != salary_type:
+                continue
+            if bank is not None and entry.bank != bank:
+                continue
+            selected.append(entry)
+        selected.sort(key=lambda e: e.relative_path)
+        return selected
+
+
+def get_manifest(input_folder) -> Manifest:
+    """Manifest of the input folder, refreshed the first time it is requested by this process."""
+    if not hasattr(get_manifest, "_instances"):
+        get_manifest._instances = {}
+    key = os.path.abspath(input_folder)
+    if key not in get_manifest._instances:
+        manifest = Manifest(input_folder)
+        manifest.refresh()
+        get_manifest._instances[key] = manifest
+    return get_manifest._instances[key]
+
+
+def refresh_manifest(input_folder) -> Manifest:
+    """Same as get_manifest, but always checks the input folder for changes. Use it after fetching the input."""
+    if hasattr(get_manifest, "_instances") and os.path.abspath(input_folder) in get_manifest._instances:
+        manifest = get_manifest._instances[os.path.abspath(input_folder)]
+        manifest.refresh()
+        return manifest
+    return get_manifest(input_folder)
@@ -0,0 +1,102 @@
+import json
+import os
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from defines import CACHE_FOLDER
+from filesystem import file_lock
+
+METADATA_CACHE_FILENAME = "graph_metadata.json"
+# Seconds an identifier is trusted before it is resolved again
+METADATA_CACHE_TTL = 24 * 60 * 60
+
+
+class MetadataCache:
+    """
+    On-disk store of identifiers resolved from Graph (site, drive and list IDs, entity type of the list...), which
+    only change if the SharePoint objects are recreated.
+
+    The store is a JSON file shared by all the processes. A lock file serializes them, so when an identifier is missing
+    or expired only one process asks Graph for it and the others read its answer.
+    """
+
+    def __init__(self, cache_path, ttl=METADATA_CACHE_TTL):
+        self.cache_path = cache_path
+        self.ttl = ttl
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+
+    def _load(self) -> dict:
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, entries: dict):
+        temporary_path = self.cache_path + "." + str(os.getpid()) + ".tmp"
+        with open(temporary_path, "w", encoding="utf-8") as f:
+            json.dump(entries, f)
+        os.replace(temporary_path, self.cache_path)
+
+    def get(self, key) -> Optional[str]:
+        entry = self._load().get(key)
+        if entry is None or entry["expires"] < time.time():
+            return None
+        return entry["value"]
+
+    def get_or_resolve(self, key, resolve: Callable[[], str]) -> str:
+        """Returns the cached value of the key, calling resolve to obtain it only if it is missing or expired."""
+        value = self.get(key)
+        if value is not None:
+            return value
+        with file_lock(self.cache_path + ".lock"):
+            entries = self._load()
+            entry = entries.get(key)
+            if entry is not None and entry["expires"] >= time.time():  # Resolved by another process meanwhile
+                return entry["value"]
+            value = resolve()
+            entries[key] = {"value": value, "expires": time.time() + self.ttl}
+            self._save(entries)
+            return value
+
+    def update(self, values: Dict[str, str]):
+        """Stores several values resolved together."""
+        with file_lock(self.cache_path + ".lock"):
+            entries = self._load()
+            expires = time.time() + self.ttl
+            for key, value in values.items():
+                entries[key] = {"value": value, "expires": expires}
+            self._save(entries)
+
+    def get_entries(self, prefixes: Tuple[str, ...]) -> Dict[str, str]:
+        """Values not expired of the keys that start with any of the prefixes."""
+        now = time.time()
+        return {key: entry["value"] for key, entry in self._load().items()
+                if key.startswith(prefixes) and entry["expires"] >= now}
+
+    def invalidate(self, keys):
+        """Removes the keys, so their values are resolved again the next time."""
+        with file_lock(self.cache_path + ".lock"):
+            entries = self._load()
+            for key in keys:
+                entries.pop(key, None)
+            self._save(entries)
+
+    def clear(self):
+        with file_lock(self.cache_path + ".lock"):
+            self._save({})
+
+
+def _create_metadata_cache():
+    return MetadataCache(os.path.join(CACHE_FOLDER, METADATA_CACHE_FILENAME))
+
+
+def get_metadata_cache() -> Optional[MetadataCache]:
+    if not hasattr(get_metadata_cache, "_instance"):
+        get_metadata_cache._instance = _create_metadata_cache()
+    return get_metadata_cache._instance
+
+
+def set_metadata_cache(cache: Optional[MetadataCache]):
+    """Replaces the shared metadata cache. Setting it to None disables the cache and Graph is always asked."""
+    get_metadata_cache._instance = cache
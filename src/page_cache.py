@@ -0,0 +1,188 @@
+import argparse
+import hashlib
+import os
+import sqlite3
+from contextlib import closing
+from typing import Callable, List, Optional
+
+from defines import CACHE_FOLDER, ROOT_FOLDER
+from pdf_backend import get_pdf_backend, parse_pdf_backend, set_pdf_backend
+
+PAGE_CACHE_FILENAME = "page_text.sqlite3"
+# Increased when the tables change. Caches with an older schema are emptied when opened
+PAGE_CACHE_SCHEMA_VERSION = 1
+
+
+def compute_file_hash(path, chunk_size=1024 * 1024) -> str:
+    """Returns the SHA-256 of a file, reading it in chunks so big PDFs are never fully loaded in memory."""
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class PageTextCache:
+    """
+    On-disk store of the text extracted from each page of a PDF.
+
+    Texts are keyed by the SHA-256 of the file content and by the PDF backend that extracted them, since each backend
+    lays out the text in its own way. A file that changes is never served stale text. To avoid
+    hashing every file on every run, the hash of each path is remembered together with its size and mtime and is only
+    recomputed when one of them changes.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            if conn.execute("PRAGMA user_version").fetchone()[0] != PAGE_CACHE_SCHEMA_VERSION:
+                conn.execute("DROP TABLE IF EXISTS pages")
+                conn.execute("DROP TABLE IF EXISTS documents")
+                conn.execute(f"PRAGMA user_version = {PAGE_CACHE_SCHEMA_VERSION}")
+            conn.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, "
+                         "hash TEXT)")
+            conn.execute("CREATE TABLE IF NOT EXISTS documents (hash TEXT, backend TEXT, page_count INTEGER, "
+                         "PRIMARY KEY (hash, backend))")
+            conn.execute("CREATE TABLE IF NOT EXISTS pages (hash TEXT, backend TEXT, page_num INTEGER, text TEXT, "
+                         "PRIMARY KEY (hash, backend, page_num))")
+
+    def _connect(self):
+        # One connection per operation, so the cache can be shared between threads and processes
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def get_file_hash(self, path) -> str:
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        with closing(self._connect()) as conn, conn:
+            row = conn.execute("SELECT size, mtime_ns, hash FROM files WHERE path = ?", (path,)).fetchone()
+            if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+                return row[2]
+
+            file_hash = compute_file_hash(path)
+            conn.execute("INSERT OR REPLACE INTO files (path, size, mtime_ns, hash) VALUES (?, ?, ?, ?)",
+                         (path, stat.st_size, stat.st_mtime_ns, file_hash))
+            return file_hash
+
+    def get_page_texts(self, path) -> Optional[List[str]]:
+        """Returns the cached text of each page of the file, or None if the current content of the file is unknown."""
+        file_hash = self.get_file_hash(path)
+        backend = get_pdf_backend().name
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT page_count FROM documents WHERE hash = ? AND backend = ?",
+                               (file_hash, backend)).fetchone()
+            if row is None:
+                return None
+            texts = [""] * row[0]
+            for page_num, text in conn.execute("SELECT page_num, text FROM pages WHERE hash = ? AND backend = ?",
+                                               (file_hash, backend)):
+                texts[page_num] = text
+            return texts
+
+    def store_page_texts(self, path, texts: List[str]):
+        file_hash = self.get_file_hash(path)
+        backend = get_pdf_backend().name
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM pages WHERE hash = ? AND backend = ?", (file_hash, backend))
+            conn.executemany("INSERT INTO pages (hash, backend, page_num, text) VALUES (?, ?, ?, ?)",
+                             [(file_hash, backend, page_num, text) for page_num, text in enumerate(texts)])
+            conn.execute("INSERT OR REPLACE INTO documents (hash, backend, page_count) VALUES (?, ?, ?)",
+                         (file_hash, backend, len(texts)))
+
+    def get_or_extract(self, path, extract: Callable[[str], List[str]]) -> List[str]:
+        texts = self.get_page_texts(path)
+        if texts is None:
+            texts = extract(path)
+            self.store_page_texts(path, texts)
+        return texts
+
+    def prune(self):
+        """Forgets paths that do not exist anymore and the texts of content that no path points to."""
+        with closing(self._connect()) as conn, conn:
+            paths = [row[0] for row in conn.execute("SELECT path FROM files")]
+            conn.executemany("DELETE FROM files WHERE path = ?", [(p,) for p in paths if not os.path.exists(p)])
+            conn.execute("DELETE FROM documents WHERE hash NOT IN (SELECT hash FROM files)")
+            conn.execute("DELETE FROM pages WHERE (hash, backend) NOT IN (SELECT hash, backend FROM documents)")
+
+    def purge(self):
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM pages")
+            conn.execute("DELETE FROM documents")
+            conn.execute("DELETE FROM files")
+        with closing(self._connect()) as conn:
+            conn.execute("VACUUM")
+
+
+def list_pdfs(folder) -> List[str]:
+    pdf_paths = []
+    for root, dirs, files in os.walk(folder):
+        for file_name in files:
+            if file_name.lower().endswith(".pdf"):
+                pdf_paths.append(os.path.join(root, file_name))
+    pdf_paths.sort()
+    return pdf_paths
+
+
+def _create_page_cache():
+    return PageTextCache(os.path.join(CACHE_FOLDER, PAGE_CACHE_FILENAME))
+
+
+def get_page_cache() -> Optional[PageTextCache]:
+    if not hasattr(get_page_cache, "_instance"):
+        get_page_cache._instance = _create_page_cache()
+    return get_page_cache._instance
+
+
+def set_page_cache(cache: Optional[PageTextCache]):
+    """Replaces the shared page cache. Setting it to None disables the cache and texts are always extracted."""
+    get_page_cache._instance = cache
+
+
+def warm_page_cache(input_folder, workers=1):
+    from pdf import get_page_texts, set_scan_workers, get_many_page_texts, shutdown_scan_pool  # pdf.py imports us
+
+    pdf_paths = list_pdfs(input_folder)
+    if workers > 1:
+        set_scan_workers(workers)
+        try:
+            get_many_page_texts(pdf_paths)
+        except Exception as e:
+            print(f"Could not extract all the PDFs in parallel, extracting them one by one. Error: {e}")
+        finally:
+            shutdown_scan_pool()
+    for i, pdf_path in enumerate(pdf_paths):
+        try:
+            texts = get_page_texts(pdf_path)
+        except Exception as e:
+            print(f"Could not extract text from {pdf_path}: {e}")
+            continue
+        print(f"[{i + 1}/{len(pdf_paths)}] {pdf_path}: {len(texts)} pages")
+    get_page_cache().prune()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the page text cache of Justicier")
+    parser.add_argument("-w", "--warm", required=False, nargs="?", const=os.path.join(ROOT_FOLDER, "input"),
+                        help="Extract and store the text of every PDF in the input folder (default: ./input).")
+    parser.add_argument("-p", "--purge", action="store_true", help="Delete every entry of the cache.")
+    parser.add_argument("-j", "--workers", type=int, default=1,
+                        help="Number of processes used to extract the text of the PDFs when warming the cache.")
+    parser.add_argument("-b", "--pdf-backend", type=parse_pdf_backend, default=get_pdf_backend().name,
+                        help="PDF backend whose texts are warmed. Use the same one as the justifications.")
+    args = parser.parse_args()
+    set_pdf_backend(args.pdf_backend)
+
+    if not args.warm and not args.purge:
+        parser.error("Nothing to do. Use --warm and/or --purge.")
+
+    if args.purge:
+        get_page_cache().purge()
+        print("Page text cache purged.")
+    if args.warm:
+        warm_page_cache(args.warm, args.workers)
+        print("Page text cache warmed.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,36 +1,266 @@
-import locale
+import contextvars
 import logging
+import multiprocessing
 import os
 import re
 import shutil
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from typing import List, Tuple
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
 
-import PyPDF2
-from pypdf import PdfReader, PdfWriter
+from pypdf import PdfReader
+from pypdf.generic import DictionaryObject
 
-from data import unparse_month
+try:  # Parses the /Encoding and /ToUnicode of fonts. Private to pypdf, so the prefilter can do without it
+    from pypdf._cmap import get_encoding as get_font_encoding
+except ImportError:
+    get_font_encoding = None
+
+from data import unparse_month, parse_spanish_date, SPANISH_MONTHS
 from filesystem import list_dir
 from logger import get_logger, get_logger_instance, build_process_logger
 from custom_except import UndefinedRegularSalaryType
-from defines import RegularSalaryType, SALARIES_AND_PROOFS_OUTPUT_NAME
+from defines import RegularSalaryType, SALARIES_AND_PROOFS_OUTPUT_NAME, NAF_PATTERN, NAF_RNT_PATTERN, DNI_PATTERN
+from page_cache import get_page_cache
+from pdf_backend import Document, Page, PYPDF_BACKEND, get_pdf_backend, set_pdf_backend
 
 
-def get_dni(pdf_path: str) -> str:
-    # Open PDF
-    reader = PdfReader(pdf_path)
+class SharedReaders:
+    """
+    Readers of the PDFs opened with open_pdf, kept so each input PDF is parsed only once (batch mode). At most
+    max_readers stay open: the least recently used one is closed when a new PDF is opened.
+
+    The pages of a reader are used by the thread that obtained it until it opens the next PDF, so the reader obtained
+    last by each thread is leased to it and is not evicted while there are other readers to evict. Only with more
+    threads than max_readers a leased reader is evicted, and it is closed when its last thread moves on (or calls
+    release).
+    """
+
+    def __init__(self, max_readers: int):
+        self.max_readers = max_readers
+        self.readers: "OrderedDict[str, Document]" = OrderedDict()
+        # Evicted readers still leased to some thread, by id of the reader
+        self.retired: Dict[int, Document] = {}
+        # Number of threads that lease each reader, by id of the reader
+        self.users: Dict[int, int] = {}
+        self.leases = threading.local()
+        self.lock = threading.Lock()
+
+    def open(self, pdf_path) -> Document:
+        key = os.path.abspath(pdf_path)
+        with self.lock:
+            document = self.readers.get(key)
+            if document is not None:
+                self.readers.move_to_end(key)
+            else:
+                self._release()
+                while len(self.readers) >= self.max_readers:
+                    self._evict()
+                document = get_pdf_backend().open(pdf_path)
+                self.readers[key] = document
+            if getattr(self.leases, "document", None) is not document:
+                self._release()
+                self.leases.document = document
+                self.users[id(document)] = self.users.get(id(document), 0) + 1
+            return document
+
+    def _evict(self):
+        # The least recently used reader that no thread is using. If all of them are in use, the least recently used
+        # one stays open until its threads move on
+        for key, document in self.readers.items():
+            if self.users.get(id(document), 0) == 0:
+                del self.readers[key]
+                get_pdf_backend().close(document)
+                return
+        _, document = self.readers.popitem(last=False)
+        self.retired[id(document)] = document
+
+    def _release(self):
+        document = getattr(self.leases, "document", None)
+        if document is None:
+            return
+        self.leases.document = None
+        self.users[id(document)] -= 1
+        if self.users[id(document)] == 0:
+            del self.users[id(document)]
+            if self.retired.pop(id(document), None) is not None:
+                get_pdf_backend().close(document)
+
+    def release(self):
+        """The current thread does not use the pages of the reader it obtained last anymore."""
+        with self.lock:
+            self._release()
+
+    def count(self) -> int:
+        """Readers open at the moment."""
+        with self.lock:
+            return len(self.readers) + len(self.retired)
+
+    def close(self):
+        with self.lock:
+            for document in list(self.readers.values()) + list(self.retired.values()):
+                get_pdf_backend().close(document)
+            self.readers.clear()
+            self.retired.clear()
+
+
+# When not None, readers opened with open_pdf are shared (batch mode)
+shared_readers: Optional[SharedReaders] = None
+# Maximum number of shared readers kept open at once
+max_open_readers = 64
+
+
+def share_readers(enabled: bool):
+    """Keeps the PDFs opened with open_pdf in memory until sharing is disabled again, which closes them."""
+    global shared_readers
+    if shared_readers is not None:
+        shared_readers.close()
+    shared_readers = SharedReaders(max_open_readers) if enabled else None
+
+
+def set_max_open_readers(max_readers: int):
+    global max_open_readers
+    max_open_readers = max(1, max_readers)
+    if shared_readers is not None:
+        shared_readers.max_readers = max_open_readers
+
+
+def open_pdf(pdf_path) -> Document:
+    if shared_readers is None:
+        return get_pdf_backend().open(pdf_path)
+    return shared_readers.open(pdf_path)
+
+
+def release_pdf():
+    """Tells the shared readers that the current thread is done with the pages of the last PDF it opened."""
+    if shared_readers is not None:
+        shared_readers.release()
+
+
+# Number of processes used to scan PDF pages. With 1, pages are scanned sequentially in the current process
+scan_workers = 1
+scan_pool = None
+# Documents are split in ranges of this many pages, so a big document can be scanned by several processes at once
+PAGES_PER_SCAN_TASK = 25
+
+
+def set_scan_workers(workers: int):
+    global scan_workers
+    shutdown_scan_pool()
+    scan_workers = max(1, workers)
+
+
+def get_scan_pool() -> ProcessPoolExecutor:
+    global scan_pool
+    if scan_pool is None:
+        # Spawn instead of fork, because the scans can be requested from threads of the main process
+        scan_pool = ProcessPoolExecutor(max_workers=scan_workers, mp_context=multiprocessing.get_context("spawn"),
+                                        initializer=set_pdf_backend, initargs=(get_pdf_backend().name,))
+    return scan_pool
+
+
+def shutdown_scan_pool():
+    global scan_pool
+    if scan_pool is not None:
+        scan_pool.shutdown()
+        scan_pool = None
+
+
+def get_page_count(pdf_path) -> int:
+    backend = get_pdf_backend()
+    document = backend.open(pdf_path)
+    try:
+        return len(backend.pages(document))
+    finally:
+        backend.close(document)
+
+
+def split_scan_tasks(pdf_paths) -> List[Tuple[str, int, int]]:
+    """Splits the documents in (path, first page, page after the last) ranges, in document and page order."""
+    tasks = []
+    for pdf_path in pdf_paths:
+        page_count = get_page_count(pdf_path)
+        for start in range(0, page_count, PAGES_PER_SCAN_TASK):
+            tasks.append((pdf_path, start, min(start + PAGES_PER_SCAN_TASK, page_count)))
+    return tasks
+
+
+def extract_page_range_texts(pdf_path, start, stop) -> List[str]:
+    backend = get_pdf_backend()
+    document = backend.open(pdf_path)
+    try:
+        pages = backend.pages(document)
+        return [backend.page_text(pages[page_num]) for page_num in range(start, stop)]
+    finally:
+        backend.close(document)
+
+
+def scan_page_range(pdf_path, start, stop, query_string: str, pattern: str) -> List[int]:
+    """Returns the numbers of the pages in the range where the pattern has a match equal to the query string."""
+    compiled = re.compile(pattern)
+    page_nums = []
+    for page_num, text in enumerate(extract_page_range_texts(pdf_path, start, stop), start):
+        if query_string in compiled.findall(text):
+            page_nums.append(page_num)
+    return page_nums
+
+
+def extract_many_page_texts(pdf_paths) -> Dict[str, List[str]]:
+    """
+    Extracts the text of every page of several PDFs. When there are scan workers, files and page ranges of big files
+    are distributed between them, but the result is the same as extracting each file sequentially.
+    """
+    if scan_workers <= 1:
+        return {pdf_path: extract_page_range_texts(pdf_path, 0, get_page_count(pdf_path))
+                for pdf_path in pdf_paths}
 
-    # Define regex pattern to search for "Z1234567Z or 12345678Z" and extract dni number
-    pattern = re.compile("[A-Z]\\d{7}[A-Z]|\\d{8}[A-Z]")
+    tasks = split_scan_tasks(pdf_paths)
+    futures = [get_scan_pool().submit(extract_page_range_texts, *task) for task in tasks]
+    texts = {pdf_path: [] for pdf_path in pdf_paths}
+    for task, future in zip(tasks, futures):
+        texts[task[0]].extend(future.result())
+    return texts
 
-    for page_num, page in enumerate(reader.pages):
-        # Get text of the page
-        text = page.extract_text()
 
+def extract_page_texts(pdf_path) -> List[str]:
+    return extract_many_page_texts([pdf_path])[pdf_path]
+
+
+def get_many_page_texts(pdf_paths) -> Dict[str, List[str]]:
+    """Same as get_page_texts for several PDFs, extracting all the ones missing in the cache in a single parallel scan."""
+    cache = get_page_cache()
+    if cache is None:
+        return extract_many_page_texts(pdf_paths)
+
+    texts = {}
+    missing = []
+    for pdf_path in pdf_paths:
+        texts[pdf_path] = cache.get_page_texts(pdf_path)
+        if texts[pdf_path] is None:
+            missing.append(pdf_path)
+    for pdf_path, extracted in extract_many_page_texts(missing).items():
+        cache.store_page_texts(pdf_path, extracted)
+        texts[pdf_path] = extracted
+    return texts
+
+
+def get_page_texts(pdf_path) -> List[str]:
+    """Returns the text of each page of the PDF, from the page cache if the file has already been seen."""
+    cache = get_page_cache()
+    if cache is None:
+        return extract_page_texts(pdf_path)
+    return cache.get_or_extract(pdf_path, extract_page_texts)
+
+
+def get_dni(pdf_path: str) -> str:
+    for page_num, text in enumerate(get_page_texts(pdf_path)):
         if not text:
             continue
 
-        match = pattern.search(text)
+        # Search for "Z1234567Z or 12345678Z" and extract dni number
+        match = DNI_REGEX.search(text)
         if not match:
             continue
 
@@ -39,148 +269,454 @@ def get_dni(pdf_path: str) -> str:
     raise ValueError("DNI could not be detected in PDF " + pdf_path)
 
 
-def write_page(page: PyPDF2.PageObject, path):
-    # Create a new PDF with only this page
-    writer = PdfWriter()
-    writer.add_page(page)
+class OutputAssembler:
+    """
+    Remembers where the page of each file written to an output folder comes from, so compacting the folder later builds
+    the merged PDF from the input PDFs with a single writer instead of reading back every single-page file. Pages that
+    come from the same input PDF share their fonts and other resources in the merged output. Only the path and number
+    of each page are kept, not the page, which would keep its whole input PDF in memory. The stages of a justification
+    write their pages from different threads to the same assembler.
+    """
 
-    with open(path, "wb+") as output_pdf:
-        writer.write(output_pdf)
-    pass
+    def __init__(self):
+        # Folder -> path of each written file -> (input PDF, page number, mtime of the input PDF, mtime of the file)
+        self.folders: Dict[str, Dict[str, Tuple[str, int, int, int]]] = {}
+        self.lock = threading.Lock()
+
+    def write_page(self, page: Page, path):
+        # The single-page file is still written right away, other stages and the upload use it
+        backend = get_pdf_backend()
+        writer = backend.new_writer()
+        backend.add_page(writer, page)
+        backend.write(writer, path)
+
+        source = backend.page_source(page)
+        if source is None:
+            return  # Compacted from the written file
+        source_path, page_num = source
+        path = os.path.abspath(path)
+        with self.lock:
+            self.folders.setdefault(os.path.dirname(path), {})[path] = (
+                source_path, page_num, os.stat(source_path).st_mtime_ns, os.stat(path).st_mtime_ns)
+
+    def get_sources(self, paths) -> Optional[List[Tuple[str, int]]]:
+        """
+        Input PDF and page number of the given files, or None if any of them was not written by the assembler or it or
+        its input PDF changed afterwards.
+        """
+        sources = []
+        for path in paths:
+            path = os.path.abspath(path)
+            with self.lock:
+                recorded = self.folders.get(os.path.dirname(path), {}).get(path)
+            if recorded is None or recorded[3] != os.stat(path).st_mtime_ns:
+                return None
+            source_path, page_num, source_mtime, _ = recorded
+            if not os.path.exists(source_path) or os.stat(source_path).st_mtime_ns != source_mtime:
+                return None
+            sources.append((source_path, page_num))
+        return sources
+
+    def write_merged(self, paths, output_path) -> bool:
+        sources = self.get_sources(paths)
+        if sources is None:
+            return False
+        backend = get_pdf_backend()
+        writer = backend.new_writer()
+        # Input PDFs opened here, when they are not shared. Each one is opened once for all its pages
+        opened = {}
+        try:
+            for source_path, page_num in sources:
+                if shared_readers is not None:
+                    document = open_pdf(source_path)
+                else:
+                    if source_path not in opened:
+                        opened[source_path] = backend.open(source_path)
+                    document = opened[source_path]
+                backend.add_page(writer, backend.pages(document)[page_num])
+            backend.write(writer, output_path)
+        finally:
+            for document in opened.values():
+                backend.close(document)
+        return True
 
+    def forget(self, folder):
+        with self.lock:
+            self.folders.pop(os.path.abspath(folder), None)
 
-def get_matching_pages(pdf_path, query_string: str, pattern: str = r"\d{2}/\d{8}-\d{2}") -> List[Tuple[PyPDF2.PageObject, int]]:
-    # Open PDF
-    reader = PdfReader(pdf_path)
+    def clear(self):
+        with self.lock:
+            self.folders.clear()
 
-    # Define regex pattern to search for "NN/NNNNNNNN-NN" and extract SS number
-    pattern = re.compile(pattern)
-    pages = []
 
-    for page_num, page in enumerate(reader.pages):
-        # Get text of the page
-        text = page.extract_text()
-        if not text:
-            continue
+# Used when no job has set its own assembler
+output_assembler = OutputAssembler()
+# Assembler of the job running in the current context (thread or asyncio task)
+job_output_assembler: contextvars.ContextVar = contextvars.ContextVar("output_assembler", default=None)
 
-        match = pattern.findall(text)
-        if not match:
-            continue
 
-        match_selected = None
-        for match_i in match:
-            if match_i.__eq__(query_string):
-                match_selected = match_i
-                break
+def get_output_assembler() -> OutputAssembler:
+    assembler = job_output_assembler.get()
+    return assembler if assembler is not None else output_assembler
 
-        if match_selected is not None:
-            pages.append((page, page_num))
-    return pages
 
+def set_output_assembler(assembler: OutputAssembler) -> contextvars.Token:
+    """Makes the pages written in the current context go to the given assembler, until reset_output_assembler."""
+    return job_output_assembler.set(assembler)
 
-def get_matching_page(pdf_path, query_string: str, pattern: str = r"\d{2}/\d{8}-\d{2}") -> PyPDF2.PageObject:
-    # Open PDF
-    reader = PdfReader(pdf_path)
 
-    # Define regex pattern to search for extract matches
-    pattern = re.compile(pattern)
+def reset_output_assembler(token: contextvars.Token):
+    job_output_assembler.reset(token)
 
-    for page_num, page in enumerate(reader.pages):
-        # Get text of the page
-        text = page.extract_text()
-        if not text:
-            continue
 
-        match = pattern.findall(text)
-        if not match:
-            continue
+def write_page(page: Page, path):
+    get_output_assembler().write_page(page, path)
 
-        match_selected = None
-        for match_i in match:
-            if str(match_i) == query_string:
-                match_selected = match_i
 
-        if match_selected is not None:
-            return page
+# When enabled, pages whose raw content can not show the queried identifier are discarded without extracting their text
+prefilter_enabled = False
 
-    raise ValueError("The string " + query_string + " can't be found in the file " + pdf_path)
 
+def set_prefilter(enabled: bool):
+    global prefilter_enabled
+    prefilter_enabled = enabled
 
-def parse_dates_from_delayed_salary(page):
-    logger = build_process_logger(get_logger_instance(), "parse_dates_from_delayed_salary")
-    # Define regex pattern to search for "NN/NNNNNNNN-NN" and extract SS number
-    query_str = r'\d{1,2}\s+(Enero|Febrero|Marzo|Abril|Mayo|Junio|Julio|Agosto|Septiembre|Octubre|Noviembre|Diciembre)\s+20\d{2}\s+a\s+\d{1,2}\s+(Enero|Febrero|Marzo|Abril|Mayo|Junio|Julio|Agosto|Septiembre|Octubre|Noviembre|Diciembre)\s+20\d{2}'  # Heuristic is to find "Atrasos" but appears two times on each page, so we are
-    # restricting the search with the beginning of the year, which appears in the line that
-    # we are interested in, which contains the date.
-    pattern = re.compile(query_str, re.MULTILINE)
 
-    text = page.extract_text()
-    if not text:
-        pass  # TODO exceptions
+def _read_literal_string(data: bytes, i: int) -> Tuple[bytes, int]:
+    """Decodes the PDF literal string that starts at data[i] == "(". Returns its bytes and the index after it."""
+    result = bytearray()
+    depth = 1
+    i += 1
+    while i < len(data):
+        c = data[i]
+        if c == 0x5C:  # Backslash
+            i += 1
+            if i >= len(data):
+                break
+            escaped = data[i]
+            if 0x30 <= escaped <= 0x37:  # Octal code of up to three digits
+                j = i
+                while j < len(data) and j < i + 3 and 0x30 <= data[j] <= 0x37:
+                    j += 1
+                result.append(int(data[i:j], 8) & 0xFF)
+                i = j
+                continue
+            result.append(escaped)
+        elif c == 0x28:  # Balanced parentheses are allowed without escaping
+            depth += 1
+            result.append(c)
+        elif c == 0x29:
+            depth -= 1
+            if depth == 0:
+                return bytes(result), i + 1
+            result.append(c)
+        else:
+            result.append(c)
+        i += 1
+    return bytes(result), i
+
+
+# Bytes that end a name or an operator in a content stream: whitespace and delimiters
+PDF_DELIMITERS = b" \t\r\n\f\x00/[]()<>{}%"
+
 
-    match = pattern.search(text)
-    if not match:
-        pass  # TODO exceptions
+def _read_name(data: bytes, i: int) -> Tuple[str, int]:
+    """Decodes the PDF name that starts at data[i] == "/". Returns it with its slash and the index after it."""
+    j = i + 1
+    while j < len(data) and data[j] not in PDF_DELIMITERS:
+        j += 1
+    name = re.sub(r"#([0-9A-Fa-f]{2})", lambda match: chr(int(match.group(1), 16)), data[i:j].decode("latin-1"))
+    return name, j
 
-    match = match.group(0)
-    match = match.replace("\n", "")
 
-    # Set locale to Spanish (you may need to install it depending on your OS)
-    locale.setlocale(locale.LC_TIME, 'es_ES.UTF-8')
+def get_shown_digits(content: bytes, code_maps: Optional[Dict[str, Dict[int, str]]] = None) -> str:
+    """
+    Concatenates the digits of every string operand of the content stream, ignoring everything else. Text-show
+    operators may split a number in several strings separated by kerning (e.g. [(08/041) -20 (35154-70)] TJ), so the
+    digits are joined across strings. The strings shown with a font of code_maps (by its resource name, as selected by
+    Tf) are translated through its map first.
+    """
+    digits = []
+    code_map = None
+    last_name = None
+    i = 0
+    while i < len(content):
+        c = content[i]
+        if c == 0x28:  # "(" literal string
+            string, i = _read_literal_string(content, i)
+            digits.append(get_string_digits(string, code_map))
+            continue
+        if c == 0x3C and content[i + 1:i + 2] == b"<":  # "<<" dictionary
+            i += 2
+            continue
+        if c == 0x3C:  # "<" hex string
+            end = content.find(b">", i)
+            if end == -1:
+                break
+            hex_string = re.sub(rb"\s", b"", content[i + 1:end])
+            if len(hex_string) % 2 == 1:
+                hex_string += b"0"
+            try:
+                digits.append(get_string_digits(bytes.fromhex(hex_string.decode("ascii")), code_map))
+            except ValueError:
+                pass
+            i = end + 1
+            continue
+        if c == 0x2F:  # "/" name, the font of a following Tf
+            last_name, i = _read_name(content, i)
+            continue
+        if (content[i:i + 2] == b"Tf" and (i == 0 or content[i - 1] in PDF_DELIMITERS) and
+                (i + 2 == len(content) or content[i + 2] in PDF_DELIMITERS)):
+            code_map = code_maps.get(last_name) if code_maps and last_name else None
+            i += 2
+            continue
+        i += 1
+    return "".join(digits)
 
-    # Split the string by ' a '
-    start_str, end_str = match.split(' a ')
 
-    # Parse both dates
-    start_date = datetime.strptime(start_str.strip(), '%d %B %Y')
-    end_date = datetime.strptime(end_str.strip(), '%d %B %Y')
-    return start_date, end_date
+def get_string_digits(string: bytes, code_map: Optional[Dict[int, str]] = None) -> str:
+    if code_map is None:
+        return re.sub(rb"\D", b"", string).decode("ascii")
+    return re.sub(r"[^0-9]", "", "".join(code_map.get(code, "") for code in string))
 
 
-def is_monthly_salary(salary_page):
-    # Get text of the page
-    text = salary_page.extract_text()
+def get_font_code_map(font) -> Optional[Dict[int, str]]:
+    """
+    Text of each code of a simple font with a /ToUnicode map, as pypdf extracts it: from the map, or from the encoding
+    for the codes missing in the map. None if pypdf can not parse the font.
+    """
+    if get_font_encoding is None:
+        return None
+    try:
+        encoding, to_unicode = get_font_encoding(font)
+    except Exception:
+        return None
+    code_map = {}
+    for code in range(256):
+        char = encoding.get(code, chr(code)) if isinstance(encoding, dict) else chr(code)
+        code_map[code] = to_unicode.get(char, char)
+    return code_map
+
+
+def get_prefilter_fonts(page) -> Optional[Dict[str, Dict[int, str]]]:
+    """
+    Code maps of the fonts of the page with a /ToUnicode map, by resource name. The digits of the other fonts are the
+    digits in the content stream.
 
-    if not text:
+    Returns None when the digits of the content stream can not be trusted: composite (Type0/CID) and Type3 fonts,
+    /Differences in the encoding, /ToUnicode maps pypdf can not parse, and inline images or form XObjects (which can
+    hide text in other streams).
+    """
+    code_maps = {}
+    resources = page.get("/Resources")
+    if resources is None:
+        return code_maps
+    resources = resources.get_object()
+    if "/XObject" in resources:
+        for xobject in resources["/XObject"].get_object().values():
+            if xobject.get_object().get("/Subtype") == "/Form":
+                return None
+    if "/Font" in resources:
+        for name, font in resources["/Font"].get_object().items():
+            font = font.get_object()
+            if font.get("/Subtype") in ("/Type0", "/Type3", "/CIDFontType0", "/CIDFontType2"):
+                return None
+            if "/DescendantFonts" in font:
+                return None
+            encoding = font.get("/Encoding")
+            if encoding is not None:
+                encoding = encoding.get_object()
+                if isinstance(encoding, DictionaryObject) and "/Differences" in encoding:
+                    return None
+            if "/ToUnicode" in font:
+                code_map = get_font_code_map(font)
+                if code_map is None:
+                    return None
+                code_maps[str(name)] = code_map
+    return code_maps
+
+
+def is_prefilter_decidable(page) -> bool:
+    """See get_prefilter_fonts."""
+    return get_prefilter_fonts(page) is not None
+
+
+def page_may_contain(page, query_string: str) -> bool:
+    """
+    Fast check on the raw content stream of the page. Returns False only when the digits of the query string are
+    surely not shown in the page, so its text does not need to be extracted.
+    """
+    query_digits = re.sub(r"\D", "", query_string)
+    if not query_digits:
+        return True
+    code_maps = get_prefilter_fonts(page)
+    if code_maps is None:
+        return True
+    contents = page.get_contents()
+    if contents is None:
         return False
+    content = contents.get_data()
+    if b"BI" in content and b"ID" in content:  # Inline image data may look like strings
+        return True
+    return query_digits in get_shown_digits(content, code_maps)
+
+
+def get_prefiltered_matching_page_nums(pdf_path, query_string: str, pattern: str = NAF_PATTERN) -> List[int]:
+    compiled = re.compile(pattern)
+    page_nums = []
+    for page_num, page in enumerate(open_pdf(pdf_path).pages):
+        if not page_may_contain(page, query_string):
+            continue
+        text = page.extract_text() or ""
+        if query_string in compiled.findall(text):
+            page_nums.append(page_num)
+    return page_nums
+
 
-    pattern = r".*Mensual -.*"
+def verify_prefilter(pdf_paths) -> Dict[str, int]:
+    """
+    Runs the prefilter against the full text extraction for every identifier found in every page of the PDFs and
+    prints each identifier the prefilter would have missed (false negatives).
+    """
+    counters = {"pages": 0, "undecidable_pages": 0, "identifiers": 0, "false_negatives": 0, "skipped_pages": 0}
+    for pdf_path in pdf_paths:
+        for page_num, page in enumerate(PdfReader(pdf_path).pages):
+            counters["pages"] += 1
+            if not is_prefilter_decidable(page):
+                counters["undecidable_pages"] += 1
+            text = page.extract_text() or ""
+            identifiers = set(NAF_REGEX.findall(text)) | set(NAF_RNT_REGEX.findall(text)) | set(DNI_REGEX.findall(text))
+            for identifier in sorted(identifiers):
+                counters["identifiers"] += 1
+                if not page_may_contain(page, identifier):
+                    counters["false_negatives"] += 1
+                    print(f"❌ False negative: {identifier} is in {pdf_path} page {str(page_num + 1)} but the "
+                          f"prefilter discards the page.")
+            # How often a page of another employee is skipped, using a NAF that does not exist as the query
+            if not page_may_contain(page, "99/99999999-99"):
+                counters["skipped_pages"] += 1
+    return counters
+
+
+def get_matching_page_nums(pdf_path, query_string: str, pattern: str = NAF_PATTERN) -> List[int]:
+    cache = get_page_cache()
+    # The prefilter reads the raw content streams of pypdf pages
+    if (prefilter_enabled and get_pdf_backend().name == PYPDF_BACKEND and
+            (cache is None or cache.get_page_texts(pdf_path) is None)):
+        # Texts extracted this way are partial, so they are not stored in the page cache
+        return get_prefiltered_matching_page_nums(pdf_path, query_string, pattern)
+
+    if cache is None and scan_workers > 1:
+        # Nothing to cache, so the scan processes only send back the numbers of the matching pages
+        tasks = split_scan_tasks([pdf_path])
+        futures = [get_scan_pool().submit(scan_page_range, *task, query_string, pattern) for task in tasks]
+        return [page_num for future in futures for page_num in future.result()]
+
+    # Define regex pattern to search for "NN/NNNNNNNN-NN" and extract SS number
     pattern = re.compile(pattern)
+    page_nums = []
+
+    for page_num, text in enumerate(get_page_texts(pdf_path)):
+        if not text:
+            continue
 
-    match = pattern.findall(text)
+        match = pattern.findall(text)
+        if not match:
+            continue
 
-    if not match:
-        return False
+        match_selected = None
+        for match_i in match:
+            if match_i.__eq__(query_string):
+                match_selected = match_i
+                break
 
-    match_selected = None
-    for match_i in match:
-        if match_i.__eq__(pattern):
-            match_selected = match_i
+        if match_selected is not None:
+            page_nums.append(page_num)
+    return page_nums
 
-    if match_selected is not None:
-        return True
-    return False
 
+def get_pages(pdf_path, page_nums: List[int]) -> List[Tuple[Page, int]]:
+    if len(page_nums) == 0:
+        return []
+    # Only open the PDF when there is some page to return
+    pages = get_pdf_backend().pages(open_pdf(pdf_path))
+    return [(pages[page_num], page_num) for page_num in page_nums]
 
-def is_settlement_salary(salary_page):
-    # Get text of the page
-    text = salary_page.extract_text()
-    if not text:
-        return False
 
-    pattern = r"Vacaciones Finiquito"
-    pattern = re.compile(pattern)
+def get_matching_pages(pdf_path, query_string: str, pattern: str = NAF_PATTERN) -> List[Tuple[Page, int]]:
+    return get_pages(pdf_path, get_matching_page_nums(pdf_path, query_string, pattern))
 
-    match = pattern.findall(text)
-    if match:
-        return True
-    return False
+
+def get_matching_page(pdf_path, query_string: str, pattern: str = NAF_PATTERN) -> Page:
+    page_nums = get_matching_page_nums(pdf_path, query_string, pattern)
+    if len(page_nums) == 0:
+        raise ValueError("The string " + query_string + " can't be found in the file " + pdf_path)
+    return get_pages(pdf_path, page_nums[:1])[0][0]
+
+
+# Patterns used to classify salary pages, compiled once for all the pages
+SPANISH_MONTH_PATTERN = "(" + "|".join(SPANISH_MONTHS.keys()) + ")"
+# Heuristic is to find "Atrasos" but appears two times on each page, so we are restricting the search with the
+# beginning of the year, which appears in the line that we are interested in, which contains the date.
+DELAY_PERIOD_REGEX = re.compile(r"(\d{1,2})\s+" + SPANISH_MONTH_PATTERN + r"\s+(20\d{2})\s+a\s+(\d{1,2})\s+" +
+                                SPANISH_MONTH_PATTERN + r"\s+(20\d{2})", re.MULTILINE)
+SPANISH_MONTH_REGEX = re.compile(r"\b" + SPANISH_MONTH_PATTERN + r"\b")
+MONTHLY_SALARY_REGEX = re.compile(r".*Mensual -.*")
+SETTLEMENT_SALARY_REGEX = re.compile(r"Vacaciones Finiquito")
+NAF_REGEX = re.compile(NAF_PATTERN)
+NAF_RNT_REGEX = re.compile(NAF_RNT_PATTERN)
+DNI_REGEX = re.compile(DNI_PATTERN)
 
 
-def parse_regular_salary_type(salary_page):
-    if is_monthly_salary(salary_page):  # For optimization first monthly because it is more common
+class PageFacts(NamedTuple):
+    """Everything the salary stages need to know about a page, obtained from a single extraction of its text."""
+    page_num: int
+    nafs: Set[str]
+    dnis: Set[str]
+    is_monthly: bool
+    is_settlement: bool
+    delay_period: Optional[Tuple[datetime, datetime]]
+    month_tokens: List[str]
+
+
+def classify_page_text(text: str, page_num: int) -> PageFacts:
+    delay_period = None
+    match = DELAY_PERIOD_REGEX.search(text)
+    if match:
+        delay_period = (parse_spanish_date(match.group(1), match.group(2), match.group(3)),
+                        parse_spanish_date(match.group(4), match.group(5), match.group(6)))
+
+    return PageFacts(page_num=page_num,
+                     nafs=set(NAF_REGEX.findall(text)),
+                     dnis=set(DNI_REGEX.findall(text)),
+                     is_monthly=MONTHLY_SALARY_REGEX.search(text) is not None,
+                     is_settlement=SETTLEMENT_SALARY_REGEX.search(text) is not None,
+                     delay_period=delay_period,
+                     month_tokens=SPANISH_MONTH_REGEX.findall(text))
+
+
+def get_pages_facts(pdf_path, page_nums: List[int]) -> List[Tuple[Page, PageFacts]]:
+    """Returns the given pages of the PDF with their facts, reusing the cached text of the pages when available."""
+    texts = get_page_texts(pdf_path) if get_page_cache() is not None else None
+    backend = get_pdf_backend()
+    pages_facts = []
+    for page, page_num in get_pages(pdf_path, page_nums):
+        text = texts[page_num] if texts is not None else backend.page_text(page)
+        pages_facts.append((page, classify_page_text(text, page_num)))
+    return pages_facts
+
+
+def parse_dates_from_delayed_salary(facts: PageFacts):
+    if facts.delay_period is None:
+        raise ValueError("The delay period (\"<day> <month> <year> a <day> <month> <year>\") was not found in page " +
+                         str(facts.page_num + 1))
+    return facts.delay_period
+
+
+def parse_regular_salary_type(facts: PageFacts):
+    if facts.is_monthly:  # For optimization first monthly because it is more common
         return RegularSalaryType.MONTHLY
-    elif is_settlement_salary(salary_page):
+    elif facts.is_settlement:
         return RegularSalaryType.SETTLEMENT
     else:
         raise UndefinedRegularSalaryType("The type was not recognized")
@@ -190,36 +726,36 @@ def merge_pdfs(pdf_paths, output_path, all_pages=False):
     """
     Merge multiple PDF files into a single PDF.
 
+    Inputs are opened one at a time and closed as soon as their pages are copied into the writer, so the memory used
+    by the readers does not grow with the number of merged documents.
+
     :param pdf_paths: List of paths to PDF files to merge.
     :param output_path: Path to save the merged PDF.
+    :param all_pages: Copy every page of each file instead of only the first one.
     """
-    # Assigning the pdfWriter() function to pdfWriter.
-    pdfWriter = PyPDF2.PdfWriter()
-    for filename in pdf_paths:  # Starting a for loop.
-        pdf_file = open(filename, 'rb')  # Opens each of the file paths in filename variable.
-        # Reads each of the files in the new variable you've created above and stores into memory.
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
-        if all_pages:
-            for i in range(len(pdf_reader.pages)):
-                pdfWriter.add_page(pdf_reader.pages[i])
-        else:
-            page = pdf_reader.pages[0]  # Documents of only one page, so we are interested in the first
-            pdfWriter.add_page(page)  # Adds each of the PDFs it's read to a new page.
-    f = open(output_path, 'wb')
-    # Writing the output file using the pdfWriter function.
-    pdfWriter.write(f)
-    f.close()
+    backend = get_pdf_backend()
+    writer = backend.new_writer()
+    for pdf_path in pdf_paths:
+        document = backend.open(pdf_path)
+        try:
+            pages = backend.pages(document)
+            if all_pages:
+                for page in pages:
+                    backend.add_page(writer, page)
+            else:
+                backend.add_page(writer, pages[0])  # Documents of only one page, so we are interested in the first
+        finally:
+            backend.close(document)
+    backend.write(writer, output_path)
 
 
 def is_date_present_in_rlc_delay(delay_begin, delay_end, document_path):
     logger = build_process_logger(get_logger_instance(), "Salaries and RLCs L03 is_date_present_in_rlc_delay")
-    reader = PdfReader(document_path)
     query_string = (unparse_month(delay_begin) + "/" + delay_begin.year.__str__() + " - " + unparse_month(delay_end)
                     + "/" + delay_end.year.__str__())
     pattern = re.compile(query_string)
 
-    for page_num, page in enumerate(reader.pages):
-        text = page.extract_text()
+    for page_num, text in enumerate(get_page_texts(document_path)):
         if not text:
             continue
 
@@ -253,7 +789,12 @@ def compact_folder(path_folder):
     paths.sort()
     for i in range(len(paths)):
         paths[i] = os.path.join(path_folder, paths[i])
-    merge_pdfs(paths, path_folder + ".pdf", True)
+    assembler = get_output_assembler()
+    if assembler.write_merged(paths, path_folder + ".pdf"):
+        logger.debug(f"Folder {path_folder} compacted from the input PDFs.")
+    else:
+        merge_pdfs(paths, path_folder + ".pdf", True)
+    assembler.forget(path_folder)
     shutil.rmtree(path_folder)
 
 
@@ -0,0 +1,149 @@
+import os
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from pypdf import PdfReader, PdfWriter
+
+try:
+    import fitz  # PyMuPDF, optional faster engine
+except ImportError:
+    fitz = None
+
+PYPDF_BACKEND = "pypdf"
+PYMUPDF_BACKEND = "pymupdf"
+
+# Opaque objects of the selected backend. Only the backend that created them knows what is inside
+Document = Any
+Page = Any
+Writer = Any
+
+
+class PdfBackend:
+    """
+    Operations on PDFs needed by Justicier. Every read and write of PDF files in pdf.py goes through the selected
+    backend, so the engine can be swapped without touching the stages.
+    """
+    name = ""
+
+    def open(self, pdf_path) -> Document:
+        raise NotImplementedError
+
+    def close(self, document: Document):
+        pass
+
+    def pages(self, document: Document) -> List[Page]:
+        raise NotImplementedError
+
+    def page_text(self, page: Page) -> str:
+        raise NotImplementedError
+
+    def page_source(self, page: Page) -> Optional[Tuple[str, int]]:
+        """Path of the PDF the page was read from and its page number, or None if it is not known."""
+        return None
+
+    def new_writer(self) -> Writer:
+        raise NotImplementedError
+
+    def add_page(self, writer: Writer, page: Page):
+        """Copies the page into the writer. After that, the document of the page can be closed."""
+        raise NotImplementedError
+
+    def write(self, writer: Writer, output_path):
+        """Writes the PDF, storing only once the objects (fonts, images...) shared by several of its pages."""
+        raise NotImplementedError
+
+
+class PypdfBackend(PdfBackend):
+    """Pure Python implementation, always available."""
+    name = PYPDF_BACKEND
+
+    def open(self, pdf_path) -> PdfReader:
+        reader = PdfReader(pdf_path)
+        reader.source_path = os.path.abspath(pdf_path)
+        return reader
+
+    def pages(self, document: PdfReader):
+        return document.pages
+
+    def page_text(self, page) -> str:
+        return page.extract_text() or ""
+
+    def page_source(self, page) -> Optional[Tuple[str, int]]:
+        source_path = getattr(page.pdf, "source_path", None)
+        if source_path is None or page.page_number < 0:
+            return None
+        return source_path, page.page_number
+
+    def new_writer(self) -> PdfWriter:
+        return PdfWriter()
+
+    def add_page(self, writer: PdfWriter, page):
+        writer.add_page(page)
+
+    def write(self, writer: PdfWriter, output_path):
+        writer.compress_identical_objects()
+        with open(output_path, "wb") as output_pdf:
+            writer.write(output_pdf)
+
+
+class PymupdfPage(NamedTuple):
+    # PyMuPDF pages can not outlive their document, so the page keeps the document alive
+    document: Any
+    page_num: int
+
+
+class PymupdfBackend(PdfBackend):
+    """Implementation over the MuPDF C library. Needs the optional PyMuPDF package."""
+    name = PYMUPDF_BACKEND
+
+    def open(self, pdf_path):
+        return fitz.open(pdf_path)
+
+    def close(self, document):
+        document.close()
+
+    def pages(self, document) -> List[PymupdfPage]:
+        return [PymupdfPage(document, page_num) for page_num in range(document.page_count)]
+
+    def page_text(self, page: PymupdfPage) -> str:
+        return page.document[page.page_num].get_text()
+
+    def page_source(self, page: PymupdfPage) -> Optional[Tuple[str, int]]:
+        if not page.document.name:
+            return None
+        return os.path.abspath(page.document.name), page.page_num
+
+    def new_writer(self):
+        return fitz.open()
+
+    def add_page(self, writer, page: PymupdfPage):
+        writer.insert_pdf(page.document, from_page=page.page_num, to_page=page.page_num)
+
+    def write(self, writer, output_path):
+        writer.save(output_path, garbage=3, deflate=True)
+        writer.close()
+
+
+BACKENDS: Dict[str, type] = {PYPDF_BACKEND: PypdfBackend, PYMUPDF_BACKEND: PymupdfBackend}
+
+
+def get_available_backends() -> List[str]:
+    return [name for name in BACKENDS if name != PYMUPDF_BACKEND or fitz is not None]
+
+
+def parse_pdf_backend(value: str) -> str:
+    value = value.strip().lower()
+    if value not in BACKENDS:
+        raise ValueError(f"Unknown PDF backend {value}. Possible values are: {', '.join(BACKENDS.keys())}")
+    if value not in get_available_backends():
+        raise ValueError(f"PDF backend {value} is not available. Install PyMuPDF to use it.")
+    return value
+
+
+def get_pdf_backend() -> PdfBackend:
+    if not hasattr(get_pdf_backend, "_instance"):
+        get_pdf_backend._instance = PypdfBackend()
+    return get_pdf_backend._instance
+
+
+def set_pdf_backend(name: str):
+    get_pdf_backend._instance = BACKENDS[parse_pdf_backend(name)]()
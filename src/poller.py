@@ -0,0 +1,121 @@
+import argparse
+import json
+import os
+import threading
+from typing import Dict, Set
+
+from TokenManager import get_token_manager
+from defines import CACHE_FOLDER, WORKER_QUEUE_FOLDER
+from logger import build_process_logger, get_console_logger, set_logger
+from secret import read_secret
+from sharepoint import get_requests_from_list, parse_request_fields, resolve_user_emails
+from worker import submit_job
+
+# Values of Estatworkflow of the requests already taken by Justicier. Any other value means the request is pending
+STARTED_STATES = ["En execució", "Completat", "Error"]
+# Seconds between queries of the list
+POLLER_INTERVAL = 60.0
+POLLER_STATE_FILENAME = "poller_submitted.json"
+
+
+def is_pending(fields: dict) -> bool:
+    return fields.get("Estatworkflow") not in STARTED_STATES
+
+
+def load_submitted(state_path) -> Set[str]:
+    try:
+        with open(state_path, "r", encoding="utf-8") as f:
+            return set(json.load(f))
+    except (OSError, ValueError):
+        return set()
+
+
+def save_submitted(state_path, submitted: Set[str]):
+    os.makedirs(os.path.dirname(state_path), exist_ok=True)
+    temporary_path = state_path + "." + str(os.getpid()) + ".tmp"
+    with open(temporary_path, "w", encoding="utf-8") as f:
+        json.dump(sorted(submitted), f)
+    os.replace(temporary_path, state_path)
+
+
+def get_pending_requests(items) -> Dict[str, dict]:
+    """
+    Configuration of each pending request of the list items, by request ID. The authors without email in the list are
+    resolved together, with a single lookup of their names.
+    """
+    configs = {}
+    creators = {}
+    for item in items:
+        fields = item.get("fields", {})
+        if is_pending(fields):
+            request = str(item["id"])
+            configs[request] = parse_request_fields(fields)
+            creators[request] = item.get("createdBy", {}).get("user", {}).get("email")
+
+    names = [config["author"] for config in configs.values()
+             if not config["author_email"] and isinstance(config["author"], str)]
+    emails = resolve_user_emails(names) if names else {}
+    for request, config in configs.items():
+        if not config["author_email"]:
+            # The creator of the item is the last resort, usually the same person that requests the justification
+            config["author_email"] = emails.get(config["author"]) or creators[request]
+    return configs
+
+
+def poll(queue_folder, submitted: Set[str], state_path) -> Set[str]:
+    """
+    Reads the list of requests once and submits a job to the worker for each pending request not submitted yet, with
+    its configuration. The submitted requests are saved in state_path after each job, so a poller that stops halfway
+    does not submit them again. Returns the requests submitted so far that are still pending.
+    """
+    logger = build_process_logger(get_console_logger(), "Poller")
+    items = get_requests_from_list(read_secret("SHAREPOINT_DOMAIN"), read_secret("SITE_NAME"),
+                                   read_secret("SHAREPOINT_LIST_NAME"), extra_fields="Estatworkflow")
+    pending = {str(item["id"]) for item in items if is_pending(item.get("fields", {}))}
+    # Requests submitted before are still waiting in the queue of the worker
+    configs = get_pending_requests([item for item in items if str(item["id"]) not in submitted])
+    for request, config in sorted(configs.items(), key=lambda entry: int(entry[0])):
+        job_name = submit_job(queue_folder, ["--id", request], config)
+        logger.info(f"Request {request} \"{config['Title']}\" submitted as job {job_name}.")
+        submitted.add(request)
+        save_submitted(state_path, submitted)
+    # Requests taken by the worker are forgotten, so a request that is set back to pending is submitted again
+    return submitted & pending
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Justicier poller",
+                                     epilog="Submits the pending requests of the Microsoft List to the queue of "
+                                            "src/worker.py.")
+    parser.add_argument("--queue", default=WORKER_QUEUE_FOLDER,
+                        help="Folder of the queue of jobs of the worker.")
+    parser.add_argument("--interval", type=float, default=POLLER_INTERVAL,
+                        help="Seconds between queries of the list.")
+    parser.add_argument("--once", action="store_true",
+                        help="Query the list a single time and exit.")
+    args = parser.parse_args()
+
+    console_logger = get_console_logger()
+    set_logger(console_logger)
+    logger = build_process_logger(console_logger, "Poller")
+    get_token_manager().start_background_refresh()
+
+    state_path = os.path.join(CACHE_FOLDER, POLLER_STATE_FILENAME)
+    submitted = load_submitted(state_path)
+    stop = threading.Event()
+    while not stop.is_set():
+        try:
+            submitted = poll(args.queue, submitted, state_path)
+            save_submitted(state_path, submitted)
+        except Exception as e:
+            if args.once:
+                raise
+            logger.error(f"The list of requests could not be read. Trying again in {args.interval:.0f}s. Error is: "
+                         f"{str(e)}")
+        if args.once:
+            break
+        stop.wait(args.interval)
+
+
+if __name__ == "__main__":
+    main()
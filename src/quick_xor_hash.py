@@ -0,0 +1,128 @@
+import base64
+import os
+import sqlite3
+from contextlib import closing
+from typing import Optional
+
+from defines import CACHE_FOLDER
+
+try:
+    import numpy as np  # Optional, folds the chunks of big files faster. It is installed with pandas
+except ImportError:
+    np = None
+
+FILE_HASH_CACHE_FILENAME = "quick_xor_hash.sqlite3"
+
+# quickXorHash XORs the bytes into a 160 bit state, each byte 11 bits further than the previous one
+QUICK_XOR_WIDTH = 160
+QUICK_XOR_SHIFT = 11
+
+
+def fold_columns(chunk: bytes) -> int:
+    """XOR of the rows of 160 bytes of the chunk, as a little-endian integer: its byte i is the column i."""
+    if np is not None:
+        padding = -len(chunk) % QUICK_XOR_WIDTH
+        rows = np.frombuffer(chunk + bytes(padding), dtype=np.uint8).reshape(-1, QUICK_XOR_WIDTH)
+        return int.from_bytes(np.bitwise_xor.reduce(rows, axis=0).tobytes(), "little")
+    folded = 0
+    for begin in range(0, len(chunk), QUICK_XOR_WIDTH):
+        folded ^= int.from_bytes(chunk[begin:begin + QUICK_XOR_WIDTH], "little")
+    return folded
+
+
+def compute_quick_xor_hash(path, chunk_size=QUICK_XOR_WIDTH * 8192) -> str:
+    """
+    Returns the quickXorHash of a file, the hash that Graph gives for the files of SharePoint and OneDrive for Business.
+    The file is read in chunks.
+
+    Bytes whose positions differ by a multiple of 160 land on the same bits of the state, so each chunk is folded into
+    160 columns first and only the columns are shifted into the state.
+    """
+    columns = 0
+    length = 0
+    with open(path, "rb") as f:
+        # Chunks are multiples of 160 bytes, so every chunk begins at column 0
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            length += len(chunk)
+            columns ^= fold_columns(chunk)
+
+    state = 0
+    for column, value in enumerate(columns.to_bytes(QUICK_XOR_WIDTH, "little")):
+        state ^= value << (column * QUICK_XOR_SHIFT % QUICK_XOR_WIDTH)
+    # Bits shifted past the end of the state wrap around to its beginning
+    state = (state & ((1 << QUICK_XOR_WIDTH) - 1)) ^ (state >> QUICK_XOR_WIDTH)
+    # The length, as 8 little-endian bytes, is XORed into the last 8 bytes
+    state ^= length << (QUICK_XOR_WIDTH - 64)
+    return base64.b64encode(state.to_bytes(QUICK_XOR_WIDTH // 8, "little")).decode("ascii")
+
+
+class FileHashCache:
+    """
+    On-disk store of the quickXorHash of local files, keyed by path and only recomputed when the size or mtime of the
+    file changes, so comparing a folder with SharePoint does not read every file on every run.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, "
+                         "quick_xor_hash TEXT)")
+
+    def _connect(self):
+        # One connection per operation, so the cache can be shared between threads and processes
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def get_quick_xor_hash(self, path) -> str:
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT size, mtime_ns, quick_xor_hash FROM files WHERE path = ?", (path,)).fetchone()
+        if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            return row[2]
+        quick_xor_hash = compute_quick_xor_hash(path)
+        self.store_quick_xor_hash(path, quick_xor_hash, stat)
+        return quick_xor_hash
+
+    def store_quick_xor_hash(self, path, quick_xor_hash, stat=None):
+        """Records the hash of a file whose content is known, e.g. because it has just been downloaded."""
+        path = os.path.abspath(path)
+        stat = stat or os.stat(path)
+        with closing(self._connect()) as conn, conn:
+            conn.execute("INSERT OR REPLACE INTO files (path, size, mtime_ns, quick_xor_hash) VALUES (?, ?, ?, ?)",
+                         (path, stat.st_size, stat.st_mtime_ns, quick_xor_hash))
+
+
+def _create_file_hash_cache():
+    return FileHashCache(os.path.join(CACHE_FOLDER, FILE_HASH_CACHE_FILENAME))
+
+
+def get_file_hash_cache() -> Optional[FileHashCache]:
+    if not hasattr(get_file_hash_cache, "_instance"):
+        get_file_hash_cache._instance = _create_file_hash_cache()
+    return get_file_hash_cache._instance
+
+
+def set_file_hash_cache(cache: Optional[FileHashCache]):
+    """Replaces the shared hash cache. Setting it to None makes every comparison hash the local file again."""
+    get_file_hash_cache._instance = cache
+
+
+def get_local_quick_xor_hash(path) -> str:
+    file_hash_cache = get_file_hash_cache()
+    if file_hash_cache is None:
+        return compute_quick_xor_hash(path)
+    return file_hash_cache.get_quick_xor_hash(path)
+
+
+def get_remote_quick_xor_hash(item: dict) -> Optional[str]:
+    """quickXorHash of a Graph driveItem, None if Graph did not give it (folders, or files still being processed)."""
+    return item.get("file", {}).get("hashes", {}).get("quickXorHash")
+
+
+def is_same_content(local_path, size: Optional[int], remote_hash: Optional[str]) -> bool:
+    """True if the local file has the given size and quickXorHash, those of a file of SharePoint."""
+    if remote_hash is None or not os.path.isfile(local_path) or os.path.getsize(local_path) != size:
+        return False
+    return get_local_quick_xor_hash(local_path) == remote_hash
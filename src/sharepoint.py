@@ -1,40 +1,135 @@
+import contextvars
+import functools
+import hashlib
 import json
-import logging
 import os
+import shutil
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, List, Set, Tuple
 
 import requests
 from requests.exceptions import HTTPError
 
 from TokenManager import TokenManager, get_token_manager
-from logger import build_process_logger
+from custom_except import DeltaLinkExpired
+from defines import CACHE_FOLDER
+from graph import GRAPH_URL, get_graph_client
+from logger import build_process_logger, get_logger_instance, submit_with_context
+from manifest import is_file_in_scope, is_folder_in_scope
+from metadata_cache import get_metadata_cache
+from quick_xor_hash import get_file_hash_cache, get_remote_quick_xor_hash, is_same_content
 from secret import read_secret
-from urllib.parse import quote
+from urllib.parse import quote, urlencode
+
+DOWNLOAD_MODES = ["full", "delta", "planned"]
+
+# Files downloaded at once. Folders are also listed concurrently
+DOWNLOAD_WORKERS = 8
+# Files uploaded at once
+UPLOAD_WORKERS = 8
+
+
+def set_upload_workers(workers: int):
+    global UPLOAD_WORKERS
+    UPLOAD_WORKERS = max(1, workers)
+
+
+def set_download_workers(workers: int):
+    global DOWNLOAD_WORKERS
+    DOWNLOAD_WORKERS = max(1, workers)
+
+
+def resolve_metadata(key, resolve):
+    """Value of the key in the metadata cache. resolve asks Graph for it when it is not cached or the cache is off."""
+    metadata_cache = get_metadata_cache()
+    if metadata_cache is None:
+        return resolve()
+    return metadata_cache.get_or_resolve(key, resolve)
+
+
+def drop_stale_metadata(metadata_cache) -> bool:
+    """
+    Asks Graph again for the cached site, drive and list IDs and removes from the cache the ones that changed or can
+    not be resolved anymore. Returns whether any was removed.
+    """
+    token_manager = get_token_manager()
+    resolvers = {"site": request_site_id, "drive": request_drive_id, "list": request_list_id}
+    stale = []
+    for key, value in metadata_cache.get_entries(("site:", "drive:", "list:")).items():
+        kind, name = key.split(":", 1)
+        # The key is the parent (domain or site ID) and the name of the object, as in get_site_id, get_drive_id...
+        parent, object_name = name.split("/", 1)
+        try:
+            current = resolvers[kind](token_manager, parent, object_name)
+        except Exception:  # Deleted, or in a site that was deleted
+            current = None
+        if current != value:
+            stale.append(key)
+    if stale:
+        metadata_cache.invalidate(stale)
+    return bool(stale)
+
+
+def refresh_metadata_on_not_found(function):
+    """
+    If Graph answers 404 to the decorated function, the cached site, drive or list IDs it used may belong to SharePoint
+    objects that were recreated. If any of them is stale, it is removed from the cache and the function is retried
+    once, resolving it again. A 404 about anything else, like a deleted item, is raised as is.
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        try:
+            return function(*args, **kwargs)
+        except HTTPError as e:
+            metadata_cache = get_metadata_cache()
+            if e.response is None or e.response.status_code != 404 or metadata_cache is None:
+                raise
+            if not drop_stale_metadata(metadata_cache):
+                raise
+            return function(*args, **kwargs)
+    return wrapper
 
 
 def get_list_id(token_manager, site_id, list_name):
-    url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/lists/{list_name}"
+    return resolve_metadata(f"list:{site_id}/{list_name}",
+                            lambda: request_list_id(token_manager, site_id, list_name))
+
+
+def request_list_id(token_manager, site_id, list_name):
+    url = f"{GRAPH_URL}/sites/{site_id}/lists/{list_name}"
     headers = {
         "Authorization": f"Bearer {token_manager.get_token()}"
     }
-    response = requests.get(url, headers=headers)
+    response = get_graph_client().get(url, headers=headers)
     response.raise_for_status()
     return response.json()["id"]
 
 
 def get_site_id(token_manager, domain, site_name):
-    url = f"https://graph.microsoft.com/v1.0/sites/{domain}:/sites/{site_name}"
+    return resolve_metadata(f"site:{domain}/{site_name}",
+                            lambda: request_site_id(token_manager, domain, site_name))
+
+
+def request_site_id(token_manager, domain, site_name):
+    url = f"{GRAPH_URL}/sites/{domain}:/sites/{site_name}"
     headers = {"Authorization": f"Bearer {token_manager.get_token()}"}
-    response = requests.get(url, headers=headers)
+    response = get_graph_client().get(url, headers=headers)
     response.raise_for_status()
     the_id = response.json()['id']
     return the_id
 
 
 def get_drive_id(token_manager, site_id, drive_name="Documents"):
-    url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drives"
+    return resolve_metadata(f"drive:{site_id}/{drive_name}",
+                            lambda: request_drive_id(token_manager, site_id, drive_name))
+
+
+def request_drive_id(token_manager, site_id, drive_name="Documents"):
+    url = f"{GRAPH_URL}/sites/{site_id}/drives"
     headers = {"Authorization": f"Bearer {token_manager.get_token()}"}
-    response = requests.get(url, headers=headers)
+    response = get_graph_client().get(url, headers=headers)
     response.raise_for_status()
     drives = response.json()['value']
     for drive in drives:
@@ -43,91 +138,504 @@ def get_drive_id(token_manager, site_id, drive_name="Documents"):
     raise Exception(f"Drive '{drive_name}' no encontrado.")
 
 
-def list_folder_contents(token_manager, drive_id, path):
-    url = f"https://graph.microsoft.com/v1.0/drives/{drive_id}/root:/{path}:/children"
+def list_folder_contents(token_manager, drive_id, path, select=None):
+    """Items of the folder. With select, e.g. "name,size", only those properties of each item are returned."""
+    url = f"{GRAPH_URL}/drives/{drive_id}/root:/{path}:/children"
     headers = {"Authorization": f"Bearer {token_manager.get_token()}"}
-    response = requests.get(url, headers=headers)
+    params = {"$select": select} if select else None
+    response = get_graph_client().get(url, headers=headers, params=params)
     response.raise_for_status()
     return response.json()['value']
 
 
-def download_file(token_mananger, drive_id, item_path, local_path, max_retries=5):
-    url = f"https://graph.microsoft.com/v1.0/drives/{drive_id}/root:/{item_path}:/content"
+def download_file(token_mananger, drive_id, item_path, local_path, quick_xor_hash=None):
+    """Downloads the file. Its quickXorHash, when given, is recorded so the next comparison does not read the file."""
+    url = f"{GRAPH_URL}/drives/{drive_id}/root:/{item_path}:/content"
     headers = {"Authorization": f"Bearer {token_mananger.get_token()}"}
 
-    retry_count = 0
-    backoff = 2  # segundos
+    # Throttling and transient errors are retried by the Graph client
+    response = get_graph_client().get(url, headers=headers, stream=True)
+    response.raise_for_status()
 
-    while retry_count <= max_retries:
-        response = None
-        try:
-            response = requests.get(url, headers=headers, stream=True)
-            response.raise_for_status()
+    os.makedirs(os.path.dirname(local_path), exist_ok=True)
+    size = 0
+    with open(local_path, 'wb') as f:
+        for chunk in response.iter_content(chunk_size=1024 * 1024):
+            if chunk:
+                f.write(chunk)
+                size += len(chunk)
+    file_hash_cache = get_file_hash_cache()
+    if quick_xor_hash is not None and file_hash_cache is not None:
+        file_hash_cache.store_quick_xor_hash(local_path, quick_xor_hash)
+    print(f"✅ Descargado: {item_path}")
+    return size
+
+
+def download_folder_recursive(token_manager: TokenManager, drive_id, remote_path, local_root, workers=None,
+                              seen=None) -> Tuple[int, int, int]:
+    """
+    Downloads the remote folder. Folders are listed and files are downloaded by a pool of threads, starting each
+    download as soon as its folder has been listed. Local files with the same size and quickXorHash as the remote ones
+    are kept. The local path of every remote item is added to seen, if given.
+    Returns the number of files and bytes downloaded and the number of files kept.
+    """
+    with ThreadPoolExecutor(max_workers=workers or DOWNLOAD_WORKERS) as pool:
+        listings = {submit_with_context(pool, list_folder_contents, token_manager, drive_id, remote_path):
+                    (remote_path, local_root)}
+        downloads = []
+        skipped = 0
+        while listings:
+            done, _ = wait(listings, return_when=FIRST_COMPLETED)
+            for listing in done:
+                folder_remote_path, folder_local_path = listings.pop(listing)
+                for item in listing.result():
+                    name = item['name']
+                    item_path = f"{folder_remote_path}/{name}"
+                    local_path = os.path.join(folder_local_path, name)
+                    if seen is not None:
+                        seen.add(local_path)
+                    if 'folder' in item:
+                        os.makedirs(local_path, exist_ok=True)
+                        listings[submit_with_context(pool, list_folder_contents, token_manager, drive_id,
+                                                     item_path)] = (item_path, local_path)
+                    elif 'file' in item:
+                        remote_hash = get_remote_quick_xor_hash(item)
+                        if is_same_content(local_path, item.get("size"), remote_hash):
+                            skipped += 1
+                        else:
+                            downloads.append(submit_with_context(pool, download_file, token_manager, drive_id,
+                                                                 item_path, local_path, remote_hash))
+        return len(downloads), sum(download.result() for download in downloads), skipped
+
+
+def download_files(token_manager, drive_id, files, workers=None):
+    """
+    Downloads (remote path, local path, quickXorHash) tuples with a pool of threads. Returns the number of bytes
+    downloaded.
+    """
+    with ThreadPoolExecutor(max_workers=workers or DOWNLOAD_WORKERS) as pool:
+        downloads = [submit_with_context(pool, download_file, token_manager, drive_id, item_path, local_path,
+                                         quick_xor_hash)
+                     for item_path, local_path, quick_xor_hash in files]
+        return sum(download.result() for download in downloads)
 
-            os.makedirs(os.path.dirname(local_path), exist_ok=True)
-            with open(local_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-            print(f"✅ Descargado: {item_path}")
-            return
 
-        except HTTPError as e:
-            if response is None:
-                raise e
-            if response.status_code == 503:
-                retry_count += 1
-                wait_time = backoff * retry_count
-                print(
-                    f"⚠️ Error 503 en '{item_path}' - Reintentando en {wait_time}s (intento {retry_count}/{max_retries})...")
-                time.sleep(wait_time)
-            else:
-                raise e  # Si no es 503, relanzamos la excepción inmediatamente
+def remove_unseen_local_items(folder_path, seen):
+    """Removes the files and folders inside the folder whose path is not in seen: they are not in SharePoint anymore."""
+    for root, dirs, files in os.walk(folder_path, topdown=False):
+        for name in files + dirs:
+            local_path = os.path.join(root, name)
+            if local_path not in seen:
+                remove_local_item(local_path)
 
-    raise RuntimeError(f"❌ Fallo permanente al descargar '{item_path}' tras {max_retries} reintentos.")
 
+def print_throughput(file_count, byte_count, start_time):
+    seconds = max(time.time() - start_time, 1e-6)
+    print(f"📊 {file_count} archivos, {byte_count / 1024 / 1024:.1f} MiB en {seconds:.1f}s "
+          f"({byte_count / 1024 / 1024 / seconds:.2f} MiB/s, {file_count / seconds:.1f} archivos/s).")
 
-def download_folder_recursive(token_manager: TokenManager, drive_id, remote_path, local_root):
-    items = list_folder_contents(token_manager, drive_id, remote_path)
-    for item in items:
-        name = item['name']
-        item_path = f"{remote_path}/{name}"
-        local_path = os.path.join(local_root, name)
 
-        if 'folder' in item:
-            download_folder_recursive(token_manager, drive_id, item_path, local_path)
-        elif 'file' in item:
-            download_file(token_manager, drive_id, item_path, local_path)
+def download_input_folder(token_manager, drive_id, remote_path, input_path, workers=None):
+    """Makes the input folder a copy of the remote folder, only downloading the files whose content differs."""
+    print("Comenzando descarga recursiva de SharePoint...")
+    start_time = time.time()
+    os.makedirs(input_path, exist_ok=True)
+    seen = set()
+    file_count, byte_count, skipped = download_folder_recursive(token_manager, drive_id, remote_path, input_path,
+                                                                workers, seen)
+    remove_unseen_local_items(input_path, seen)
+    print(f"✅ Descarga completada. {skipped} archivos sin cambios no se han descargado.")
+    print_throughput(file_count, byte_count, start_time)
+
 
+def get_delta_state_path(drive_id, remote_path, input_path):
+    key = "|".join([drive_id, remote_path.strip("/"), os.path.abspath(input_path)])
+    return os.path.join(CACHE_FOLDER, f"delta_{hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]}.json")
 
-def download_input_folder(token_manager, drive_id, remote_path, input_path):
-    print("Comenzando descarga recursiva de SharePoint...")
-    download_folder_recursive(token_manager, drive_id, remote_path, input_path)
-    print("✅ Descarga completada.")
+
+def load_delta_state(state_path):
+    try:
+        with open(state_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_delta_state(state_path, state):
+    os.makedirs(os.path.dirname(state_path), exist_ok=True)
+    temporary_path = state_path + "." + str(os.getpid()) + ".tmp"
+    with open(temporary_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(temporary_path, state_path)
+
+
+def get_item_id(token_manager, drive_id, path):
+    url = f"{GRAPH_URL}/drives/{drive_id}/root:/{quote(path)}"
+    response = get_graph_client().get(url, headers={"Authorization": f"Bearer {token_manager.get_token()}"},
+                                      params={"$select": "id"})
+    response.raise_for_status()
+    return response.json()["id"]
+
+
+def remove_local_item(local_path):
+    if os.path.isdir(local_path):
+        shutil.rmtree(local_path)
+    elif os.path.exists(local_path):
+        os.remove(local_path)
+
+
+def forget_delta_item(input_path, item_id, known_items, pending, counters):
+    """Removes the local copy of a known item, and of its children if it is a folder."""
+    known = known_items.pop(item_id)
+    remove_local_item(os.path.join(input_path, *known["path"].split("/")))
+    pending.discard(item_id)
+    if known["folder"]:
+        prefix = known["path"] + "/"
+        for child_id in [child_id for child_id, child in known_items.items() if child["path"].startswith(prefix)]:
+            del known_items[child_id]
+            pending.discard(child_id)
+    counters["deleted"] += 1
+
+
+def apply_delta_item(input_path, root_id, item, known_items, pending, counters) -> bool:
+    """
+    Brings the local copy of one item reported by the delta query up to date. Files to download are added to pending
+    and downloaded after all the changes are applied.
+
+    Graph does not send the path of the items of a delta query, so the path of each item is built from the known path
+    of its parent. Returns False, without doing anything, if the parent is not known (yet).
+    """
+    item_id = item["id"]
+    known = known_items.get(item_id)
+    if item_id == root_id:
+        return True
+    if "deleted" in item:
+        if known is not None:
+            forget_delta_item(input_path, item_id, known_items, pending, counters)
+        return True
+
+    parent_id = item.get("parentReference", {}).get("id")
+    if parent_id == root_id:
+        parent_path = ""
+    elif parent_id in known_items and known_items[parent_id]["folder"]:
+        parent_path = known_items[parent_id]["path"] + "/"
+    else:
+        return False
+
+    relative_path = parent_path + item["name"]
+    local_path = os.path.join(input_path, *relative_path.split("/"))
+    if known is not None and known["path"] != relative_path:
+        # Renamed or moved inside the folder. Children of a folder are not reported again, so move them too
+        old_local_path = os.path.join(input_path, *known["path"].split("/"))
+        if os.path.exists(old_local_path):
+            os.makedirs(os.path.dirname(local_path), exist_ok=True)
+            os.replace(old_local_path, local_path)
+        if known["folder"]:
+            prefix = known["path"] + "/"
+            for child in known_items.values():
+                if child["path"].startswith(prefix):
+                    child["path"] = relative_path + "/" + child["path"][len(prefix):]
+        counters["moved"] += 1
+
+    if "folder" in item:
+        os.makedirs(local_path, exist_ok=True)
+        known_items[item_id] = {"path": relative_path, "tag": None, "folder": True}
+    elif "file" in item:
+        tag = item.get("cTag") or item.get("eTag")
+        if known is not None and known["tag"] == tag and os.path.exists(local_path):
+            counters["unchanged"] += 1
+        else:
+            pending.add(item_id)
+        known_items[item_id] = {"path": relative_path, "tag": tag, "folder": False, "size": item.get("size"),
+                                "hash": get_remote_quick_xor_hash(item)}
+    return True
+
+
+def apply_delta_items(input_path, root_id, items, known_items, pending, counters):
+    """
+    Applies the items of the delta query. Items whose parent comes later in the response are applied after it. Items
+    whose parent never shows up are not in the input folder anymore: they were moved out of it.
+    """
+    while items:
+        postponed = [item for item in items
+                     if not apply_delta_item(input_path, root_id, item, known_items, pending, counters)]
+        if len(postponed) == len(items):
+            break
+        items = postponed
+    for item in items:
+        if item["id"] in known_items:
+            forget_delta_item(input_path, item["id"], known_items, pending, counters)
+
+
+def sync_input_folder_delta(token_manager, drive_id, remote_path, input_path, workers=None):
+    """
+    Brings the local input folder up to date with a Graph delta query of the drive, so only the items added, changed
+    or deleted since the last synchronization are transferred. The delta link, the ID of the folder and the ID, path
+    and cTag of every item are kept in a state file of the cache folder, so an unchanged folder costs a single request.
+    Without a usable state, the folder is downloaded from scratch.
+    """
+    remote_path = remote_path.strip("/")
+    state_path = get_delta_state_path(drive_id, remote_path, input_path)
+    state = load_delta_state(state_path)
+    if state is None or not os.path.isdir(input_path) or state.get("root_id") is None:
+        print("No hay estado de sincronización. Sincronizando la carpeta de entrada completa...")
+        state = None
+
+    start_time = time.time()
+    counters = {"downloaded": 0, "deleted": 0, "moved": 0, "unchanged": 0, "pages": 0}
+    pending = set()
+    resync = False
+    while True:
+        if state is None:
+            # The local files are kept: the ones with the same content as the remote ones are not downloaded again
+            os.makedirs(input_path, exist_ok=True)
+            state = {"delta_link": None, "root_id": get_item_id(token_manager, drive_id, remote_path), "items": {}}
+            pending.clear()
+            resync = True
+        root_id = state["root_id"]
+        # SharePoint only supports delta queries of the whole drive. The items outside the input folder, like the
+        # uploaded results, are dropped by apply_delta_items since their parents are not inside the folder
+        url = state["delta_link"] or f"{GRAPH_URL}/drives/{drive_id}/root/delta"
+        items = []
+        try:
+            while url is not None:
+                response = get_graph_client().get(url, headers={"Authorization": f"Bearer {token_manager.get_token()}"})
+                if response.status_code == 410:  # The delta link expired, Graph asks for a full resynchronization
+                    raise DeltaLinkExpired(url)
+                response.raise_for_status()
+                page = response.json()
+                counters["pages"] += 1
+                items.extend(page.get("value", []))
+                url = page.get("@odata.nextLink")
+                if url is None:
+                    state["delta_link"] = page.get("@odata.deltaLink")
+        except DeltaLinkExpired:
+            print("⚠️ El enlace delta ha caducado. Sincronizando la carpeta de entrada completa...")
+            state = None
+            continue
+        if not resync and any(item["id"] == root_id and "deleted" in item for item in items):
+            # The items of a folder created again with the same path have other IDs
+            print("⚠️ La carpeta de entrada se ha eliminado. Sincronizando la carpeta de entrada completa...")
+            state = None
+            continue
+        break
+    apply_delta_items(input_path, root_id, items, state["items"], pending, counters)
+
+    if resync:
+        # Files deleted in SharePoint while there was no usable state are never reported
+        remove_unseen_local_items(input_path, {os.path.join(input_path, *known["path"].split("/"))
+                                               for known in state["items"].values()})
+
+    files = []
+    for item_id in pending:
+        known = state["items"][item_id]
+        local_path = os.path.join(input_path, *known["path"].split("/"))
+        if is_same_content(local_path, known.get("size"), known.get("hash")):
+            counters["unchanged"] += 1
+        else:
+            files.append((remote_path + "/" + known["path"], local_path, known.get("hash")))
+    byte_count = download_files(token_manager, drive_id, files, workers)
+    counters["downloaded"] = len(files)
+
+    save_delta_state(state_path, state)
+    print(f"✅ Sincronización delta completada: {counters['downloaded']} descargados, {counters['deleted']} "
+          f"eliminados, {counters['moved']} movidos, {counters['unchanged']} sin cambios ({counters['pages']} "
+          f"peticiones delta).")
+    print_throughput(len(files), byte_count, start_time)
+    return counters
+
+
+def remove_folder_contents(folder_path):
+    if os.path.isdir(folder_path):
+        shutil.rmtree(folder_path)
+    os.makedirs(folder_path, exist_ok=True)
+
+
+def list_remote_tree(token_manager, drive_id, remote_path, include_folder=None, workers=None) -> List[Tuple[str, dict]]:
+    """
+    Lists the files under the remote folder with a pool of threads, returning their paths relative to it and their
+    name, size and hash. Subfolders for which include_folder(relative path) is False are not listed.
+    """
+    select = "name,size,file,folder"
+    files = []
+    with ThreadPoolExecutor(max_workers=workers or DOWNLOAD_WORKERS) as pool:
+        listings = {submit_with_context(pool, list_folder_contents, token_manager, drive_id, remote_path, select): ""}
+        while listings:
+            done, _ = wait(listings, return_when=FIRST_COMPLETED)
+            for listing in done:
+                folder_relative_path = listings.pop(listing)
+                for item in listing.result():
+                    relative_path = f"{folder_relative_path}/{item['name']}".strip("/")
+                    if 'folder' in item:
+                        if include_folder is None or include_folder(relative_path):
+                            listings[submit_with_context(pool, list_folder_contents, token_manager, drive_id,
+                                                         f"{remote_path}/{relative_path}", select)] = relative_path
+                    elif 'file' in item:
+                        files.append((relative_path, item))
+    return files
+
+
+def fetch_input_folder_planned(token_manager, drive_id, remote_path, input_path, begin, end, naf=None, workers=None):
+    """
+    Downloads only the input files that can affect a justification of [begin, end], chosen by the names of the remote
+    files with the same conventions used by the stages (see manifest.is_file_in_scope). The year folders out of the
+    range are not even listed. Files of the range whose content did not change are not downloaded, and local files of
+    the range that are not in SharePoint anymore are removed. Files out of the range are left as they are.
+    """
+    print(f"Planificando la descarga de SharePoint para el periodo {begin.strftime('%Y-%m-%d')} - "
+          f"{end.strftime('%Y-%m-%d')}...")
+    start_time = time.time()
+    remote_path = remote_path.strip("/")
+    remote_files = list_remote_tree(token_manager, drive_id, remote_path,
+                                    lambda relative_path: is_folder_in_scope(relative_path, begin, end), workers)
+
+    counters = {"out_of_scope": 0, "out_of_scope_bytes": 0, "unchanged": 0, "unchanged_bytes": 0}
+    files = []
+    for relative_path, item in remote_files:
+        local_path = os.path.join(input_path, *relative_path.split("/"))
+        if not is_file_in_scope(relative_path, begin, end, naf):
+            counters["out_of_scope"] += 1
+            counters["out_of_scope_bytes"] += item.get("size", 0)
+        elif is_same_content(local_path, item.get("size"), get_remote_quick_xor_hash(item)):
+            counters["unchanged"] += 1
+            counters["unchanged_bytes"] += item.get("size", 0)
+        else:
+            files.append((remote_path + "/" + relative_path, local_path, get_remote_quick_xor_hash(item)))
+    os.makedirs(input_path, exist_ok=True)
+    byte_count = download_files(token_manager, drive_id, files, workers)
+
+    remote_relative_paths = {relative_path for relative_path, _ in remote_files}
+    deleted = 0
+    for root, dirs, local_files in os.walk(input_path):
+        for file_name in local_files:
+            local_path = os.path.join(root, file_name)
+            relative_path = os.path.relpath(local_path, input_path).replace(os.sep, "/")
+            if relative_path not in remote_relative_paths and is_file_in_scope(relative_path, begin, end, naf):
+                os.remove(local_path)
+                deleted += 1
+
+    print(f"✅ Descarga planificada completada: {len(files)} descargados, {counters['unchanged']} sin cambios, "
+          f"{deleted} eliminados, {counters['out_of_scope']} fuera del periodo.")
+    print(f"📉 No transferidos: {counters['out_of_scope_bytes'] / 1024 / 1024:.1f} MiB fuera del periodo y "
+          f"{counters['unchanged_bytes'] / 1024 / 1024:.1f} MiB sin cambios.")
+    print_throughput(len(files), byte_count, start_time)
+    return counters
+
+
+def fetch_input_folder(token_manager, drive_id, remote_path, input_path, mode="full", workers=None, begin=None,
+                       end=None, naf=None):
+    """
+    Obtains the input folder from SharePoint, listing the whole remote folder (full), only asking for its changes
+    (delta) or only the files that can affect a justification of [begin, end] (planned). In all modes, files whose
+    content did not change are not downloaded.
+    """
+    if mode == "delta":
+        sync_input_folder_delta(token_manager, drive_id, remote_path, input_path, workers)
+    elif mode == "planned" and begin is not None and end is not None:
+        fetch_input_folder_planned(token_manager, drive_id, remote_path, input_path, begin, end, naf, workers)
+    else:
+        download_input_folder(token_manager, drive_id, remote_path, input_path, workers)
 
 
 # Upload functions
+# Files bigger than this are uploaded with an upload session, in chunks. Graph does not accept simple uploads > 4 MiB
+UPLOAD_SESSION_THRESHOLD = 4 * 1024 * 1024
+# Chunks of upload sessions must be multiples of 320 KiB
+UPLOAD_CHUNK_SIZE = 16 * 320 * 1024
+# Times a chunk is retried, resuming from the last byte acknowledged by Graph
+UPLOAD_CHUNK_RETRIES = 5
+
+
 def upload_file(token_manager, drive_id, remote_path, local_file_path):
-    logger_instance = logging.getLogger("justicier")
+    logger_instance = get_logger_instance()
     logger = build_process_logger(logger_instance, "upload_file")
 
     logger.info("Uploading from local path " + local_file_path + " to " + remote_path)
-    url = f"https://graph.microsoft.com/v1.0/drives/{drive_id}/root:/{remote_path}:/content"
+    if os.path.getsize(local_file_path) > UPLOAD_SESSION_THRESHOLD:
+        upload_large_file(token_manager, drive_id, remote_path, local_file_path)
+        logger.info(f"✅ Upload Done")
+        return
+
+    url = f"{GRAPH_URL}/drives/{drive_id}/root:/{remote_path}:/content"
     headers = {
         "Authorization": f"Bearer {token_manager.get_token()}",
         "Content-Type": "application/octet-stream"
     }
 
+    # The file object is streamed, it is never read whole in memory
     with open(local_file_path, 'rb') as f:
-        data = f.read()
-
-    response = requests.put(url, headers=headers, data=data)
+        response = get_graph_client().put(url, headers=headers, data=f)
     response.raise_for_status()
     logger.info(f"✅ Upload Done")
 
 
+def create_upload_session(token_manager, drive_id, remote_path) -> str:
+    url = f"{GRAPH_URL}/drives/{drive_id}/root:/{remote_path}:/createUploadSession"
+    headers = {"Authorization": f"Bearer {token_manager.get_token()}", "Content-Type": "application/json"}
+    data = {"item": {"@microsoft.graph.conflictBehavior": "replace"}}
+    response = get_graph_client().post(url, headers=headers, json=data)
+    response.raise_for_status()
+    return response.json()["uploadUrl"]
+
+
+def get_upload_session_offset(upload_url) -> int:
+    """First byte that the upload session is still waiting for."""
+    # The upload URL is pre-authenticated, sending the token to it is not allowed
+    response = get_graph_client().get(upload_url)
+    response.raise_for_status()
+    ranges = response.json().get("nextExpectedRanges", [])
+    if len(ranges) == 0:
+        raise RuntimeError(f"Upload session {upload_url} is not expecting more data")
+    return int(ranges[0].split("-")[0])
+
+
+def upload_large_file(token_manager, drive_id, remote_path, local_file_path):
+    """
+    Uploads a file with a Graph upload session, sending fixed size chunks read from disk, so memory does not grow with
+    the size of the file. After a failed chunk, the upload resumes from the last byte acknowledged by Graph.
+    """
+    logger = build_process_logger(get_logger_instance(), "upload_file")
+    total_size = os.path.getsize(local_file_path)
+    upload_url = create_upload_session(token_manager, drive_id, remote_path)
+    offset = 0
+    retries = 0
+    with open(local_file_path, "rb") as f:
+        while offset < total_size:
+            f.seek(offset)
+            chunk = f.read(UPLOAD_CHUNK_SIZE)
+            headers = {"Content-Length": str(len(chunk)),
+                       "Content-Range": f"bytes {offset}-{offset + len(chunk) - 1}/{total_size}"}
+            try:
+                response = get_graph_client().put(upload_url, headers=headers, data=chunk)
+                if response.status_code in (200, 201):
+                    return response.json()
+                response.raise_for_status()
+                next_ranges = response.json().get("nextExpectedRanges", [])
+                offset = int(next_ranges[0].split("-")[0]) if next_ranges else offset + len(chunk)
+                retries = 0
+            except requests.RequestException as e:
+                retries += 1
+                if retries > UPLOAD_CHUNK_RETRIES:
+                    raise RuntimeError(f"❌ Upload of {local_file_path} failed after {UPLOAD_CHUNK_RETRIES} retries at "
+                                       f"byte {offset} of {total_size}. Error: {e}")
+                wait_time = 2 * retries
+                logger.warning(f"⚠️ Chunk at byte {offset} of {local_file_path} failed ({e}). Resuming in "
+                               f"{wait_time}s (retry {retries}/{UPLOAD_CHUNK_RETRIES})...")
+                time.sleep(wait_time)
+                try:
+                    offset = get_upload_session_offset(upload_url)
+                except requests.HTTPError as status_error:
+                    if status_error.response is not None and status_error.response.status_code == 404:
+                        # The session expired, start again with a new one
+                        upload_url = create_upload_session(token_manager, drive_id, remote_path)
+                        offset = 0
+                except requests.RequestException:
+                    pass  # Keep the offset, the next chunk will fail with 416 if it is not the expected one
+    raise RuntimeError(f"❌ Upload session of {local_file_path} sent every byte but Graph did not confirm the file")
+
+
 def ensure_remote_folder(token_manager, drive_id, parent_path, folder_name):
-    url = f"https://graph.microsoft.com/v1.0/drives/{drive_id}/root:/{parent_path}:/children"
+    url = f"{GRAPH_URL}/drives/{drive_id}/root:/{parent_path}:/children"
     headers = {
         "Authorization": f"Bearer {token_manager.get_token()}",
         "Content-Type": "application/json"
@@ -138,18 +646,82 @@ def ensure_remote_folder(token_manager, drive_id, parent_path, folder_name):
         "@microsoft.graph.conflictBehavior": "replace"
     }
 
-    response = requests.post(url, headers=headers, json=data)
+    response = get_graph_client().post(url, headers=headers, json=data)
     if response.status_code not in (200, 201):
         response.raise_for_status()
 
     return os.path.join(parent_path, folder_name).replace("\\", "/")
 
 
-def upload_folder_recursive(token_manager, drive_id, local_folder_path, remote_folder_path):
-    logger_instance = logging.getLogger("justicier")
-    logger = build_process_logger(logger_instance, "Upload data results")
+def create_remote_folder(token_manager, drive_id, parent_path, folder_name):
+    """Creates the folder if it does not exist. Unlike ensure_remote_folder, an existing folder is left untouched."""
+    if parent_path.strip("/"):
+        url = f"{GRAPH_URL}/drives/{drive_id}/root:/{parent_path.strip('/')}:/children"
+    else:
+        url = f"{GRAPH_URL}/drives/{drive_id}/root/children"
+    headers = {
+        "Authorization": f"Bearer {token_manager.get_token()}",
+        "Content-Type": "application/json"
+    }
+    data = {
+        "name": folder_name,
+        "folder": {},
+        "@microsoft.graph.conflictBehavior": "fail"
+    }
+    response = get_graph_client().post(url, headers=headers, json=data)
+    if response.status_code == 409:  # It already exists
+        return False
+    response.raise_for_status()
+    return True
+
 
+def create_remote_folders(token_manager, drive_id, remote_folder_paths) -> Set[str]:
+    """
+    Creates each folder and its parents, parents first, with one request per folder. Returns the given folders that
+    already existed.
+    """
+    created = set()
+    existing = set()
+    for remote_folder_path in sorted(remote_folder_paths):
+        parts = remote_folder_path.strip("/").split("/")
+        for i in range(len(parts)):
+            path = "/".join(parts[:i + 1])
+            if path not in created:
+                if not create_remote_folder(token_manager, drive_id, "/".join(parts[:i]), parts[i]):
+                    existing.add(path)
+                created.add(path)
+    return existing & {remote_folder_path.strip("/") for remote_folder_path in remote_folder_paths}
+
+
+def skip_unchanged_uploads(token_manager, drive_id, uploads, existing_folders) -> List[Tuple[str, str]]:
+    """
+    Leaves out of the (remote path, local path) uploads the files already in SharePoint with the same size and
+    quickXorHash. Only the folders that existed before the upload are listed, new folders can not hold any file.
+    """
+    with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as pool:
+        listings = {folder: submit_with_context(pool, list_folder_contents, token_manager, drive_id, folder)
+                    for folder in existing_folders}
+        listings = {folder: listing.result() for folder, listing in listings.items()}
+    remote_items = {}
+    for folder, items in listings.items():
+        for item in items:
+            remote_items[f"{folder}/{item['name']}"] = item
+    changed = []
+    for remote_file, local_file in uploads:
+        item = remote_items.get(remote_file)
+        if item is None or not is_same_content(local_file, item.get("size"), get_remote_quick_xor_hash(item)):
+            changed.append((remote_file, local_file))
+    return changed
+
+
+def list_folder_uploads(local_folder_path, remote_folder_path):
+    """Returns the (remote path, local path) of each file of the local folder and the remote folders that hold them."""
+    logger = build_process_logger(get_logger_instance(), "Upload data results")
+
+    uploads = []
+    remote_folders = set()
     for root, dirs, files in os.walk(local_folder_path):
+        dirs.sort()
         if len(files) == 0 and len(dirs) == 0:  # Ignore empty folders because they cause issue
             continue
 
@@ -158,14 +730,68 @@ def upload_folder_recursive(token_manager, drive_id, local_folder_path, remote_f
         logger.debug("rel path: " + str(rel_path))
         sharepoint_current_path = os.path.normpath(os.path.join(remote_folder_path, rel_path)).replace("\\", "/")
         logger.debug("sharepoint current path: " + str(sharepoint_current_path))
+        if len(files) > 0:
+            remote_folders.add(sharepoint_current_path.strip("/"))
 
-        # Subir archivos
-        for file_name in files:
+        for file_name in sorted(files):
             local_file = os.path.join(root, file_name)
             remote_file = f"{sharepoint_current_path}/{file_name}".strip("/")
-            upload_file(token_manager, drive_id, remote_file, local_file)
+            uploads.append((remote_file, local_file))
+    return uploads, remote_folders
+
+
+def print_upload_summary(logger, file_count, byte_count, start_time):
+    seconds = max(time.time() - start_time, 1e-6)
+    logger.info(f"Uploaded {str(file_count)} files, {byte_count / 1024 / 1024:.1f} MiB in {seconds:.1f}s "
+                f"({byte_count / 1024 / 1024 / seconds:.2f} MiB/s).")
+
+
+def upload_folder_recursive(token_manager, drive_id, local_folder_path, remote_folder_path, workers=None):
+    """
+    Uploads every file of the local folder. The remote folders are created first, once each, and then the files are
+    uploaded by a pool of threads. Progress is logged in the order of the files.
+    """
+    logger = build_process_logger(get_logger_instance(), "Upload data results")
+    uploads, remote_folders = list_folder_uploads(local_folder_path, remote_folder_path)
+
+    start_time = time.time()
+    # Parallel uploads to a folder that does not exist yet would race to create it
+    existing_folders = create_remote_folders(token_manager, drive_id, remote_folders)
+    file_count = len(uploads)
+    uploads = skip_unchanged_uploads(token_manager, drive_id, uploads, existing_folders)
+    if len(uploads) < file_count:
+        logger.info(f"{str(file_count - len(uploads))} files are already in SharePoint with the same content.")
+
+    total_bytes = 0
+    with ThreadPoolExecutor(max_workers=workers or UPLOAD_WORKERS) as pool:
+        futures = [submit_with_context(pool, upload_file, token_manager, drive_id, remote_file, local_file)
+                   for remote_file, local_file in uploads]
+        for i, (future, (remote_file, local_file)) in enumerate(zip(futures, uploads)):
+            future.result()
+            total_bytes += os.path.getsize(local_file)
+            logger.info(f"[{str(i + 1)}/{str(len(uploads))}] Uploaded {remote_file}")
+
+    print_upload_summary(logger, len(uploads), total_bytes, start_time)
+
+
+def get_list_entity_type(token_manager, sharepoint_domain, site_name, list_name):
+    return resolve_metadata(f"entity_type:{sharepoint_domain}/{site_name}/{list_name}",
+                            lambda: request_list_entity_type(token_manager, sharepoint_domain, site_name, list_name))
+
+
+def request_list_entity_type(token_manager, sharepoint_domain, site_name, list_name):
+    meta_url = f"https://{sharepoint_domain}/sites/{site_name}/_api/web/lists/getbytitle('{list_name}')"
+    meta_headers = {
+        "Authorization": f"Bearer {token_manager.get_token()}",
+        "Accept": "application/json;odata=verbose"
+    }
+
+    meta_resp = get_graph_client().get(meta_url, headers=meta_headers)
+    meta_resp.raise_for_status()
+    return meta_resp.json()["d"]["ListItemEntityTypeFullName"]
 
 
+@refresh_metadata_on_not_found
 def update_resultat_sharepoint_rest(item_id, link):
     """
     Updates the 'Resultat' hyperlink field in a SharePoint list item using SharePoint REST API.
@@ -181,15 +807,7 @@ def update_resultat_sharepoint_rest(item_id, link):
     access_token = token_manager.get_token()
 
     # Step 1: Get ListItemEntityTypeFullName
-    meta_url = f"https://{sharepoint_domain}/sites/{site_name}/_api/web/lists/getbytitle('{list_name}')"
-    meta_headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Accept": "application/json;odata=verbose"
-    }
-
-    meta_resp = requests.get(meta_url, headers=meta_headers)
-    meta_resp.raise_for_status()
-    entity_type = meta_resp.json()["d"]["ListItemEntityTypeFullName"]
+    entity_type = get_list_entity_type(token_manager, sharepoint_domain, site_name, list_name)
 
     # Step 2: Update the item
     update_url = f"https://{sharepoint_domain}/sites/{site_name}/_api/web/lists/getbytitle('{list_name}')/items({item_id})"
@@ -210,11 +828,12 @@ def update_resultat_sharepoint_rest(item_id, link):
         }
     }
 
-    response = requests.post(update_url, headers=headers, json=payload)
+    response = get_graph_client().post(update_url, headers=headers, json=payload)
     response.raise_for_status()
     print("✅ Successfully updated 'Resultat' field via SharePoint REST API.")
 
 
+@refresh_metadata_on_not_found
 def get_result_column(item_id):
     sharepoint_domain = read_secret("SHAREPOINT_DOMAIN")
     site_name = read_secret("SITE_NAME")
@@ -226,8 +845,8 @@ def get_result_column(item_id):
     site_id = get_site_id(token_manager, sharepoint_domain, site_name)
 
     # Get list items
-    list_resp = requests.get(
-    f"https://graph.microsoft.com/v1.0/sites/{site_id}/lists/{list_name}/items/{item_id}/fields",
+    list_resp = get_graph_client().get(
+    f"{GRAPH_URL}/sites/{site_id}/lists/{list_name}/items/{item_id}/fields",
         headers={"Authorization": f"Bearer {access_token}"}
     )
     list_resp.raise_for_status()
@@ -235,6 +854,7 @@ def get_result_column(item_id):
     print(list_resp.json())
 
 
+@refresh_metadata_on_not_found
 def print_columns():
     sharepoint_domain = read_secret("SHAREPOINT_DOMAIN")
     site_name = read_secret("SITE_NAME")
@@ -246,8 +866,8 @@ def print_columns():
     site_id = get_site_id(token_manager, sharepoint_domain, site_name)
 
     # Get list items
-    list_resp = requests.get(
-    f"https://graph.microsoft.com/v1.0/sites/{site_id}/lists/{list_name}/items?expand=fields,createdBy",
+    list_resp = get_graph_client().get(
+    f"{GRAPH_URL}/sites/{site_id}/lists/{list_name}/items?expand=fields,createdBy",
         headers={"Authorization": f"Bearer {access_token}"}
     )
     list_resp.raise_for_status()
@@ -255,6 +875,7 @@ def print_columns():
     print(list_resp.json())
 
 
+@refresh_metadata_on_not_found
 def get_list_columns():
     sharepoint_domain = read_secret("SHAREPOINT_DOMAIN")
     site_name = read_secret("SITE_NAME")
@@ -264,12 +885,12 @@ def get_list_columns():
     access_token = token_manager.get_token()
     site_id = get_site_id(token_manager, sharepoint_domain, site_name)
 
-    url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/lists/{list_name}/columns"
+    url = f"{GRAPH_URL}/sites/{site_id}/lists/{list_name}/columns"
     headers = {
         "Authorization": f"Bearer {access_token}"
     }
 
-    response = requests.get(url, headers=headers)
+    response = get_graph_client().get(url, headers=headers)
     response.raise_for_status()
 
     columns = response.json().get("value", [])
@@ -285,37 +906,151 @@ def get_list_columns():
     return columns
 
 
-def update_list_item_field(item_id, updated_fields: dict):
-    sharepoint_domain = read_secret("SHAREPOINT_DOMAIN")
-    site_name = read_secret("SITE_NAME")
-    list_name = read_secret("SHAREPOINT_LIST_NAME")
+# Requests that Graph accepts in a single $batch
+GRAPH_BATCH_LIMIT = 20
 
-    token_manager = get_token_manager()
-    access_token = token_manager.get_token()
 
-    site_id = get_site_id(token_manager, sharepoint_domain, site_name)
+class ListItemUpdateBuffer:
+    """
+    Collects the field changes of the items of the list of requests and sends them together on flush: one PATCH if a
+    single item changed, or $batch requests of up to GRAPH_BATCH_LIMIT PATCHes otherwise. Several changes of the same
+    field of an item only send the last value.
+    """
 
-    # Endpoint to patch the item's fields
-    patch_url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/lists/{list_name}/items/{item_id}/fields"
+    def __init__(self):
+        self.pending: Dict[str, dict] = {}
+        self.lock = threading.Lock()
+
+    def update(self, item_id, updated_fields: dict):
+        with self.lock:
+            self.pending.setdefault(str(item_id), {}).update(updated_fields)
+
+    def flush(self):
+        pending = self.take()
+        if pending:
+            self.send(pending)
+
+    def take(self) -> Dict[str, dict]:
+        """Removes the queued changes from the buffer and returns them."""
+        with self.lock:
+            pending = self.pending
+            self.pending = {}
+        return pending
+
+    def get_pending(self, item_id) -> dict:
+        """Changes of the item queued and not sent yet."""
+        with self.lock:
+            return dict(self.pending.get(str(item_id), {}))
+
+    def merge(self, pending: Dict[str, dict]):
+        for item_id, updated_fields in pending.items():
+            self.update(item_id, updated_fields)
+
+    @staticmethod
+    @refresh_metadata_on_not_found
+    def send(pending: Dict[str, dict]):
+        sharepoint_domain = read_secret("SHAREPOINT_DOMAIN")
+        site_name = read_secret("SITE_NAME")
+        list_name = read_secret("SHAREPOINT_LIST_NAME")
+
+        token_manager = get_token_manager()
+        site_id = get_site_id(token_manager, sharepoint_domain, site_name)
+        headers = {
+            "Authorization": f"Bearer {token_manager.get_token()}",
+            "Content-Type": "application/json"
+        }
 
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
+        if len(pending) == 1:
+            item_id, updated_fields = next(iter(pending.items()))
+            # Endpoint to patch the item's fields
+            patch_url = f"{GRAPH_URL}/sites/{site_id}/lists/{list_name}/items/{item_id}/fields"
+            response = get_graph_client().patch(patch_url, headers=headers, json=updated_fields)
+            if response.status_code == 404:  # Maybe a stale site ID
+                response.raise_for_status()
+            if response.status_code != 200:
+                raise RuntimeError(f"Failed to update item {item_id}: {response.status_code} - {response.text}")
+            return
 
-    response = requests.patch(
-        patch_url,
-        headers=headers,
-        json=updated_fields
-    )
+        items = list(pending.items())
+        errors = []
+        for begin in range(0, len(items), GRAPH_BATCH_LIMIT):
+            requests_batch = [{"id": item_id,
+                               "method": "PATCH",
+                               "url": f"/sites/{site_id}/lists/{list_name}/items/{item_id}/fields",
+                               "headers": {"Content-Type": "application/json"},
+                               "body": updated_fields}
+                              for item_id, updated_fields in items[begin:begin + GRAPH_BATCH_LIMIT]]
+            response = get_graph_client().post(f"{GRAPH_URL}/$batch", headers=headers,
+                                               json={"requests": requests_batch})
+            if response.status_code == 404:
+                response.raise_for_status()
+            if response.status_code != 200:
+                raise RuntimeError(f"Failed to update items {', '.join(pending.keys())}: {response.status_code} - "
+                                   f"{response.text}")
+            for item_response in response.json()["responses"]:
+                if item_response["status"] != 200:
+                    errors.append(f"{item_response['id']}: {item_response['status']} - "
+                                  f"{json.dumps(item_response.get('body'))}")
+        if errors:
+            raise RuntimeError(f"Failed to update items {'; '.join(errors)}")
+
+
+# Buffer of the changes queued outside of any job
+list_item_updates = ListItemUpdateBuffer()
+# Buffer of the job running in the current context, so a job only flushes its own changes
+job_list_item_updates: contextvars.ContextVar = contextvars.ContextVar("list_item_updates", default=None)
+
+
+def get_list_item_updates() -> ListItemUpdateBuffer:
+    buffer = job_list_item_updates.get()
+    return buffer if buffer is not None else list_item_updates
 
-    if response.status_code != 200:
-        raise RuntimeError(f"Failed to update item {item_id}: {response.status_code} - {response.text}")
 
-    return response.json()
+def set_list_item_updates(buffer: ListItemUpdateBuffer) -> contextvars.Token:
+    """Makes the changes queued in the current context go to the given buffer, until reset_list_item_updates."""
+    return job_list_item_updates.set(buffer)
 
 
+def reset_list_item_updates(token: contextvars.Token):
+    job_list_item_updates.reset(token)
 
+
+def update_list_item_field(item_id, updated_fields: dict):
+    """Queues the change of fields of the item. It is sent to SharePoint by the next flush_list_item_updates."""
+    get_list_item_updates().update(item_id, updated_fields)
+
+
+def flush_list_item_updates():
+    """Sends the changes queued in the current context."""
+    get_list_item_updates().flush()
+
+
+# Fields of an item of the list of requests that make the configuration of its justification
+REQUEST_FIELDS = ("Title,Nomdelapersona,Fusi_x00f3_NominaiJustificantBan,Tipusdidentificador,NAF,"
+                  "DNI,DataInici,Datafinal,juntarpdfs,Fusi_x00f3_RLCRNT,Sol_x00b7_licitant,SolicitantEmail,id")
+# Items of the list returned by each page of a query
+LIST_PAGE_SIZE = 200
+
+
+def parse_request_fields(fields: dict) -> dict:
+    """Configuration of a justification from the fields of its item of the list of requests."""
+    return {
+        'Title': fields.get('Title'),
+        'id_type': fields.get('Tipusdidentificador'),
+        'NAF': fields.get('NAF'),
+        'name': fields.get('Nomdelapersona'),
+        'DNI': fields.get('DNI'),
+        'begin': fields.get('DataInici'),
+        'end': fields.get('Datafinal'),
+        'author_email': fields.get('SolicitantEmail'),
+        'author': fields.get('Sol_x00b7_licitant'),
+        'merge_salary_bankproof': fields.get('Fusi_x00f3_NominaiJustificantBan'),
+        'merge_results': fields.get('juntarpdfs'),
+        'merge_RLC_RNT': fields.get('Fusi_x00f3_RLCRNT')
+    }
+
+
+@refresh_metadata_on_not_found
 def get_parameters_from_list(sharepoint_domain, site_name, list_name, job_id):
     token_manager = get_token_manager()
     access_token = token_manager.get_token()
@@ -324,63 +1059,118 @@ def get_parameters_from_list(sharepoint_domain, site_name, list_name, job_id):
 
     # Build query in a clearer way: expand fields and select only needed fields
     # Note: requests will correctly encode $ and parentheses in params
-    select_fields = (
-        "Title,Nomdelapersona,Fusi_x00f3_NominaiJustificantBan,Tipusdidentificador,NAF,"
-        "DNI,DataInici,Datafinal,juntarpdfs,Fusi_x00f3_RLCRNT,Sol_x00b7_licitant,SolicitantEmail,id"
-    )
-
     params = {
-        "$expand": f"fields($select={select_fields})",
+        "$expand": f"fields($select={REQUEST_FIELDS})",
         "$select": "fields,createdBy"
     }
 
-    list_url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/lists/{quote(list_name, safe='')}/items/{job_id}"
-    list_resp = requests.get(list_url, headers={"Authorization": f"Bearer {access_token}"}, params=params)
+    list_url = f"{GRAPH_URL}/sites/{site_id}/lists/{quote(list_name, safe='')}/items/{job_id}"
+    list_resp = get_graph_client().get(list_url, headers={"Authorization": f"Bearer {access_token}"}, params=params)
     list_resp.raise_for_status()
-    resp_json = list_resp.json()
-    fields = resp_json.get("fields", {})
-
-    print(list_resp.json()["fields"])
+    fields = list_resp.json().get("fields", {})
 
+    print(fields)
 
     # Search for the job ID
-    if str(list_resp.json()["fields"].get("id")) == str(job_id):
-        data = {
-            'Title': list_resp.json()["fields"].get('Title'),
-            'id_type': list_resp.json()["fields"].get('Tipusdidentificador'),
-            'NAF': list_resp.json()["fields"].get('NAF'),
-            'name': list_resp.json()["fields"].get('Nomdelapersona'),
-            'DNI': list_resp.json()["fields"].get('DNI'),
-            'begin': list_resp.json()["fields"].get('DataInici'),
-            'end': list_resp.json()["fields"].get('Datafinal'),
-            'author_email': list_resp.json()["fields"].get('SolicitantEmail'),
-            'author': list_resp.json()["fields"].get('Sol_x00b7_licitant'),
-            'merge_salary_bankproof': list_resp.json()["fields"].get('Fusi_x00f3_NominaiJustificantBan'),
-            'merge_results': list_resp.json()["fields"].get('juntarpdfs'),
-            'merge_RLC_RNT': list_resp.json()["fields"].get('Fusi_x00f3_RLCRNT')
-        }
-
-        return data
+    if str(fields.get("id")) == str(job_id):
+        return parse_request_fields(fields)
 
     raise ValueError(f"Job ID {job_id} not found in SharePoint List")
 
 
+@refresh_metadata_on_not_found
+def get_requests_from_list(sharepoint_domain, site_name, list_name, extra_fields="") -> List[dict]:
+    """
+    Every item of the list of requests, with the fields of REQUEST_FIELDS (and extra_fields, comma separated) and its
+    creator, in a single paged query.
+    """
+    token_manager = get_token_manager()
+    site_id = get_site_id(token_manager, sharepoint_domain, site_name)
+
+    select_fields = REQUEST_FIELDS + ("," + extra_fields if extra_fields else "")
+    params = {
+        "$expand": f"fields($select={select_fields})",
+        "$select": "id,fields,createdBy",
+        "$top": str(LIST_PAGE_SIZE)
+    }
+    url = f"{GRAPH_URL}/sites/{site_id}/lists/{quote(list_name, safe='')}/items"
+    items = []
+    while url:
+        response = get_graph_client().get(url, headers={"Authorization": f"Bearer {token_manager.get_token()}"},
+                                          params=params)
+        response.raise_for_status()
+        page = response.json()
+        items.extend(page.get("value", []))
+        # The link to the next page already holds the query
+        url = page.get("@odata.nextLink")
+        params = None
+    return items
+
+
+def resolve_user_emails(display_names) -> Dict[str, str]:
+    """
+    Email of the users of Entra ID with the given display names, as in the Sol·licitant field. Names resolved in
+    previous runs are read from the metadata cache, and the rest are looked up together with $batch requests of
+    /users. Names without a user are left out.
+    """
+    metadata_cache = get_metadata_cache()
+    emails = {}
+    missing = []
+    for display_name in sorted(set(display_names)):
+        email = metadata_cache.get(f"user_email:{display_name}") if metadata_cache is not None else None
+        if email is not None:
+            emails[display_name] = email
+        else:
+            missing.append(display_name)
+    if not missing:
+        return emails
+
+    token_manager = get_token_manager()
+    headers = {
+        "Authorization": f"Bearer {token_manager.get_token()}",
+        "Content-Type": "application/json"
+    }
+    found = {}
+    for begin in range(0, len(missing), GRAPH_BATCH_LIMIT):
+        names = missing[begin:begin + GRAPH_BATCH_LIMIT]
+        requests_batch = []
+        for i, name in enumerate(names):
+            # Single quotes are escaped by doubling them in OData
+            query = urlencode({"$filter": "displayName eq '" + name.replace("'", "''") + "'",
+                               "$select": "mail,userPrincipalName,displayName"}, quote_via=quote)
+            requests_batch.append({"id": str(i), "method": "GET", "url": "/users?" + query})
+        response = get_graph_client().post(f"{GRAPH_URL}/$batch", headers=headers, json={"requests": requests_batch})
+        response.raise_for_status()
+        for item_response in response.json()["responses"]:
+            if item_response["status"] != 200:
+                continue  # Looked up again on the next call
+            users = item_response.get("body", {}).get("value", [])
+            email = (users[0].get("mail") or users[0].get("userPrincipalName")) if users else None
+            if email:
+                found[names[int(item_response["id"])]] = email
+    if found and metadata_cache is not None:
+        metadata_cache.update({f"user_email:{display_name}": email for display_name, email in found.items()})
+    emails.update(found)
+    return emails
+
+
 def get_sharepoint_web_url(token_manager, site_id, drive_id, folder_path):
     """
     Given a folder path inside the drive, returns its webUrl for user access.
     Example path: Shared Documents/_output/amarine@iciq.es
     """
-    url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drives/{drive_id}/root:/{folder_path}"
+    url = f"{GRAPH_URL}/sites/{site_id}/drives/{drive_id}/root:/{folder_path}"
     headers = {
         "Authorization": f"Bearer {token_manager.get_token()}",
     }
 
-    response = requests.get(url, headers=headers)
+    response = get_graph_client().get(url, headers=headers)
     response.raise_for_status()
     item = response.json()
     return item.get("webUrl")
 
 
+@refresh_metadata_on_not_found
 def get_author_email(job_id: str) -> str:
     """
     Given a SharePoint item ID, returns the email address stored in the Person field 'Sol·licitant'.
@@ -405,11 +1195,11 @@ def get_author_email(job_id: str) -> str:
     }
 
     list_url = (
-        f"https://graph.microsoft.com/v1.0/sites/{site_id}/lists/"
+        f"{GRAPH_URL}/sites/{site_id}/lists/"
         f"{quote(list_name, safe='')}/items/{job_id}"
     )
 
-    resp = requests.get(
+    resp = get_graph_client().get(
         list_url,
         headers={"Authorization": f"Bearer {access_token}"},
         params=params,
@@ -442,7 +1232,7 @@ def get_author_email(job_id: str) -> str:
     if isinstance(person, str):
         display_name = person
 
-        users_url = "https://graph.microsoft.com/v1.0/users"
+        users_url = f"{GRAPH_URL}/users"
         # Escape single quotes for OData
         safe_name = display_name.replace("'", "''")
         users_params = {
@@ -450,7 +1240,7 @@ def get_author_email(job_id: str) -> str:
             "$select": "mail,userPrincipalName,displayName",
         }
 
-        users_resp = requests.get(
+        users_resp = get_graph_client().get(
             users_url,
             headers={"Authorization": f"Bearer {access_token}"},
             params=users_params,
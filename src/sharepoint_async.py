@@ -0,0 +1,273 @@
+import asyncio
+import contextvars
+import os
+import random
+import time
+from typing import Awaitable, BinaryIO, Callable, Dict, List, Optional, Tuple
+
+try:
+    import aiohttp  # Optional, only needed for the asyncio transfers
+except ImportError:
+    aiohttp = None
+
+from graph import GRAPH_URL, RETRY_STATUS_CODES, GRAPH_MAX_RETRIES, GRAPH_BACKOFF_BASE, GRAPH_BACKOFF_MAX, \
+    parse_retry_after, get_graph_client
+from logger import build_process_logger, get_logger_instance
+from quick_xor_hash import get_file_hash_cache, get_remote_quick_xor_hash, is_same_content
+from sharepoint import UPLOAD_SESSION_THRESHOLD, create_remote_folders, fetch_input_folder, list_folder_uploads, \
+    print_throughput, print_upload_summary, remove_unseen_local_items, skip_unchanged_uploads, upload_large_file
+
+
+def is_async_available() -> bool:
+    return aiohttp is not None
+
+
+class AsyncGraphClient:
+    """
+    asyncio counterpart of graph.GraphClient, to keep many transfers in flight from a single thread. Same retries of
+    throttled and failed requests, with the semaphore of the event loop limiting the requests in flight.
+
+    Use it as an async context manager, which opens and closes the pool of connections:
+        async with AsyncGraphClient() as client:
+            await download_file(client, ...)
+    """
+
+    def __init__(self, concurrency=None, max_retries=GRAPH_MAX_RETRIES, backoff_base=GRAPH_BACKOFF_BASE,
+                 backoff_max=GRAPH_BACKOFF_MAX):
+        if aiohttp is None:
+            raise ImportError("The asyncio Graph client needs the aiohttp package.")
+        self.concurrency = concurrency or get_graph_client().concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.session = None
+        self.semaphore = None
+        self.paused_until = 0.0
+        self.counters: Dict[str, float] = {"requests": 0, "retries": 0, "throttled": 0, "server_errors": 0,
+                                           "connection_errors": 0, "waited_seconds": 0.0}
+
+    async def __aenter__(self):
+        # Created here and not in __init__, they belong to the running event loop
+        self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.concurrency))
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        await self.session.close()
+        # Logged together with the requests of the synchronous client
+        graph_client = get_graph_client()
+        for counter, amount in self.counters.items():
+            graph_client.count(counter, amount)
+
+    def get_backoff(self, attempt) -> float:
+        backoff = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+        return random.uniform(backoff / 2, backoff)
+
+    async def wait(self, seconds):
+        if seconds > 0:
+            self.counters["waited_seconds"] += seconds
+            await asyncio.sleep(seconds)
+
+    async def request(self, method, url, handle: Callable[["aiohttp.ClientResponse"], Awaitable],
+                      open_body: Optional[Callable[[], BinaryIO]] = None, **kwargs):
+        """
+        Sends the request and returns what handle returns for the response. handle is called within the request, so it
+        can read the body. Throttled and failed requests are retried before; the last response is handled when the
+        retries are exhausted. open_body, if given, opens the body to stream on each attempt, e.g. a file.
+        """
+        logger = build_process_logger(get_logger_instance(), "Graph")
+        attempt = 0
+        while True:
+            await self.wait(self.paused_until - time.time())
+            self.counters["requests"] += 1
+            body = open_body() if open_body is not None else None
+            if body is not None:
+                kwargs["data"] = body
+            try:
+                async with self.semaphore:
+                    async with self.session.request(method, url, **kwargs) as response:
+                        if response.status not in RETRY_STATUS_CODES or attempt >= self.max_retries:
+                            return await handle(response)
+                        status = response.status
+                        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if attempt >= self.max_retries:
+                    raise
+                self.counters["connection_errors"] += 1
+                delay = self.get_backoff(attempt)
+                logger.warning(f"{method} {url} failed ({e}). Retrying in {delay:.1f}s "
+                               f"({str(attempt + 1)}/{str(self.max_retries)}).")
+            else:
+                delay = retry_after if retry_after is not None else self.get_backoff(attempt)
+                if status == 429:
+                    self.counters["throttled"] += 1
+                    self.paused_until = max(self.paused_until, time.time() + delay)
+                else:
+                    self.counters["server_errors"] += 1
+                logger.warning(f"{method} {url} answered {str(status)}. Retrying in {delay:.1f}s "
+                               f"({str(attempt + 1)}/{str(self.max_retries)}).")
+            finally:
+                if body is not None:
+                    body.close()
+            self.counters["retries"] += 1
+            attempt += 1
+            await self.wait(delay)
+
+
+async def run_blocking(function, *args):
+    """Runs a blocking function (file hashing, token refresh, synchronous Graph calls) out of the event loop."""
+    return await asyncio.get_running_loop().run_in_executor(None, contextvars.copy_context().run, function, *args)
+
+
+async def get_authorization(token_manager) -> str:
+    # The token may be refreshed over the network
+    return f"Bearer {await run_blocking(token_manager.get_token)}"
+
+
+async def read_json(response) -> dict:
+    response.raise_for_status()
+    return await response.json()
+
+
+async def list_folder_contents(client: AsyncGraphClient, token_manager, drive_id, path) -> List[dict]:
+    url = f"{GRAPH_URL}/drives/{drive_id}/root:/{path}:/children"
+    headers = {"Authorization": await get_authorization(token_manager)}
+    return (await client.request("GET", url, read_json, headers=headers))['value']
+
+
+async def download_file(client: AsyncGraphClient, token_manager, drive_id, item_path, local_path,
+                        quick_xor_hash=None) -> int:
+    url = f"{GRAPH_URL}/drives/{drive_id}/root:/{item_path}:/content"
+    headers = {"Authorization": await get_authorization(token_manager)}
+
+    async def write_file(response):
+        response.raise_for_status()
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        size = 0
+        with open(local_path, 'wb') as f:
+            async for chunk in response.content.iter_chunked(1024 * 1024):
+                f.write(chunk)
+                size += len(chunk)
+        return size
+
+    size = await client.request("GET", url, write_file, headers=headers)
+    file_hash_cache = get_file_hash_cache()
+    if quick_xor_hash is not None and file_hash_cache is not None:
+        file_hash_cache.store_quick_xor_hash(local_path, quick_xor_hash)
+    print(f"✅ Descargado: {item_path}")
+    return size
+
+
+async def download_folder_recursive(client: AsyncGraphClient, token_manager, drive_id, remote_path, local_root,
+                                    seen=None) -> Tuple[int, int, int]:
+    """
+    Downloads the remote folder, listing its subfolders and downloading its files concurrently. Same as
+    sharepoint.download_folder_recursive: unchanged files are kept and the local path of every item is added to seen.
+    """
+    os.makedirs(local_root, exist_ok=True)
+    folders = []
+    files = []
+    skipped = 0
+    for item in await list_folder_contents(client, token_manager, drive_id, remote_path):
+        item_path = f"{remote_path}/{item['name']}"
+        local_path = os.path.join(local_root, item['name'])
+        if seen is not None:
+            seen.add(local_path)
+        if 'folder' in item:
+            folders.append(download_folder_recursive(client, token_manager, drive_id, item_path, local_path, seen))
+        elif 'file' in item:
+            remote_hash = get_remote_quick_xor_hash(item)
+            if await run_blocking(is_same_content, local_path, item.get("size"), remote_hash):
+                skipped += 1
+            else:
+                files.append(download_file(client, token_manager, drive_id, item_path, local_path, remote_hash))
+    results = await asyncio.gather(asyncio.gather(*folders), asyncio.gather(*files))
+    file_count = len(files) + sum(result[0] for result in results[0])
+    byte_count = sum(results[1]) + sum(result[1] for result in results[0])
+    skipped += sum(result[2] for result in results[0])
+    return file_count, byte_count, skipped
+
+
+async def upload_file(client: AsyncGraphClient, token_manager, drive_id, remote_path, local_file_path) -> int:
+    logger = build_process_logger(get_logger_instance(), "upload_file")
+    logger.info("Uploading from local path " + local_file_path + " to " + remote_path)
+    size = os.path.getsize(local_file_path)
+    if size > UPLOAD_SESSION_THRESHOLD:
+        # Upload sessions send the file in sequential chunks, nothing to gain from running them in the event loop
+        await run_blocking(upload_large_file, token_manager, drive_id, remote_path, local_file_path)
+    else:
+        url = f"{GRAPH_URL}/drives/{drive_id}/root:/{remote_path}:/content"
+        headers = {
+            "Authorization": await get_authorization(token_manager),
+            "Content-Type": "application/octet-stream"
+        }
+        # Streamed from the file, opened again if the request is retried
+        await client.request("PUT", url, read_json, open_body=lambda: open(local_file_path, 'rb'), headers=headers)
+    logger.info(f"✅ Upload Done")
+    return size
+
+
+async def upload_folder_recursive(client: AsyncGraphClient, token_manager, drive_id, local_folder_path,
+                                  remote_folder_path):
+    logger = build_process_logger(get_logger_instance(), "Upload data results")
+    uploads, remote_folders = list_folder_uploads(local_folder_path, remote_folder_path)
+
+    start_time = time.time()
+    # Parallel uploads to a folder that does not exist yet would race to create it
+    existing_folders = await run_blocking(create_remote_folders, token_manager, drive_id, remote_folders)
+    file_count = len(uploads)
+    uploads = await run_blocking(skip_unchanged_uploads, token_manager, drive_id, uploads, existing_folders)
+    if len(uploads) < file_count:
+        logger.info(f"{str(file_count - len(uploads))} files are already in SharePoint with the same content.")
+    tasks = [asyncio.ensure_future(upload_file(client, token_manager, drive_id, remote_file, local_file))
+             for remote_file, local_file in uploads]
+    total_bytes = 0
+    for i, (task, (remote_file, local_file)) in enumerate(zip(tasks, uploads)):
+        total_bytes += await task
+        logger.info(f"[{str(i + 1)}/{str(len(uploads))}] Uploaded {remote_file}")
+    print_upload_summary(logger, len(uploads), total_bytes, start_time)
+
+
+async def update_list_item_fields(client: AsyncGraphClient, token_manager, site_id, list_name, item_id,
+                                  updated_fields: dict) -> dict:
+    patch_url = f"{GRAPH_URL}/sites/{site_id}/lists/{list_name}/items/{item_id}/fields"
+    headers = {
+        "Authorization": await get_authorization(token_manager),
+        "Content-Type": "application/json"
+    }
+    return await client.request("PATCH", patch_url, read_json, headers=headers, json=updated_fields)
+
+
+async def get_sharepoint_web_url(client: AsyncGraphClient, token_manager, site_id, drive_id, folder_path) -> str:
+    url = f"{GRAPH_URL}/sites/{site_id}/drives/{drive_id}/root:/{folder_path}"
+    headers = {"Authorization": await get_authorization(token_manager)}
+    return (await client.request("GET", url, read_json, headers=headers)).get("webUrl")
+
+
+# Synchronous wrappers, each one runs its own event loop
+def run_with_client(function, *args):
+    """Runs function(client, *args) in a new event loop, with a client open for its duration."""
+    async def run():
+        async with AsyncGraphClient() as client:
+            return await function(client, *args)
+    return asyncio.run(run())
+
+
+def run_fetch_input_folder(token_manager, drive_id, remote_path, input_path, mode="full", begin=None, end=None,
+                           naf=None):
+    """Same as sharepoint.fetch_input_folder, with the full download done by the asyncio client."""
+    if mode != "full":
+        return fetch_input_folder(token_manager, drive_id, remote_path, input_path, mode, begin=begin, end=end, naf=naf)
+    print("Comenzando descarga recursiva de SharePoint...")
+    start_time = time.time()
+    seen = set()
+    file_count, byte_count, skipped = run_with_client(download_folder_recursive, token_manager, drive_id, remote_path,
+                                                      input_path, seen)
+    remove_unseen_local_items(input_path, seen)
+    print(f"✅ Descarga completada. {skipped} archivos sin cambios no se han descargado.")
+    print_throughput(file_count, byte_count, start_time)
+
+
+def run_upload_folder(token_manager, drive_id, local_folder_path, remote_folder_path):
+    """Same as sharepoint.upload_folder_recursive, with the uploads done by the asyncio client."""
+    run_with_client(upload_folder_recursive, token_manager, drive_id, local_folder_path, remote_folder_path)
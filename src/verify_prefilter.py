@@ -0,0 +1,29 @@
+import argparse
+import os
+
+from defines import ROOT_FOLDER
+from page_cache import list_pdfs
+from pdf import verify_prefilter
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the raw content prefilter of Justicier (--prefilter) against "
+                                                 "the full text extraction of a corpus of PDFs")
+    parser.add_argument("folder", nargs="?", default=os.path.join(ROOT_FOLDER, "input"),
+                        help="Folder with the PDFs to check (default: ./input).")
+    args = parser.parse_args()
+
+    counters = verify_prefilter(list_pdfs(args.folder))
+    print(f"Pages: {str(counters['pages'])}. Pages always extracted because their content can not be checked: "
+          f"{str(counters['undecidable_pages'])}. Pages that would be skipped for an unknown NAF: "
+          f"{str(counters['skipped_pages'])}.")
+    print(f"Identifiers checked: {str(counters['identifiers'])}. False negatives: "
+          f"{str(counters['false_negatives'])}.")
+    if counters["false_negatives"] > 0:
+        print("❌ The prefilter misses identifiers of this corpus. Do not enable it.")
+        exit(1)
+    print("✅ The prefilter finds every identifier of this corpus.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+import argparse
+import itertools
+import json
+import os
+import signal
+import threading
+import time
+from typing import List, Optional
+
+from TokenManager import get_token_manager
+from arguments import parse_arguments, complete_parsed_arguments
+from chrono import elapsed_time
+from defines import WORKER_QUEUE_FOLDER
+from logger import build_process_logger, get_console_logger, set_logger
+from mail import mail_process
+from main import process, apply_performance_arguments
+from pdf import shutdown_scan_pool
+from sharepoint import ListItemUpdateBuffer, flush_list_item_updates, reset_list_item_updates, \
+    set_list_item_updates, update_list_item_field
+
+# States of a job, each one a subfolder of the queue
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+JOB_STATES = [PENDING, RUNNING, DONE, FAILED]
+
+# Seconds between checks of the queue when it is empty
+WORKER_POLL_INTERVAL = 2.0
+
+# Numbers the jobs submitted by this process, so their names are unique
+submitted_jobs = itertools.count(1)
+
+
+def get_job_path(queue_folder, state, job_name):
+    return os.path.join(queue_folder, state, job_name)
+
+
+def read_job(path) -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def get_running_path(queue_folder, job_name, worker_pid):
+    """The running file of a job is named after the worker that claimed it, so the claim and its owner are atomic."""
+    return get_job_path(queue_folder, RUNNING, f"{str(worker_pid)}-{job_name}")
+
+
+def write_job(path, job: dict):
+    # Temporary file of this process only, other processes may be writing the same job
+    temporary_path = path + "." + str(os.getpid()) + ".tmp"
+    with open(temporary_path, "w", encoding="utf-8") as f:
+        json.dump(job, f, indent=2)
+    os.replace(temporary_path, path)
+
+
+def ensure_queue(queue_folder):
+    for state in JOB_STATES:
+        os.makedirs(os.path.join(queue_folder, state), exist_ok=True)
+
+
+def submit_job(queue_folder, argv: List[str], config: Optional[dict] = None) -> str:
+    """
+    Adds a justification with the arguments of src/main.py to the queue. Returns the name of its job file. For requests
+    of the list, config can hold their configuration, so the worker does not read it from the list again.
+    """
+    ensure_queue(queue_folder)
+    # Names sort in order of submission, so the jobs are done first in, first out
+    job_name = f"{time.time():.6f}_{str(os.getpid())}_{str(next(submitted_jobs))}.json"
+    temporary_path = get_job_path(queue_folder, PENDING, "." + job_name)
+    job = {"argv": argv, "submitted": time.time()}
+    if config is not None:
+        job["config"] = config
+    write_job(temporary_path, job)
+    os.replace(temporary_path, get_job_path(queue_folder, PENDING, job_name))
+    return job_name
+
+
+def wait_for_job(queue_folder, job_name, poll_interval=WORKER_POLL_INTERVAL) -> dict:
+    """Waits until the worker finishes the job and returns it, with its state and result."""
+    while True:
+        for state in [DONE, FAILED]:
+            path = get_job_path(queue_folder, state, job_name)
+            if os.path.exists(path):
+                job = read_job(path)
+                job["state"] = state
+                return job
+        time.sleep(poll_interval)
+
+
+def claim_next_job(queue_folder) -> Optional[str]:
+    """
+    Moves the oldest pending job to the running folder, under the name given by get_running_path, and returns its name.
+    The move is atomic, so several workers can share the queue without doing the same job twice.
+    """
+    for job_name in sorted(os.listdir(os.path.join(queue_folder, PENDING))):
+        if job_name.startswith(".") or not job_name.endswith(".json"):
+            continue
+        try:
+            os.rename(get_job_path(queue_folder, PENDING, job_name),
+                      get_running_path(queue_folder, job_name, os.getpid()))
+        except FileNotFoundError:  # Claimed by another worker
+            continue
+        return job_name
+    return None
+
+
+def is_process_alive(pid) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def fail_abandoned_jobs(queue_folder):
+    """
+    Jobs left in the running folder by a worker that was killed are marked as failed. They are not done again, their
+    justification may have been partially uploaded already.
+    """
+    for running_name in os.listdir(os.path.join(queue_folder, RUNNING)):
+        if not running_name.endswith(".json"):
+            continue
+        path = get_job_path(queue_folder, RUNNING, running_name)
+        try:
+            job = read_job(path)
+        except (OSError, ValueError):
+            continue
+        if "-" in running_name:
+            worker_pid, job_name = running_name.split("-", 1)
+            worker_pid = int(worker_pid)
+        else:  # Claimed by a worker of a version that kept the worker only in the job
+            worker_pid, job_name = job.get("worker"), running_name
+        if worker_pid is not None and is_process_alive(worker_pid):
+            continue
+        job["error"] = "The worker was stopped during the justification."
+        write_job(path, job)
+        os.replace(path, get_job_path(queue_folder, FAILED, job_name))
+
+
+def run_justification(argv: List[str], config: Optional[dict] = None):
+    """
+    Same as src/main.py with the given arguments, without leaving the process: parses them, justifies and notifies the
+    author. config is the configuration of the request of the list, if it was already read. Raises an exception if the
+    justification could not be done.
+    """
+    try:
+        args = parse_arguments(argv)
+    except SystemExit:  # argparse exits on invalid arguments, but the worker has to carry on with the next job
+        raise ValueError("Arguments could not have been parsed. The arguments are: " + str(argv))
+
+    common = "Error parsing arguments of the job. The arguments are: " + str(argv)
+    # Other worker threads flush their own jobs' changes of the list, not the ones of this job
+    list_updates_token = set_list_item_updates(ListItemUpdateBuffer())
+    try:
+        # Every justification talks to Graph. Started once, by the first job
+        get_token_manager().start_background_refresh()
+        try:
+            args = complete_parsed_arguments(args, common, config)
+        except SystemExit as e:  # Invalid data in the request of the list
+            raise ValueError(f"The arguments of the request are not valid (exit code {str(e.code)}). {common}")
+        link, log_link = process(args, args.input_location)
+    except Exception as e:
+        if args.request:
+            update_list_item_field(args.request, {"Estatworkflow": "Error", "Missatge_x0020_error":
+                                                  f"A not controlled error happen during execution of "
+                                                  f"Justicier. Error is: {str(e)}"})
+        raise
+    finally:
+        try:
+            flush_list_item_updates()
+        finally:
+            reset_list_item_updates(list_updates_token)
+
+    if args.request:
+        mail_process(link, log_link, args)
+    return link, log_link
+
+
+def work_on_queue(queue_folder, defaults: List[str], poll_interval, stop: threading.Event, console_logger):
+    """Claims and does the jobs of the queue one after the other until stop is set."""
+    # Each thread has its own context, jobs set their logger there and restore this one when they finish
+    set_logger(console_logger)
+    logger = build_process_logger(console_logger, "Worker")
+    while not stop.is_set():
+        job_name = claim_next_job(queue_folder)
+        if job_name is None:
+            stop.wait(poll_interval)
+            continue
+
+        path = get_running_path(queue_folder, job_name, os.getpid())
+        job = read_job(path)
+        job["worker"] = os.getpid()
+        job["started"] = time.time()
+        write_job(path, job)
+        logger.info(f"Starting job {job_name} with arguments {str(job['argv'])}.")
+        start_time = time.time()
+        try:
+            job["link"], job["log_link"] = run_justification(defaults + job["argv"], job.get("config"))
+        except Exception as e:
+            logger.error(f"Job {job_name} failed. Continuing with the next one. Error is: {str(e)}")
+            job["error"] = str(e)
+            state = FAILED
+        else:
+            logger.info(f"Job {job_name} finished in {elapsed_time(start_time)}: {job['link']}")
+            state = DONE
+        job["finished"] = time.time()
+        write_job(path, job)
+        os.replace(path, get_job_path(queue_folder, state, job_name))
+
+
+def run_worker(queue_folder, defaults: List[str], poll_interval=WORKER_POLL_INTERVAL, stop: threading.Event = None,
+               jobs=1):
+    """
+    Does the jobs of the queue until stop is set, up to `jobs` of them at the same time. Imports, the registry of
+    employees, the connections and token of Graph, the identifiers of SharePoint and the PDF caches stay loaded between
+    jobs, so each justification only spends the time of its own extraction and upload.
+    """
+    console_logger = get_console_logger()
+    set_logger(console_logger)
+    logger = build_process_logger(console_logger, "Worker")
+    stop = stop or threading.Event()
+
+    ensure_queue(queue_folder)
+    fail_abandoned_jobs(queue_folder)
+    logger.info(f"Waiting for jobs in {queue_folder}, {str(jobs)} at the same time.")
+    threads = [threading.Thread(target=work_on_queue, name=f"worker-{str(i + 1)}",
+                                args=(queue_folder, defaults, poll_interval, stop, console_logger))
+               for i in range(1, jobs)]
+    for thread in threads:
+        thread.start()
+    # The main thread works too, and keeps receiving the signals that stop the worker
+    work_on_queue(queue_folder, defaults, poll_interval, stop, console_logger)
+    for thread in threads:
+        thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Justicier worker",
+                                     epilog="Any other argument of src/main.py is the default of every job: the "
+                                            "performance arguments apply to the worker and the rest can be "
+                                            "overridden by the arguments of each job.")
+    parser.add_argument("--queue", default=WORKER_QUEUE_FOLDER,
+                        help="Folder of the queue of jobs, shared by the worker and the clients that submit jobs.")
+    parser.add_argument("--poll-interval", type=float, default=WORKER_POLL_INTERVAL,
+                        help="Seconds between checks of the queue when it is empty.")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="Justifications done at the same time, each one in its own thread.")
+    parser.add_argument("--submit", action="store_true",
+                        help="Instead of working, add a justification with the rest of the arguments to the queue.")
+    parser.add_argument("--wait", action="store_true",
+                        help="With --submit, wait until the worker finishes the justification. Exits with an error "
+                             "if it failed.")
+    worker_args, remaining = parser.parse_known_args()
+
+    if worker_args.submit:
+        job_name = submit_job(worker_args.queue, remaining)
+        print(f"Job {job_name} submitted.")
+        if worker_args.wait:
+            job = wait_for_job(worker_args.queue, job_name, worker_args.poll_interval)
+            if job["state"] == FAILED:
+                print(f"❌ Job {job_name} failed: {job.get('error')}")
+                exit(1)
+            print(f"✅ Job {job_name}: {job.get('link')}")
+        return
+
+    # The performance arguments of the worker apply to all the jobs
+    apply_performance_arguments(parse_arguments(remaining))
+
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        print("Stopping the worker after the current job.")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+    try:
+        run_worker(worker_args.queue, remaining, worker_args.poll_interval, stop, max(1, worker_args.jobs))
+    finally:
+        shutdown_scan_pool()
+    print("Worker is stopped.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+import os
+import sys
+
+import pytest
+from pypdf import PdfWriter
+from pypdf.generic import DictionaryObject, NameObject, StreamObject
+
+# The modules of Justicier are imported by name from src, as src/main.py does
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+
+@pytest.fixture
+def write_text_pdf():
+    """Writes a PDF with a page for each of the given texts, in Helvetica, and returns its path."""
+    def write(path, texts):
+        writer = PdfWriter()
+        font = writer._add_object(DictionaryObject({NameObject("/Type"): NameObject("/Font"),
+                                                     NameObject("/Subtype"): NameObject("/Type1"),
+                                                     NameObject("/BaseFont"): NameObject("/Helvetica"),
+                                                     NameObject("/Encoding"): NameObject("/WinAnsiEncoding")}))
+        for text in texts:
+            page = writer.add_blank_page(612, 792)
+            page[NameObject("/Resources")] = DictionaryObject({
+                NameObject("/Font"): DictionaryObject({NameObject("/F1"): font})
+            })
+            contents = StreamObject()
+            contents.set_data(b"BT /F1 12 Tf 72 720 Td (" + text.encode("latin-1") + b") Tj ET")
+            page[NameObject("/Contents")] = writer._add_object(contents)
+        with open(path, "wb") as f:
+            writer.write(f)
+        return str(path)
+    return write
@@ -0,0 +1,56 @@
+import threading
+
+import pytest
+
+import batch
+import sharepoint
+from job_context import JobContext
+
+
+class Args:
+    def __init__(self, request):
+        self.request = request
+        self.naf = None
+        self.location = "local"
+
+
+def failing_process(args, INPUT_FOLDER, prepare_input=True):
+    with JobContext(args, INPUT_FOLDER):
+        sharepoint.update_list_item_field(args.request, {"Estatworkflow": "En execució"})
+        if args.request == "1":
+            # Error of a stage, queued by process itself
+            sharepoint.update_list_item_field(args.request, {"Estatworkflow": "Error",
+                                                             "Missatge_x0020_error": "Stage failed"})
+        raise ValueError("Stage failed")
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    sent = []
+    monkeypatch.setattr(sharepoint.ListItemUpdateBuffer, "send",
+                        staticmethod(lambda pending: sent.append((threading.current_thread().name, pending))))
+    monkeypatch.setattr(batch, "refresh_manifest", lambda input_folder: None)
+    monkeypatch.setattr(batch, "get_identifier_index", lambda: None)
+    monkeypatch.setattr(batch, "process", failing_process)
+    return sent
+
+
+def test_error_of_the_stages_is_kept(sent, tmp_path):
+    results = batch.process_batch([Args("1"), Args("2")], str(tmp_path))
+
+    assert [pending for thread, pending in sent] == [
+        {"1": {"Estatworkflow": "Error", "Missatge_x0020_error": "Stage failed"}},
+        {"2": {"Estatworkflow": "Error", "Missatge_x0020_error": "A not controlled error happen during execution of "
+                                                                 "Justicier. Error is: Stage failed"}}]
+    assert [(job_name, link) for job_name, link, error in results] == [("request 1", None), ("request 2", None)]
+
+
+def test_failed_list_update_does_not_stop_the_batch(sent, tmp_path, monkeypatch):
+    def send(pending):
+        raise RuntimeError("Failed to update item")
+
+    monkeypatch.setattr(sharepoint.ListItemUpdateBuffer, "send", staticmethod(send))
+    results = batch.process_batch([Args("1"), Args("2"), Args("3")], str(tmp_path))
+
+    assert [job_name for job_name, link, error in results] == ["request 1", "request 2", "request 3"]
+    assert all(isinstance(error, ValueError) for job_name, link, error in results)
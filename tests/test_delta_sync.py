@@ -0,0 +1,293 @@
+import itertools
+import json
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+import pytest
+
+import graph
+import quick_xor_hash
+import sharepoint
+
+DRIVE_ID = "drive"
+INPUT_PATH = "Justicier/input"
+
+
+def get_quick_xor_hash(content: bytes) -> str:
+    with tempfile.NamedTemporaryFile() as f:
+        f.write(content)
+        f.flush()
+        return quick_xor_hash.compute_quick_xor_hash(f.name)
+
+
+class FakeDrive:
+    """
+    Drive of SharePoint as seen by a delta query of its root: every item changed since a delta link, with its parent ID
+    but without its path, and deleted items with the deleted facet only.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.version = 0
+        self.items = {"root": {"name": "root", "parent": None, "content": None, "version": 0}}
+        self.deleted = {}
+        self.expired_links = set()
+        self.requests = []
+
+    def add(self, path, content=None):
+        """Adds the file (or folder, without content) and the folders of its path that are missing."""
+        parent = "root"
+        names = path.split("/")
+        for i, name in enumerate(names):
+            child = self.find_child(parent, name)
+            if child is None:
+                child = str(next(self.ids))
+                self.items[child] = {"name": name, "parent": parent, "content": None, "version": 0}
+                self.touch(child)
+            parent = child
+        if content is not None:
+            self.change_content(parent, content)
+        return parent
+
+    def find_child(self, parent, name):
+        for item_id, item in self.items.items():
+            if item["parent"] == parent and item["name"] == name:
+                return item_id
+        return None
+
+    def find(self, path):
+        item_id = "root"
+        for name in path.split("/"):
+            item_id = self.find_child(item_id, name)
+        return item_id
+
+    def touch(self, item_id):
+        self.version += 1
+        self.items[item_id]["version"] = self.version
+
+    def change_content(self, item_id, content):
+        self.items[item_id]["content"] = content
+        self.touch(item_id)
+        # The cTag only changes with the content, not when the item is renamed or moved
+        self.items[item_id]["content_version"] = self.version
+
+    def change(self, path, content):
+        self.change_content(self.find(path), content)
+
+    def move(self, path, new_parent_path):
+        item_id = self.find(path)
+        self.items[item_id]["parent"] = self.find(new_parent_path)
+        self.touch(item_id)
+
+    def delete(self, path):
+        """Deletes the item and its children. Like SharePoint, only the deletion of the item itself is reported."""
+        item_id = self.find(path)
+        removed = [item_id]
+        while removed:
+            removed_id = removed.pop()
+            del self.items[removed_id]
+            removed.extend(child for child, item in self.items.items() if item["parent"] == removed_id)
+        self.version += 1
+        self.deleted[item_id] = self.version
+
+    def get_path(self, item_id):
+        names = []
+        while item_id != "root":
+            names.append(self.items[item_id]["name"])
+            item_id = self.items[item_id]["parent"]
+        return "/".join(reversed(names))
+
+    def get_delta(self, since):
+        changed = sorted((item for item in self.items.items() if item[1]["version"] > since),
+                         key=lambda item: item[1]["version"])
+        values = []
+        for item_id, item in changed:
+            value = {"id": item_id, "name": item["name"]}
+            if item["parent"] is None:
+                value["root"] = {}
+            else:
+                value["parentReference"] = {"driveId": DRIVE_ID, "id": item["parent"]}
+            if item["content"] is None:
+                value["folder"] = {}
+            else:
+                value["file"] = {"hashes": {"quickXorHash": get_quick_xor_hash(item["content"])}}
+                value["size"] = len(item["content"])
+                value["cTag"] = f"c{str(item['content_version'])}"
+            values.append(value)
+        values.extend({"id": item_id, "deleted": {}} for item_id, version in self.deleted.items() if version > since)
+        return values
+
+
+class Handler(BaseHTTPRequestHandler):
+    drive: FakeDrive = None
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        drive = self.drive
+        url = urlparse(self.path)
+        path = unquote(url.path)
+        query = parse_qs(url.query)
+        base = f"http://{self.headers['Host']}"
+        with drive.lock:
+            drive.requests.append(path)
+            if path == f"/drives/{DRIVE_ID}/root/delta":
+                since = int(query.get("token", ["0"])[0])
+                if since in drive.expired_links:
+                    return self.send_json(410, {"error": {"code": "resyncRequired"}})
+                values = drive.get_delta(since)
+                # Two pages, to follow the next link
+                page = int(query.get("page", ["0"])[0])
+                if page == 0 and len(values) > 1:
+                    return self.send_json(200, {"value": values[:len(values) // 2],
+                                                "@odata.nextLink": f"{base}{url.path}?token={since}&page=1"})
+                values = values[len(values) // 2:] if page == 1 else values
+                return self.send_json(200, {"value": values,
+                                            "@odata.deltaLink": f"{base}{url.path}?token={drive.version}"})
+            prefix = f"/drives/{DRIVE_ID}/root:/"
+            if path.startswith(prefix) and path.endswith(":/content"):
+                item_id = drive.find(path[len(prefix):-len(":/content")])
+                content = drive.items[item_id]["content"]
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                return self.wfile.write(content)
+            if path.startswith(prefix):
+                item_id = drive.find(path[len(prefix):])
+                if item_id is None:
+                    return self.send_json(404, {"error": {"code": "itemNotFound"}})
+                return self.send_json(200, {"id": item_id})
+        self.send_json(404, {"error": {"code": "invalidRequest"}})
+
+
+class Token:
+    def get_token(self):
+        return "token"
+
+
+@pytest.fixture
+def drive(tmp_path, monkeypatch):
+    drive = FakeDrive()
+    drive.add(INPUT_PATH + "/_salaries/2024/2401_Nomines.pdf", b"salary 2401")
+    drive.add(INPUT_PATH + "/_salaries/2024/2402_Nomines.pdf", b"salary 2402")
+    drive.add(INPUT_PATH + "/_contracts/080413515470_2301.pdf", b"contract")
+    drive.add(INPUT_PATH + "/NAF_DNI.xlsx", b"registry")
+    drive.add("Justicier/output/alice@iciq.es/result.pdf", b"result")
+
+    handler = type("DriveHandler", (Handler,), {"drive": drive})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(sharepoint, "GRAPH_URL", f"http://127.0.0.1:{str(server.server_address[1])}")
+    monkeypatch.setattr(sharepoint, "CACHE_FOLDER", str(tmp_path / "cache"))
+    monkeypatch.setattr(graph, "GRAPH_BACKOFF_BASE", 0.0)
+    previous_hash_cache = quick_xor_hash.get_file_hash_cache()
+    quick_xor_hash.set_file_hash_cache(None)
+    yield drive
+    quick_xor_hash.set_file_hash_cache(previous_hash_cache)
+    server.shutdown()
+    server.server_close()
+
+
+def sync(drive, input_path):
+    drive.requests.clear()
+    return sharepoint.sync_input_folder_delta(Token(), DRIVE_ID, INPUT_PATH, input_path, workers=2)
+
+
+def read_tree(folder):
+    tree = {}
+    for root, dirs, files in os.walk(folder):
+        for name in files:
+            path = os.path.join(root, name)
+            with open(path, "rb") as f:
+                tree[os.path.relpath(path, folder).replace(os.sep, "/")] = f.read()
+    return tree
+
+
+def remote_tree(drive):
+    prefix = INPUT_PATH + "/"
+    return {drive.get_path(item_id)[len(prefix):]: item["content"] for item_id, item in drive.items.items()
+            if item["content"] is not None and drive.get_path(item_id).startswith(prefix)}
+
+
+def test_first_sync_downloads_only_the_input_folder(drive, tmp_path):
+    input_path = str(tmp_path / "input")
+    counters = sync(drive, input_path)
+
+    assert read_tree(input_path) == remote_tree(drive)
+    assert counters["downloaded"] == 4
+    assert f"/drives/{DRIVE_ID}/root/delta" in drive.requests
+
+
+def test_unchanged_folder_costs_a_single_request(drive, tmp_path):
+    input_path = str(tmp_path / "input")
+    sync(drive, input_path)
+    counters = sync(drive, input_path)
+
+    assert drive.requests == [f"/drives/{DRIVE_ID}/root/delta"]
+    assert counters["downloaded"] == 0
+    assert read_tree(input_path) == remote_tree(drive)
+
+
+def test_changes_are_applied(drive, tmp_path):
+    input_path = str(tmp_path / "input")
+    sync(drive, input_path)
+    drive.add(INPUT_PATH + "/_salaries/2024/2403_Nomines.pdf", b"salary 2403")
+    drive.change(INPUT_PATH + "/_salaries/2024/2401_Nomines.pdf", b"salary 2401, corrected")
+    drive.delete(INPUT_PATH + "/NAF_DNI.xlsx")
+    drive.move(INPUT_PATH + "/_salaries/2024/2402_Nomines.pdf", INPUT_PATH + "/_contracts")
+    drive.move(INPUT_PATH + "/_contracts/080413515470_2301.pdf", "Justicier/output")
+    drive.add("Justicier/output/bob@iciq.es/result.pdf", b"another result")
+    counters = sync(drive, input_path)
+
+    assert read_tree(input_path) == remote_tree(drive)
+    assert counters["downloaded"] == 2
+    assert counters["moved"] == 1
+    assert counters["deleted"] == 2  # Deleted and moved out of the folder
+
+
+def test_moved_folder_takes_its_files(drive, tmp_path):
+    input_path = str(tmp_path / "input")
+    sync(drive, input_path)
+    drive.add(INPUT_PATH + "/_old")
+    drive.move(INPUT_PATH + "/_salaries/2024", INPUT_PATH + "/_old")
+    counters = sync(drive, input_path)
+
+    assert read_tree(input_path) == remote_tree(drive)
+    assert counters["downloaded"] == 0
+
+
+def test_expired_delta_link_resynchronizes(drive, tmp_path):
+    input_path = str(tmp_path / "input")
+    sync(drive, input_path)
+    drive.expired_links.add(drive.version)
+    drive.delete(INPUT_PATH + "/NAF_DNI.xlsx")
+    drive.change(INPUT_PATH + "/_salaries/2024/2401_Nomines.pdf", b"salary 2401, corrected")
+    counters = sync(drive, input_path)
+
+    assert read_tree(input_path) == remote_tree(drive)
+    # The files whose content did not change are kept
+    assert counters["downloaded"] == 1
+
+
+def test_recreated_input_folder_resynchronizes(drive, tmp_path):
+    input_path = str(tmp_path / "input")
+    sync(drive, input_path)
+    drive.delete(INPUT_PATH)
+    drive.add(INPUT_PATH + "/_salaries/2024/2405_Nomines.pdf", b"salary 2405")
+    sync(drive, input_path)
+
+    assert read_tree(input_path) == remote_tree(drive)
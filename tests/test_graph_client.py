@@ -0,0 +1,141 @@
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import graph
+
+
+class FakeGraph:
+    """Answers each path with the scripted (status, headers) answers, in order, and then with 200."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.scripts = {}
+        self.requests = []
+
+    def script(self, path, *answers):
+        self.scripts[path] = list(answers)
+
+    def next_answer(self, path, body):
+        with self.lock:
+            self.requests.append((path, body))
+            answers = self.scripts.get(path)
+            return answers.pop(0) if answers else (200, {})
+
+    def bodies(self, path):
+        return [body for request_path, body in self.requests if request_path == path]
+
+
+class Handler(BaseHTTPRequestHandler):
+    fake: FakeGraph = None
+
+    def log_message(self, *args):
+        pass
+
+    def answer(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        status, headers = self.fake.next_answer(self.path, body)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    do_GET = answer
+    do_PUT = answer
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    fake = FakeGraph()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), type("GraphHandler", (Handler,), {"fake": fake}))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(graph, "GRAPH_URL", f"http://127.0.0.1:{str(server.server_address[1])}")
+    yield fake
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """The waits of the client are recorded instead of slept."""
+    sleeps = []
+    monkeypatch.setattr(graph.time, "sleep", sleeps.append)
+    return sleeps
+
+
+def test_retry_after_in_seconds(fake, sleeps):
+    fake.script("/sites", (503, {"Retry-After": "7"}))
+    client = graph.GraphClient()
+    response = client.get(f"{graph.GRAPH_URL}/sites")
+
+    assert response.status_code == 200
+    assert sleeps == [7.0]
+    counters = client.get_counters()
+    assert (counters["requests"], counters["retries"], counters["server_errors"], counters["throttled"]) == (2, 1, 1, 0)
+    assert counters["waited_seconds"] == 7.0
+
+
+def test_retry_after_as_a_date(fake, sleeps):
+    fake.script("/sites", (503, {"Retry-After": formatdate(time.time() + 20, usegmt=True)}))
+    client = graph.GraphClient()
+    assert client.get(f"{graph.GRAPH_URL}/sites").status_code == 200
+    assert len(sleeps) == 1 and 18.0 <= sleeps[0] <= 20.0
+
+
+def test_backoff_without_retry_after(fake, sleeps):
+    fake.script("/sites", (503, {}), (502, {}), (504, {}))
+    client = graph.GraphClient(backoff_base=1.0, backoff_max=60.0)
+    assert client.get(f"{graph.GRAPH_URL}/sites").status_code == 200
+
+    # Jittered between half and all of the exponential backoff
+    assert len(sleeps) == 3
+    for attempt, delay in enumerate(sleeps):
+        assert 2 ** attempt / 2 <= delay <= 2 ** attempt
+    assert client.get_counters()["server_errors"] == 3
+
+
+def test_backoff_is_capped():
+    client = graph.GraphClient(backoff_base=1.0, backoff_max=60.0)
+    for _ in range(100):
+        assert 30.0 <= client.get_backoff(20) <= 60.0
+
+
+def test_throttling_pauses_every_request(fake, sleeps):
+    fake.script("/sites", (429, {"Retry-After": "30"}))
+    client = graph.GraphClient()
+    assert client.get(f"{graph.GRAPH_URL}/sites").status_code == 200
+    assert client.get_counters()["throttled"] == 1
+
+    # The sleeps are not real, so the pause of the 429 is still on for any other request
+    sleeps.clear()
+    assert client.get(f"{graph.GRAPH_URL}/drives").status_code == 200
+    assert len(sleeps) == 1 and 25.0 <= sleeps[0] <= 30.0
+
+
+def test_exhausted_retries_return_the_last_response(fake, sleeps):
+    fake.script("/sites", *[(503, {"Retry-After": "1"})] * 5)
+    client = graph.GraphClient(max_retries=2)
+    response = client.get(f"{graph.GRAPH_URL}/sites")
+
+    assert response.status_code == 503
+    counters = client.get_counters()
+    assert (counters["requests"], counters["retries"]) == (3, 2)
+
+
+def test_streamed_body_is_sent_again_from_its_position(fake, sleeps, tmp_path):
+    path = tmp_path / "chunk"
+    path.write_bytes(b"header|content of the chunk")
+    fake.script("/upload", (503, {"Retry-After": "1"}), (429, {"Retry-After": "1"}))
+    client = graph.GraphClient()
+    with open(path, "rb") as data:
+        data.seek(len(b"header|"))
+        response = client.put(f"{graph.GRAPH_URL}/upload", data=data,
+                              headers={"Content-Length": str(len(b"content of the chunk"))})
+
+    assert response.status_code == 200
+    assert fake.bodies("/upload") == [b"content of the chunk"] * 3
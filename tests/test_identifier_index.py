@@ -0,0 +1,97 @@
+import os
+
+import pytest
+
+import identifier_index
+import pdf
+from identifier_index import IdentifierIndex, find_matching_page_nums, get_identifier_index, set_identifier_index
+from page_cache import get_page_cache, set_page_cache
+from pdf_backend import PYMUPDF_BACKEND
+
+NAF_QUERY = "08/04135154-70"
+DNI_QUERY = "12345678Z"
+SALARY_TEXTS = [f"Treballador {NAF_QUERY} DNI {DNI_QUERY}", "Treballador 08/11111111-11", "", f"Total {NAF_QUERY}"]
+RNT_TEXTS = ["Treballador 08/11111111-11", f"Treballador {NAF_QUERY}"]
+
+
+class OtherBackend:
+    name = PYMUPDF_BACKEND
+
+
+@pytest.fixture
+def input_folder(tmp_path, write_text_pdf):
+    folder = tmp_path / "input"
+    (folder / "_salaries" / "2024").mkdir(parents=True)
+    (folder / "_RNT" / "2024").mkdir(parents=True)
+    write_text_pdf(folder / "_salaries" / "2024" / "2401_Nomines.pdf", SALARY_TEXTS)
+    write_text_pdf(folder / "_RNT" / "2024" / "2401_RNT.pdf", RNT_TEXTS)
+    return str(folder)
+
+
+@pytest.fixture
+def index(tmp_path):
+    previous_cache = get_page_cache()
+    previous_index = get_identifier_index()
+    set_page_cache(None)
+    index = IdentifierIndex(str(tmp_path / "cache" / identifier_index.IDENTIFIER_INDEX_FILENAME))
+    set_identifier_index(index)
+    yield index
+    set_identifier_index(previous_index)
+    set_page_cache(previous_cache)
+
+
+def salary_path(input_folder):
+    return os.path.join(input_folder, "_salaries", "2024", "2401_Nomines.pdf")
+
+
+def rnt_path(input_folder):
+    return os.path.join(input_folder, "_RNT", "2024", "2401_RNT.pdf")
+
+
+def test_build_indexes_the_identifiers(index, input_folder):
+    index.build(input_folder)
+
+    assert index.lookup(NAF_QUERY) == {salary_path(input_folder): [0, 3], rnt_path(input_folder): [1]}
+    assert index.lookup(DNI_QUERY, identifier_index.DNI_PATTERN) == {salary_path(input_folder): [0]}
+    assert index.lookup("99/99999999-99") == {}
+
+
+def test_changed_file_is_indexed_again(index, input_folder, write_text_pdf):
+    index.build(input_folder)
+    stat = os.stat(salary_path(input_folder))
+    write_text_pdf(salary_path(input_folder), list(reversed(SALARY_TEXTS)))
+    os.utime(salary_path(input_folder), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert not index.is_indexed(salary_path(input_folder))
+
+    assert index.lookup_file(salary_path(input_folder), NAF_QUERY) == [0, 3]
+    assert index.lookup_file(salary_path(input_folder), "08/11111111-11") == [2]
+    assert index.is_indexed(salary_path(input_folder))
+
+
+def test_removed_file_is_forgotten(index, input_folder):
+    index.build(input_folder)
+    os.remove(rnt_path(input_folder))
+    index.build(input_folder)
+
+    assert index.lookup(NAF_QUERY) == {salary_path(input_folder): [0, 3]}
+
+
+def test_files_are_indexed_again_with_another_backend(index, input_folder, monkeypatch):
+    index.build(input_folder)
+    assert index.is_indexed(salary_path(input_folder))
+
+    monkeypatch.setattr(identifier_index, "get_pdf_backend", OtherBackend)
+    assert not index.is_indexed(salary_path(input_folder))
+    index.ensure_file(salary_path(input_folder))
+    assert index.is_indexed(salary_path(input_folder))
+    monkeypatch.undo()
+    assert not index.is_indexed(salary_path(input_folder))
+
+
+@pytest.mark.parametrize("built", [True, False])
+def test_find_matching_page_nums_as_the_scan(index, input_folder, built):
+    if built:
+        index.build(input_folder)
+    for path in (salary_path(input_folder), rnt_path(input_folder)):
+        for query in (NAF_QUERY, "08/11111111-11", "99/99999999-99"):
+            assert find_matching_page_nums(path, query) == pdf.get_matching_page_nums(path, query)
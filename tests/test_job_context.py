@@ -0,0 +1,35 @@
+import logging
+import os
+
+import graph
+from job_context import JobContext
+
+
+class Args:
+    pass
+
+
+def test_loggers_of_finished_jobs_are_reused(tmp_path, monkeypatch):
+    def compute_paths(args, id_str, impersonal_id_str, output_root):
+        folder = tmp_path / id_str
+        return (str(folder), str(folder), str(folder / "user.log"), str(folder / "admin.log"),
+                str(folder / "supervisor.log"))
+
+    monkeypatch.setattr("job_context.compute_paths", compute_paths)
+    monkeypatch.setattr("job_context.ensure_file_structure", lambda folder, *others: os.makedirs(folder))
+    for i in range(3):
+        with JobContext(Args(), str(tmp_path)) as context:
+            context.open_output(f"job{str(i)}", f"job{str(i)}")
+            context.logger.info("working")
+    names = [name for name in logging.Logger.manager.loggerDict if name.startswith("justicier.job")]
+    assert len(names) == 1
+
+
+def test_graph_counters_belong_to_the_job(tmp_path):
+    client = graph.GraphClient()
+    client.count("requests")
+    with JobContext(Args(), str(tmp_path)) as context:
+        client.count("requests", 2)
+    client.count("requests")
+    assert context.graph_counters["requests"] == 2
+    assert client.get_counters()["requests"] == 4
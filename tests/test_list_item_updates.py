@@ -0,0 +1,48 @@
+import threading
+
+import pytest
+
+import sharepoint
+from job_context import JobContext
+
+
+class Args:
+    pass
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    sent = []
+    monkeypatch.setattr(sharepoint.ListItemUpdateBuffer, "send",
+                        staticmethod(lambda pending: sent.append((threading.current_thread().name, pending))))
+    return sent
+
+
+def test_jobs_only_flush_their_own_updates(sent, tmp_path):
+    both_queued = threading.Barrier(2)
+
+    def job(request):
+        with JobContext(Args(), str(tmp_path)):
+            sharepoint.update_list_item_field(request, {"Estatworkflow": "En execució"})
+            both_queued.wait()
+            sharepoint.flush_list_item_updates()
+
+    threads = [threading.Thread(target=job, args=(request,), name=request) for request in ("1", "2")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(sent) == [("1", {"1": {"Estatworkflow": "En execució"}}),
+                            ("2", {"2": {"Estatworkflow": "En execució"}})]
+
+
+def test_updates_of_a_failed_job_are_flushed_by_the_caller(sent, tmp_path):
+    with pytest.raises(ValueError):
+        with JobContext(Args(), str(tmp_path)):
+            sharepoint.update_list_item_field("1", {"Estatworkflow": "En execució"})
+            raise ValueError
+    sharepoint.update_list_item_field("1", {"Estatworkflow": "Error"})
+    sharepoint.flush_list_item_updates()
+
+    assert sent == [(threading.current_thread().name, {"1": {"Estatworkflow": "Error"}})]
@@ -0,0 +1,177 @@
+import os
+from datetime import datetime
+
+import pytest
+
+from NAF import NAF
+from arguments import parse_date
+from data import parse_date_from_salary_filename, parse_salary_filename_from_salary_path, parse_salary_type
+from defines import SalaryType
+from filesystem import flatten_dirs, list_dir
+from manifest import CONTRACT_CATEGORY, PROOF_CATEGORY, RNT_CATEGORY, SALARY_CATEGORY, Manifest, \
+    is_file_in_scope, is_folder_in_scope, parse_path_metadata
+
+NAF_EMPLOYEE = "080413515470"
+
+INPUT_FILES = [
+    "_salaries/2023/2312_Nomines.pdf",
+    "_salaries/2023/2312_Extres.pdf",
+    "_salaries/2024/2401_Nomines.pdf",
+    "_salaries/2024/2401_Atrasos.pdf",
+    "_salaries/2024/2402_Nomines.pdf",
+    "_salaries/2024/2403_Nomines.pdf",
+    "_salaries/2024/2404_Atrasos.pdf",
+    "_proofs/2023/122023_BBVA/transfer.pdf",
+    "_proofs/2024/012024_LA_CAIXA/1.pdf",
+    "_proofs/2024/012024_LA_CAIXA/2.pdf",
+    "_proofs/2024/032024_BBVA_endarreriments/transfer.pdf",
+    "_proofs/2024/032024_LA_CAIXA_EXTRA/transfer.pdf",
+    "_proofs/2024/042024_BBVA_FINIQUITO/settlement.pdf",
+    "_RNT/2023/2312_RNT.pdf",
+    "_RNT/2024/2401_RNT.pdf",
+    "_RNT/2024/2403_RNT.pdf",
+    "_RNT/2024/2404_RNT.pdf",
+    "_RLC/2023/12_L00N01.pdf",
+    "_RLC/2023/12_L13P01.pdf",
+    "_RLC/2024/01_L00N01.pdf",
+    "_RLC/2024/01_L03P02.pdf",
+    "_RLC/2024/03_L00P01.pdf",
+    "_RLC/2024/04_L03N01.pdf",
+    f"_contracts/{NAF_EMPLOYEE}_2301.pdf",  # Undefined contract
+    f"_contracts/{NAF_EMPLOYEE}_2201_2212.pdf",  # Ended before the justification
+    f"_contracts/{NAF_EMPLOYEE}_2403_2406.pdf",  # Begins in the last month
+    f"_contracts/{NAF_EMPLOYEE}_2312_A.pdf",  # Addenda
+    "_contracts/081111111111_2301.pdf",  # Another employee
+]
+
+# Begin and end of justifications, including the first and last day of a month and ranges inside a single month
+PERIODS = [
+    (datetime(2024, 1, 1), datetime(2024, 3, 31)),
+    (datetime(2024, 1, 15), datetime(2024, 3, 1)),
+    (datetime(2023, 12, 1), datetime(2023, 12, 1)),
+    (datetime(2023, 12, 2), datetime(2024, 1, 1)),
+    (datetime(2024, 4, 1), datetime(2024, 12, 31)),
+]
+
+
+@pytest.fixture
+def input_folder(tmp_path):
+    for relative_path in INPUT_FILES:
+        path = tmp_path / "input" / relative_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(relative_path.encode("utf-8"))
+    return str(tmp_path / "input")
+
+
+@pytest.fixture
+def manifest(input_folder, tmp_path):
+    manifest = Manifest(input_folder, str(tmp_path / "manifest.json"))
+    manifest.refresh()
+    return manifest
+
+
+# Selection of each stage before the manifest, from the listing of the folders and the names of the files
+
+def old_salaries(input_folder, begin, end):
+    selected = []
+    for salary_file in flatten_dirs(os.path.join(input_folder, "_salaries")):
+        dir_date = parse_date_from_salary_filename(parse_salary_filename_from_salary_path(salary_file))
+        if begin <= dir_date <= end:
+            selected.append("_salaries/" + salary_file)
+    return sorted(selected)
+
+
+def old_proofs(input_folder, begin, end):
+    proofs_folder = os.path.join(input_folder, "_proofs")
+    selected = []
+    for bankproof_folder in flatten_dirs(proofs_folder):
+        dir_date = parse_date(bankproof_folder.split("/")[1][:6], "%m%Y")
+        if begin <= dir_date <= end:
+            bank = "_".join(bankproof_folder.split("_")[1:])
+            for bankproof_file in list_dir(os.path.join(proofs_folder, bankproof_folder)):
+                selected.append(("_proofs/" + bankproof_folder + "/" + bankproof_file, bank, dir_date))
+    return sorted(selected)
+
+
+def old_contracts(input_folder, naf, begin, end):
+    selected = []
+    for contracts_file in sorted(list_dir(os.path.join(input_folder, "_contracts"))):
+        naf_dirty = NAF(contracts_file.split("_")[0])
+        dates = contracts_file.split(".")[0].split("_")
+        begin_date = parse_date("20" + dates[1], "%Y%m")
+        if len(dates) == 3 and dates[2] != "A":
+            end_date = parse_date("20" + dates[2], "%Y%m")
+        else:
+            end_date = datetime.max
+        if naf_dirty == naf and begin <= end_date and begin_date <= end:
+            selected.append("_contracts/" + contracts_file)
+    return selected
+
+
+def old_rnts(input_folder, begin, end):
+    selected = []
+    for rnt_file in sorted(flatten_dirs(os.path.join(input_folder, "_RNT"))):
+        file_date = parse_date("20" + rnt_file.split("/")[1][:4], "%Y%m", return_naive=True)
+        if begin <= file_date <= end:
+            selected.append("_RNT/" + rnt_file)
+    return selected
+
+
+def old_rlcs(input_folder, begin, end):
+    """RLCs are looked up in the year folder of each selected salary, by the month of the salary."""
+    selected = set()
+    for salary_file in old_salaries(input_folder, begin, end):
+        salary_date = parse_date_from_salary_filename(salary_file)
+        year_folder = os.path.join(input_folder, "_RLC", str(salary_date.year))
+        for rlc_file in list_dir(year_folder) if os.path.isdir(year_folder) else []:
+            if rlc_file.startswith(f"{salary_date.month:02d}_L"):
+                selected.add(f"_RLC/{str(salary_date.year)}/{rlc_file}")
+    return selected
+
+
+@pytest.mark.parametrize("relative_path", INPUT_FILES)
+def test_parse_path_metadata_matches_the_names(relative_path):
+    metadata = parse_path_metadata(relative_path)
+    assert metadata["period"] is not None
+    if metadata["category"] == SALARY_CATEGORY:
+        assert metadata["period"] == parse_date_from_salary_filename(relative_path)
+        assert SalaryType(metadata["salary_type"]) == parse_salary_type(relative_path)
+    elif metadata["category"] == CONTRACT_CATEGORY:
+        assert NAF(metadata["naf"]) == NAF(os.path.basename(relative_path).split("_")[0])
+
+
+@pytest.mark.parametrize("begin,end", PERIODS)
+def test_select_matches_the_stages(manifest, input_folder, begin, end):
+    assert [entry.relative_path for entry in manifest.select(SALARY_CATEGORY, begin, end)] == \
+           old_salaries(input_folder, begin, end)
+    assert [(entry.relative_path, entry.bank, entry.period) for entry in manifest.select(PROOF_CATEGORY, begin, end)] \
+           == old_proofs(input_folder, begin, end)
+    assert [entry.relative_path for entry in manifest.select(RNT_CATEGORY, begin, end)] == \
+           old_rnts(input_folder, begin, end)
+    # The contracts stage selects all the contracts and checks their NAF and period itself
+    naf = NAF(NAF_EMPLOYEE)
+    assert [entry.relative_path for entry in manifest.select(CONTRACT_CATEGORY)
+            if NAF(entry.naf) == naf and begin <= entry.period_end and entry.period <= end] == \
+           old_contracts(input_folder, naf, begin, end)
+
+
+@pytest.mark.parametrize("begin,end", PERIODS)
+def test_files_in_scope_are_the_ones_the_stages_read(input_folder, begin, end):
+    naf = NAF(NAF_EMPLOYEE)
+    read = set(old_salaries(input_folder, begin, end) + old_rnts(input_folder, begin, end) +
+               old_contracts(input_folder, naf, begin, end)) | old_rlcs(input_folder, begin, end)
+    read |= {relative_path for relative_path, bank, date in old_proofs(input_folder, begin, end)}
+    in_scope = {relative_path for relative_path in INPUT_FILES if is_file_in_scope(relative_path, begin, end, naf)}
+    assert read <= in_scope
+    # The RLCs of a month are kept even when its salary is missing, anything else is only kept if a stage reads it
+    assert {relative_path for relative_path in in_scope - read if not relative_path.startswith("_RLC/")} == set()
+
+
+@pytest.mark.parametrize("begin,end", PERIODS)
+def test_year_folders_in_scope(begin, end):
+    for relative_path in INPUT_FILES:
+        folder = "/".join(relative_path.split("/")[:2])
+        if folder.startswith("_contracts"):
+            assert is_folder_in_scope(folder, begin, end)
+        else:
+            assert is_folder_in_scope(folder, begin, end) == (begin.year <= int(folder.split("/")[1]) <= end.year)
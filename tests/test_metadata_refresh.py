@@ -0,0 +1,59 @@
+import pytest
+import requests
+from requests.exceptions import HTTPError
+
+import metadata_cache
+import sharepoint
+
+
+def not_found():
+    response = requests.Response()
+    response.status_code = 404
+    return HTTPError(response=response)
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    previous = metadata_cache.get_metadata_cache()
+    cache = metadata_cache.MetadataCache(str(tmp_path / "metadata.json"))
+    cache.update({"site:domain/site": "site-1", "list:site-1/requests": "list-1",
+                  "user_email:Garcia, Juan": "juan@iciq.es"})
+    metadata_cache.set_metadata_cache(cache)
+    monkeypatch.setattr(sharepoint, "get_token_manager", lambda: None)
+    monkeypatch.setattr(sharepoint, "request_list_id", lambda token_manager, site_id, list_name: "list-1")
+    yield cache
+    metadata_cache.set_metadata_cache(previous)
+
+
+def test_not_found_item_keeps_the_cache(cache, monkeypatch):
+    monkeypatch.setattr(sharepoint, "request_site_id", lambda token_manager, domain, site_name: "site-1")
+    calls = []
+
+    @sharepoint.refresh_metadata_on_not_found
+    def get_item():
+        calls.append(1)
+        raise not_found()
+
+    with pytest.raises(HTTPError):
+        get_item()
+    assert len(calls) == 1
+    assert cache.get("site:domain/site") == "site-1"
+    assert cache.get("user_email:Garcia, Juan") == "juan@iciq.es"
+
+
+def test_recreated_site_is_resolved_again(cache, monkeypatch):
+    monkeypatch.setattr(sharepoint, "request_site_id", lambda token_manager, domain, site_name: "site-2")
+    calls = []
+
+    @sharepoint.refresh_metadata_on_not_found
+    def get_item():
+        calls.append(1)
+        if len(calls) == 1:
+            raise not_found()
+        return "item"
+
+    assert get_item() == "item"
+    assert len(calls) == 2
+    assert cache.get("site:domain/site") is None
+    assert cache.get("list:site-1/requests") == "list-1"
+    assert cache.get("user_email:Garcia, Juan") == "juan@iciq.es"
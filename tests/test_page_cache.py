@@ -0,0 +1,115 @@
+import os
+from contextlib import closing
+
+import pytest
+
+import page_cache
+import pdf
+from page_cache import PageTextCache, get_page_cache, set_page_cache
+from pdf_backend import PYMUPDF_BACKEND
+
+NAF_QUERY = "08/04135154-70"
+TEXTS = [f"Treballador {NAF_QUERY}", "Treballador 08/11111111-11", "", f"Total {NAF_QUERY}"]
+
+
+class Extractor:
+    def __init__(self):
+        self.paths = []
+
+    def __call__(self, path):
+        self.paths.append(path)
+        return pdf.extract_page_texts(path)
+
+
+class OtherBackend:
+    name = PYMUPDF_BACKEND
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return PageTextCache(str(tmp_path / "cache" / page_cache.PAGE_CACHE_FILENAME))
+
+
+@pytest.fixture
+def document(tmp_path, write_text_pdf):
+    return write_text_pdf(tmp_path / "2401_Nomines.pdf", TEXTS)
+
+
+def test_texts_are_extracted_once(cache, document):
+    extract = Extractor()
+    texts = cache.get_or_extract(document, extract)
+    assert cache.get_or_extract(document, extract) == texts
+    assert extract.paths == [document]
+    assert [text.strip() for text in texts] == TEXTS
+
+
+@pytest.mark.parametrize("new_texts,same_mtime", [
+    (TEXTS + ["Annex"], True),  # Only the size tells the change
+    (list(reversed(TEXTS)), False),  # Same size, only the mtime tells the change
+])
+def test_changed_content_is_extracted_again(cache, document, write_text_pdf, new_texts, same_mtime):
+    extract = Extractor()
+    cache.get_or_extract(document, extract)
+    stat = os.stat(document)
+    write_text_pdf(document, new_texts)
+    if same_mtime:
+        os.utime(document, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    else:
+        os.utime(document, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        assert os.stat(document).st_size == stat.st_size
+
+    texts = cache.get_or_extract(document, extract)
+    assert extract.paths == [document, document]
+    assert [text.strip() for text in texts] == new_texts
+
+
+def test_touched_file_keeps_its_texts(cache, document, monkeypatch):
+    extract = Extractor()
+    cache.get_or_extract(document, extract)
+    hashed = []
+    compute_file_hash = page_cache.compute_file_hash
+    monkeypatch.setattr(page_cache, "compute_file_hash", lambda path: hashed.append(path) or compute_file_hash(path))
+    cache.get_or_extract(document, extract)
+    assert hashed == []
+
+    stat = os.stat(document)
+    os.utime(document, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    cache.get_or_extract(document, extract)
+    # The new mtime makes the file hashed again, but its content is known
+    assert hashed == [os.path.abspath(document)]
+    assert extract.paths == [document]
+
+
+def test_texts_belong_to_their_backend(cache, document, monkeypatch):
+    cache.get_or_extract(document, Extractor())
+    monkeypatch.setattr(page_cache, "get_pdf_backend", OtherBackend)
+    assert cache.get_page_texts(document) is None
+
+    cache.store_page_texts(document, ["other layout"] * len(TEXTS))
+    assert cache.get_page_texts(document) == ["other layout"] * len(TEXTS)
+    monkeypatch.undo()
+    assert [text.strip() for text in cache.get_page_texts(document)] == TEXTS
+
+
+def test_older_schema_is_emptied(cache, document):
+    cache.get_or_extract(document, Extractor())
+    with closing(cache._connect()) as conn, conn:
+        conn.execute("PRAGMA user_version = 0")
+    assert PageTextCache(cache.db_path).get_page_texts(document) is None
+
+
+def test_matching_page_nums_with_and_without_cache(cache, document, write_text_pdf):
+    previous_cache = get_page_cache()
+    try:
+        set_page_cache(None)
+        expected = pdf.get_matching_page_nums(document, NAF_QUERY)
+        assert expected == [0, 3]
+        set_page_cache(cache)
+        assert pdf.get_matching_page_nums(document, NAF_QUERY) == expected  # Extracted and stored
+        assert cache.get_page_texts(document) is not None
+        assert pdf.get_matching_page_nums(document, NAF_QUERY) == expected  # From the cache
+
+        write_text_pdf(document, [TEXTS[1], TEXTS[0]])
+        assert pdf.get_matching_page_nums(document, NAF_QUERY) == [1]
+    finally:
+        set_page_cache(previous_cache)
@@ -0,0 +1,39 @@
+import pytest
+
+import poller
+
+
+def make_item(request, state=None):
+    fields = {"id": request, "Title": f"Request {request}", "SolicitantEmail": "author@iciq.es"}
+    if state:
+        fields["Estatworkflow"] = state
+    return {"id": request, "fields": fields}
+
+
+class PollerStopped(Exception):
+    pass
+
+
+def test_poller_that_stops_halfway_does_not_submit_again(tmp_path, monkeypatch):
+    items = [make_item("1", "Completat"), make_item("2"), make_item("3"), make_item("4", "Pendent")]
+    monkeypatch.setattr(poller, "read_secret", lambda name: name)
+    monkeypatch.setattr(poller, "get_requests_from_list", lambda *args, **kwargs: items)
+    submitted_jobs = []
+    stop_after = [2]
+
+    def submit_job(queue_folder, argv, config):
+        if len(submitted_jobs) == stop_after[0]:
+            raise PollerStopped
+        submitted_jobs.append(argv[1])
+        return f"job{argv[1]}.json"
+
+    monkeypatch.setattr(poller, "submit_job", submit_job)
+    state_path = str(tmp_path / "submitted.json")
+    with pytest.raises(PollerStopped):
+        poller.poll(str(tmp_path), poller.load_submitted(state_path), state_path)
+    assert poller.load_submitted(state_path) == {"2", "3"}
+
+    stop_after[0] = None
+    submitted = poller.poll(str(tmp_path), poller.load_submitted(state_path), state_path)
+    assert submitted_jobs == ["2", "3", "4"]
+    assert submitted == {"2", "3", "4"}
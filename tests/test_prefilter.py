@@ -0,0 +1,104 @@
+import pytest
+from pypdf import PdfWriter
+from pypdf.generic import ArrayObject, DictionaryObject, NameObject, NumberObject, StreamObject
+
+import pdf
+
+
+def make_page(font: DictionaryObject, writer: PdfWriter = None, text=b"(08/04135154-70) Tj"):
+    writer = writer or PdfWriter()
+    page = writer.add_blank_page(612, 792)
+    page[NameObject("/Resources")] = DictionaryObject({
+        NameObject("/Font"): DictionaryObject({NameObject("/F1"): writer._add_object(font)})
+    })
+    contents = StreamObject()
+    contents.set_data(b"BT /F1 12 Tf 10 10 Td " + text + b" ET")
+    page[NameObject("/Contents")] = writer._add_object(contents)
+    return page
+
+
+def simple_font(**entries) -> DictionaryObject:
+    font = DictionaryObject({NameObject("/Type"): NameObject("/Font"),
+                             NameObject("/Subtype"): NameObject("/Type1"),
+                             NameObject("/BaseFont"): NameObject("/Helvetica")})
+    for name, value in entries.items():
+        font[NameObject("/" + name)] = value
+    return font
+
+
+def differences() -> DictionaryObject:
+    return DictionaryObject({NameObject("/Type"): NameObject("/Encoding"),
+                             NameObject("/Differences"): ArrayObject([NumberObject(48), NameObject("/five")])})
+
+
+def test_standard_encoding_is_decidable():
+    page = make_page(simple_font(Encoding=NameObject("/WinAnsiEncoding")))
+    assert pdf.is_prefilter_decidable(page)
+    assert pdf.page_may_contain(page, "08/04135154-70")
+    assert not pdf.page_may_contain(page, "08/11111111-11")
+
+
+def test_direct_differences_are_undecidable():
+    assert not pdf.is_prefilter_decidable(make_page(simple_font(Encoding=differences())))
+
+
+def test_indirect_differences_are_undecidable():
+    writer = PdfWriter()
+    page = make_page(simple_font(Encoding=writer._add_object(differences())), writer)
+    assert not pdf.is_prefilter_decidable(page)
+    assert pdf.page_may_contain(page, "08/11111111-11")
+
+
+def to_unicode(writer: PdfWriter, first: bytes, last: bytes, unicode: bytes):
+    """ToUnicode map of the codes from first to last to the characters from unicode on."""
+    cmap = StreamObject()
+    cmap.set_data(b"/CIDInit /ProcSet findresource begin 12 dict begin begincmap\n"
+                  b"1 begincodespacerange\n<00> <FF>\nendcodespacerange\n"
+                  b"1 beginbfrange\n<" + first + b"> <" + last + b"> <" + unicode + b">\nendbfrange\n"
+                  b"endcmap CMapName currentdict /CMap defineresource pop end end")
+    return writer._add_object(cmap)
+
+
+def test_to_unicode_codes_are_mapped():
+    writer = PdfWriter()
+    # Letters A to J are shown as the digits 0 to 9
+    page = make_page(simple_font(ToUnicode=to_unicode(writer, b"41", b"4A", b"0030")), writer,
+                     b"(AI/AEBDFBFE-HA) Tj")
+    assert "08/04135154-70" in page.extract_text()
+    assert pdf.is_prefilter_decidable(page)
+    assert pdf.page_may_contain(page, "08/04135154-70")
+    assert not pdf.page_may_contain(page, "08/11111111-11")
+
+
+def test_to_unicode_can_hide_digits():
+    writer = PdfWriter()
+    # Digits are shown as the letters A to J
+    page = make_page(simple_font(ToUnicode=to_unicode(writer, b"30", b"39", b"0041")), writer)
+    assert "08/04135154-70" not in page.extract_text()
+    assert not pdf.page_may_contain(page, "08/04135154-70")
+
+
+def test_to_unicode_applies_to_the_strings_of_its_font():
+    writer = PdfWriter()
+    page = make_page(simple_font(ToUnicode=to_unicode(writer, b"41", b"4A", b"0030")), writer,
+                     b"(AI) Tj /F2 12 Tf (/04135154-70) Tj /F1 12 Tf (HA) Tj")
+    page["/Resources"]["/Font"][NameObject("/F2")] = writer._add_object(simple_font())
+    assert pdf.page_may_contain(page, "08/04135154-70")
+    assert not pdf.page_may_contain(page, "70/04135154-08")
+
+
+def test_unparsable_to_unicode_is_undecidable(monkeypatch):
+    def get_encoding(font):
+        raise ValueError
+
+    writer = PdfWriter()
+    page = make_page(simple_font(ToUnicode=to_unicode(writer, b"41", b"4A", b"0030")), writer)
+    monkeypatch.setattr(pdf, "get_font_encoding", get_encoding)
+    assert not pdf.is_prefilter_decidable(page)
+
+
+@pytest.mark.parametrize("subtype", ["/Type0", "/Type3", "/CIDFontType2"])
+def test_composite_and_type3_fonts_are_undecidable(subtype):
+    font = simple_font()
+    font[NameObject("/Subtype")] = NameObject(subtype)
+    assert not pdf.is_prefilter_decidable(make_page(font))
@@ -0,0 +1,37 @@
+import pytest
+
+import quick_xor_hash
+
+# quickXorHash of Graph for these contents, given by the reference implementation of Microsoft (QuickXorHash.cs)
+KNOWN_HASHES = [
+    (b"", "AAAAAAAAAAAAAAAAAAAAAAAAAAA="),
+    (b"Hello, world!", "SCgDG9jwBhaA4A5vnQMbyBACAAA="),
+    # The shifts of the bytes wrap around the 160 bits of the state
+    (bytes(range(159)), "/+EGLlnQi0dVs5OEknWhEnz5Ih0="),
+    (bytes(range(160)), "/+EGLlnQi0dVs5OErXWhEnz5wg4="),
+    (bytes(range(161)), "X+EGLlnQi0dVs5OErHWhEnz5wg4="),
+    (bytes(i * 7 % 256 for i in range(1000)), "1+af4JAt6vicGNPjpE3HUFtNbW0="),
+]
+
+
+@pytest.fixture(params=["numpy", "python"])
+def folding(request, monkeypatch):
+    if request.param == "python":
+        monkeypatch.setattr(quick_xor_hash, "np", None)
+    elif quick_xor_hash.np is None:
+        pytest.skip("numpy is not installed")
+    return request.param
+
+
+@pytest.mark.parametrize("content,expected", KNOWN_HASHES)
+def test_known_hashes(tmp_path, folding, content, expected):
+    path = tmp_path / "file"
+    path.write_bytes(content)
+    assert quick_xor_hash.compute_quick_xor_hash(str(path)) == expected
+
+
+@pytest.mark.parametrize("content,expected", KNOWN_HASHES)
+def test_hash_does_not_depend_on_the_chunks(tmp_path, folding, content, expected):
+    path = tmp_path / "file"
+    path.write_bytes(content)
+    assert quick_xor_hash.compute_quick_xor_hash(str(path), chunk_size=quick_xor_hash.QUICK_XOR_WIDTH) == expected
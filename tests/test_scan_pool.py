@@ -0,0 +1,67 @@
+import pytest
+
+import pdf
+from defines import NAF_PATTERN
+from page_cache import get_page_cache, set_page_cache
+
+NAF_QUERY = "08/04135154-70"
+
+
+def page_text(page_num):
+    if page_num % 7 == 3:
+        return f"Treballador {NAF_QUERY}, pagina {str(page_num)}"
+    if page_num % 5 == 0:
+        return "Treballador 08/11111111-11"
+    return ""
+
+
+@pytest.fixture
+def documents(tmp_path, write_text_pdf):
+    """A document of several scan tasks, with the last one shorter, and a document smaller than a task."""
+    return [write_text_pdf(tmp_path / "big.pdf", [page_text(page_num) for page_num in range(60)]),
+            write_text_pdf(tmp_path / "small.pdf", [page_text(page_num) for page_num in range(9)])]
+
+
+@pytest.fixture
+def scan_settings():
+    previous_cache = get_page_cache()
+    previous_workers = pdf.scan_workers
+    previous_prefilter = pdf.prefilter_enabled
+    set_page_cache(None)
+    pdf.set_prefilter(False)
+    yield
+    pdf.set_scan_workers(previous_workers)
+    pdf.set_prefilter(previous_prefilter)
+    set_page_cache(previous_cache)
+
+
+def test_split_scan_tasks(documents):
+    big, small = documents
+    assert pdf.split_scan_tasks(documents) == [(big, 0, 25), (big, 25, 50), (big, 50, 60), (small, 0, 9)]
+
+
+def test_scan_pool_finds_the_pages_of_the_serial_scan(documents, scan_settings):
+    serial = {pdf_path: pdf.scan_page_range(pdf_path, 0, pdf.get_page_count(pdf_path), NAF_QUERY, NAF_PATTERN)
+              for pdf_path in documents}
+    assert serial[documents[0]] == [page_num for page_num in range(60) if page_num % 7 == 3]
+
+    pdf.set_scan_workers(2)
+    tasks = pdf.split_scan_tasks(documents)
+    futures = [pdf.get_scan_pool().submit(pdf.scan_page_range, *task, NAF_QUERY, NAF_PATTERN) for task in tasks]
+    pooled = {pdf_path: [] for pdf_path in documents}
+    for task, future in zip(tasks, futures):
+        pooled[task[0]].extend(future.result())
+    assert pooled == serial
+
+
+def test_matching_page_nums_with_and_without_workers(documents, scan_settings):
+    serial = [pdf.get_matching_page_nums(pdf_path, NAF_QUERY) for pdf_path in documents]
+    pdf.set_scan_workers(2)
+    assert [pdf.get_matching_page_nums(pdf_path, NAF_QUERY) for pdf_path in documents] == serial
+
+
+def test_page_texts_with_and_without_workers(documents, scan_settings):
+    serial = pdf.extract_many_page_texts(documents)
+    assert len(serial[documents[0]]) == 60
+    pdf.set_scan_workers(2)
+    assert pdf.extract_many_page_texts(documents) == serial
@@ -0,0 +1,112 @@
+import threading
+
+import pytest
+from pypdf import PdfWriter
+
+import pdf
+import pdf_backend
+
+
+class CountingBackend(pdf_backend.PypdfBackend):
+    """pypdf backend that records which readers are open."""
+
+    def __init__(self):
+        self.open_documents = set()
+        self.closed = 0
+
+    def open(self, pdf_path):
+        document = super().open(pdf_path)
+        self.open_documents.add(id(document))
+        return document
+
+    def close(self, document):
+        self.open_documents.remove(id(document))
+        self.closed += 1
+
+
+@pytest.fixture
+def backend():
+    previous = pdf_backend.get_pdf_backend()
+    backend = CountingBackend()
+    pdf_backend.get_pdf_backend._instance = backend
+    yield backend
+    pdf.share_readers(False)
+    pdf_backend.get_pdf_backend._instance = previous
+
+
+def make_pdfs(folder, count, pages=2):
+    paths = []
+    for i in range(count):
+        writer = PdfWriter()
+        for _ in range(pages):
+            writer.add_blank_page(100, 100)
+        path = str(folder / f"{i:02d}.pdf")
+        with open(path, "wb") as f:
+            writer.write(f)
+        paths.append(path)
+    return paths
+
+
+def test_open_readers_never_exceed_the_maximum(tmp_path, backend):
+    pdf.set_max_open_readers(3)
+    pdf.share_readers(True)
+    output_folder = tmp_path / "output"
+    output_folder.mkdir()
+    inputs = make_pdfs(tmp_path, 12)
+
+    for round_number in range(2):
+        for path in inputs:
+            for page, page_num in pdf.get_pages(path, [0, 1]):
+                pdf.write_page(page, str(output_folder / f"{round_number}_{page_num}_{path[-6:]}"))
+            assert len(backend.open_documents) <= 3
+            assert pdf.shared_readers.count() <= 3
+
+    pdf.release_pdf()
+    pdf.share_readers(False)
+    assert len(backend.open_documents) == 0
+
+
+def test_reader_in_use_by_another_thread_is_not_closed(tmp_path, backend):
+    pdf.set_max_open_readers(1)
+    pdf.share_readers(True)
+    first, second, third = make_pdfs(tmp_path, 3)
+    opened = threading.Event()
+    done = threading.Event()
+    pages = []
+
+    def use_first():
+        pages.extend(pdf.get_pages(first, [0]))
+        opened.set()
+        done.wait()
+        pdf.release_pdf()
+
+    thread = threading.Thread(target=use_first)
+    thread.start()
+    opened.wait()
+    # The only reader is leased by the other thread, it stays open until the thread is done with its pages
+    pdf.get_pages(second, [0])
+    pdf.get_pages(third, [0])
+    assert len(backend.open_documents) == 2
+    done.set()
+    thread.join()
+    assert len(backend.open_documents) == 1
+    assert pdf.shared_readers.count() == 1
+
+
+def test_compaction_reopens_the_inputs_within_the_maximum(tmp_path, backend):
+    pdf.set_max_open_readers(2)
+    pdf.share_readers(True)
+    output_folder = tmp_path / "output"
+    output_folder.mkdir()
+    inputs = make_pdfs(tmp_path, 6)
+    for path in inputs:
+        for page, page_num in pdf.get_pages(path, [0, 1]):
+            pdf.write_page(page, str(output_folder / f"{path[-6:-4]}_{page_num}.pdf"))
+
+    written = sorted(str(path) for path in output_folder.iterdir())
+    assert pdf.get_output_assembler().get_sources(written) is not None
+
+    pdf.compact_folder(str(output_folder))
+
+    assert len(pdf_backend.PdfReader(str(tmp_path / "output.pdf")).pages) == 12
+    assert len(backend.open_documents) <= 2
@@ -0,0 +1,68 @@
+import threading
+import time
+
+import pytest
+
+from main import Stage, run_stage_graph
+
+
+class Recorder:
+    def __init__(self):
+        self.events = []
+        self.lock = threading.Lock()
+
+    def stage(self, name, after=(), duration=0.0, error=None):
+        def run():
+            with self.lock:
+                self.events.append(("start", name))
+            time.sleep(duration)
+            if error is not None:
+                raise error
+            with self.lock:
+                self.events.append(("end", name))
+        return Stage(name, run, after)
+
+    def index(self, event, name):
+        return self.events.index((event, name))
+
+
+def test_stages_start_after_the_stages_they_depend_on():
+    recorder = Recorder()
+    stages = [recorder.stage("merge", ("salaries", "proofs")),
+              recorder.stage("salaries", duration=0.05),
+              recorder.stage("proofs", duration=0.02),
+              recorder.stage("compact", ("merge",))]
+    run_stage_graph(stages, workers=4)
+
+    assert recorder.index("start", "merge") > recorder.index("end", "salaries")
+    assert recorder.index("start", "merge") > recorder.index("end", "proofs")
+    assert recorder.index("start", "compact") > recorder.index("end", "merge")
+    # Independent stages run at the same time
+    assert recorder.index("start", "proofs") < recorder.index("end", "salaries")
+
+
+def test_failure_drops_the_stages_not_started():
+    recorder = Recorder()
+    error = RuntimeError("contracts failed")
+    stages = [recorder.stage("contracts", error=error),
+              recorder.stage("compact contracts", ("contracts",)),
+              recorder.stage("salaries", duration=0.05)]
+    with pytest.raises(RuntimeError) as raised:
+        run_stage_graph(stages, workers=2)
+
+    assert raised.value is error
+    assert ("start", "compact contracts") not in recorder.events
+    # Running stages are not interrupted
+    assert ("end", "salaries") in recorder.events
+
+
+@pytest.mark.parametrize("stages", [
+    [Stage("merge", lambda: None, ("missing",))],
+    [Stage("a", lambda: None, ("b",)), Stage("b", lambda: None, ("a",))],
+])
+def test_invalid_dependencies_run_nothing(stages):
+    recorder = Recorder()
+    stages = stages + [recorder.stage("salaries")]
+    with pytest.raises(ValueError):
+        run_stage_graph(stages, workers=2)
+    assert recorder.events == []
@@ -0,0 +1,56 @@
+import threading
+import time
+
+import TokenManager
+
+
+def run_together(target, count=8):
+    start = threading.Barrier(count)
+
+    def run():
+        start.wait()
+        target()
+
+    threads = [threading.Thread(target=run) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def new_manager(tmp_path):
+    manager = TokenManager.TokenManager("tenant", "client", "secret", cache_path=str(tmp_path / "token.json"))
+    # Fresh for a day, so no token is requested
+    manager.access_token = "token"
+    manager.expires_at = time.time() + 24 * 3600
+    return manager
+
+
+def test_a_single_token_manager_is_created(tmp_path, monkeypatch):
+    created = []
+
+    def create():
+        time.sleep(0.05)  # The other threads check the singleton while it is created
+        created.append(new_manager(tmp_path))
+        return created[-1]
+
+    monkeypatch.setattr(TokenManager, "_create_token_manager", create)
+    monkeypatch.delattr(TokenManager.get_token_manager, "_instance", raising=False)
+    managers = []
+    try:
+        run_together(lambda: managers.append(TokenManager.get_token_manager()))
+    finally:
+        del TokenManager.get_token_manager._instance
+
+    assert len(created) == 1
+    assert all(manager is created[0] for manager in managers)
+
+
+def test_a_single_refresh_thread_is_started(tmp_path):
+    manager = new_manager(tmp_path)
+    refreshes = []
+    manager._refresh_periodically = lambda: refreshes.append(threading.current_thread())
+    run_together(manager.start_background_refresh)
+    manager.refresh_thread.join()
+
+    assert refreshes == [manager.refresh_thread]
@@ -0,0 +1,23 @@
+import os
+
+import worker
+
+
+def test_claimed_job_is_owned_by_the_worker(tmp_path):
+    queue = str(tmp_path)
+    job_name = worker.submit_job(queue, ["--naf", "08/04135154-70"])
+    assert worker.claim_next_job(queue) == job_name
+    # The owner is known from the claim itself, before the worker writes anything into the job
+    worker.fail_abandoned_jobs(queue)
+    assert os.listdir(os.path.join(queue, worker.RUNNING)) == [f"{str(os.getpid())}-{job_name}"]
+    assert os.listdir(os.path.join(queue, worker.FAILED)) == []
+
+
+def test_jobs_of_stopped_workers_fail(tmp_path, monkeypatch):
+    queue = str(tmp_path)
+    job_name = worker.submit_job(queue, ["--naf", "08/04135154-70"])
+    worker.claim_next_job(queue)
+    monkeypatch.setattr(worker, "is_process_alive", lambda pid: False)
+    worker.fail_abandoned_jobs(queue)
+    assert os.listdir(os.path.join(queue, worker.RUNNING)) == []
+    assert "error" in worker.read_job(worker.get_job_path(queue, worker.FAILED, job_name))